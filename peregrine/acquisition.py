@@ -13,6 +13,12 @@ to satellite acquisition.
 
 """
 
+import os
+import fcntl
+import hashlib
+import tempfile
+import contextlib
+import multiprocessing as mp
 import numpy as np
 import pyfftw
 import cPickle
@@ -29,6 +35,21 @@ DEFAULT_WISDOM_FILE = "fftw_wisdom"
 DEFAULT_THRESHOLD = 20.0
 """The default correlation power to consider an acquisition successful."""
 
+THREADED_FFT_MIN_SIZE = 1 << 15
+"""The smallest transform size that :func:`plan_parallelism` splits across
+threads. FFTW threads only pay off for transforms of tens of thousands of
+points and this is a conservative guess rather than a measurement, check it on
+the target machine with ``peregrine-benchmark parallelism``."""
+
+DEFAULT_CODE_CACHE_DIR = None
+"""The default directory for on-disk code spectrum caches, `None` to only
+cache code spectra in memory."""
+
+BATCH_CHUNK_BYTES = 1 << 25
+"""Approximate size in bytes of each of the input and output arrays of the
+batched inverse FFT used by :meth:`Acquisition.acquire` with `batch` set, the
+frequencies searched are split into chunks of this size."""
+
 # Import progressbar if it is available.
 _progressbar_available = True
 try:
@@ -71,6 +92,53 @@ class Acquisition:
     operations required on the current hardware. Using FFTW wisdom greatly
     reduces the time required to perform an acquisition. If `wisdom_file` is
     `None` then no wisdom file is loaded or saved.
+  code_cache_dir : string or `None`, optional
+    Directory in which to store the Fourier transforms of the upsampled codes
+    so that they are only computed once per set of sampling parameters. The
+    transforms are always cached in memory, if `code_cache_dir` is `None` they
+    are not also stored on disk. See :class:`CodeSpectrumCache`.
+  batch : bool, optional
+    If `True`, :meth:`acquire` builds the Doppler-shifted spectra for all
+    offsets and a chunk of frequencies as a single array and correlates them
+    with one multi-dimensional inverse FFT instead of one small FFT per
+    frequency bin. The chunks are limited to about `BATCH_CHUNK_BYTES` so the
+    extra memory used is bounded. Whether this is faster depends on the
+    machine, gains of around 10% have been measured but it can also be
+    slower, so it is worth benchmarking before enabling.
+  threads : int or `None`, optional
+    Number of threads used by each FFTW plan. The default is one thread, with
+    :meth:`acquisition` spreading the PRNs over parallel processes instead.
+    Multithreading is opt-in: if `None` then the number of threads is chosen
+    by :func:`plan_parallelism` from the transform size, the number of CPUs
+    and the number of PRNs, and the FFTs are re-planned by
+    :meth:`acquisition` for the number of PRNs it is given. When more than
+    one thread is used, :meth:`acquisition` acquires PRNs in this process
+    rather than in parallel processes.
+  real : bool or `None`, optional
+    If `True` the samples are real valued and their spectra are computed with
+    real-to-complex FFTs, which take roughly half the time and memory of a
+    complex FFT. If `None` then this is decided from the type of `samples`,
+    defaulting to complex if `samples` is `None`.
+  dtype : {`numpy.complex128`, `numpy.complex64`}, optional
+    Complex type used for the FFTs and correlation buffers. With
+    `numpy.complex64` single-precision FFTW plans are used and the results
+    grids are `numpy.float32`, halving the memory used. The input samples are
+    only a few bits so the detected code phase and Doppler are not affected.
+    It is not always faster, with 4 ms integrations it has been measured at
+    193 ms per PRN against 221 ms for `numpy.complex128` on one machine but
+    at 247 ms against 202 ms on another, see
+    :func:`peregrine.analysis.benchmark.acquisition_precision`.
+  fft_size : {`None`, 'pad', 'resample'} or int, optional
+    FFTs whose length has large prime factors are slow and
+    `n_codes_integrate * samples_per_code` is often such a length. If
+    `'pad'`, the FFT length is increased to the next product of 2, 3, 5 and 7
+    that is at least one code period longer than the integration and the code
+    replica is zero-padded, so the correlation is computed without any
+    wrap-around. If `'resample'`, the samples are resampled (by nearest
+    neighbour) to the next such length at least `n_integrate` long and the
+    code phase axis is mapped back to the original samples. An integer is
+    used as the padded FFT length. If `None` the FFT length is `n_integrate`.
+    The chosen length is stored in the `fft_size` attribute.
 
   """
 
@@ -82,7 +150,13 @@ class Acquisition:
                code_length=defaults.code_length,
                n_codes_integrate=4,
                offsets = None,
-               wisdom_file=DEFAULT_WISDOM_FILE):
+               wisdom_file=DEFAULT_WISDOM_FILE,
+               code_cache_dir=DEFAULT_CODE_CACHE_DIR,
+               batch=False,
+               threads=1,
+               real=None,
+               dtype=np.complex128,
+               fft_size=None):
 
     self.sampling_freq = sampling_freq
     self.IF = IF
@@ -90,6 +164,58 @@ class Acquisition:
     self.n_integrate = n_codes_integrate * self.samples_per_code
     self.code_length = code_length
     self.samples_per_chip = float(samples_per_code) / code_length
+    self.wisdom_file = wisdom_file
+    self.code_cache_dir = code_cache_dir
+
+    # Choose the FFT length, `resample_ratio` is the ratio of the sampling
+    # frequency used in the FFTs to `sampling_freq`.
+    self.resample_ratio = 1.0
+    if fft_size is None:
+      self.fft_size = self.n_integrate
+      self.fft_size_mode = None
+    elif fft_size == 'pad':
+      self.fft_size = next_fast_len(self.n_integrate + self.samples_per_code)
+      self.fft_size_mode = 'pad'
+    elif fft_size == 'resample':
+      self.fft_size = next_fast_len(self.n_integrate)
+      self.fft_size_mode = 'resample'
+      self.resample_ratio = float(self.fft_size) / self.n_integrate
+    elif fft_size >= self.n_integrate + self.samples_per_code:
+      self.fft_size = int(fft_size)
+      self.fft_size_mode = 'pad'
+    else:
+      raise ValueError("FFT size must be at least n_integrate + "
+                       "samples_per_code (%d) to pad the correlation." %
+                       (self.n_integrate + self.samples_per_code))
+    if self.fft_size != self.n_integrate:
+      logger.info("Using FFT size %d (%s) for %d samples of integration.",
+                  self.fft_size, self.fft_size_mode, self.n_integrate)
+
+    # Indices of the correlation output corresponding to each code phase in
+    # samples, only needed when resampling.
+    if self.fft_size_mode == 'resample':
+      self.code_phase_indices = np.asarray(
+        np.round(np.arange(self.samples_per_code) * self.resample_ratio),
+        dtype=np.int)
+    else:
+      self.code_phase_indices = None
+    self.batch = batch
+    self.code_cache = get_code_spectrum_cache(code_cache_dir)
+
+    # With automatic threading, plan for acquiring a single PRN until
+    # `acquisition` is given the PRNs to search.
+    self.auto_threads = threads is None
+    if threads is None:
+      threads, _ = plan_parallelism(self.fft_size, 1)
+
+    if real is None:
+      real = samples is not None and not np.iscomplexobj(samples)
+    self.real = real
+
+    self.dtype = np.dtype(dtype)
+    if self.dtype not in (np.complex64, np.complex128):
+      raise ValueError("Unsupported acquisition dtype '%s'" % self.dtype)
+    self.real_dtype = np.empty(0, self.dtype).real.dtype
 
     if offsets is None:
       if n_codes_integrate <= 10:
@@ -106,6 +232,16 @@ class Acquisition:
                          + "offsets. Specify them or generalize the technique.")
     self.offsets = offsets
 
+    # The constructor arguments, except the samples and threads, so that the
+    # worker processes of `acquisition` can create an identical object.
+    self.kwargs = dict(sampling_freq=sampling_freq, IF=IF,
+                       samples_per_code=samples_per_code,
+                       code_length=code_length,
+                       n_codes_integrate=n_codes_integrate,
+                       offsets=list(offsets), wisdom_file=wisdom_file,
+                       code_cache_dir=code_cache_dir, batch=batch, real=real,
+                       dtype=self.dtype, fft_size=fft_size)
+
     # Try to load saved FFTW wisdom.
     if wisdom_file is not None:
       try:
@@ -114,32 +250,91 @@ class Acquisition:
         logger.warning("Couldn't open FFTW wisdom file, "
                        "the first run might take longer than usual.")
 
+    # Setup acquisition:
+
+    # Allocate aligned arrays for the sample FFTs. Real samples only need the
+    # non-negative frequency half of their spectrum to be computed.
+    if self.real:
+      self.short_sample = pyfftw.n_byte_align_empty((self.fft_size), 16,
+                                                    dtype=self.real_dtype)
+      self.short_sample_ft = pyfftw.n_byte_align_empty(
+        (self.fft_size // 2 + 1), 16, dtype=self.dtype)
+    else:
+      self.short_sample = pyfftw.n_byte_align_empty((self.fft_size), 16,
+                                                    dtype=self.dtype)
+      self.short_sample_ft = pyfftw.n_byte_align_empty((self.fft_size), 16,
+                                                       dtype=self.dtype)
+
+    # Allocate aligned arrays for the code FFT. The code is always real.
+    self.code = pyfftw.n_byte_align_empty((self.fft_size), 16,
+                                          dtype=self.real_dtype)
+    self.code_ft = pyfftw.n_byte_align_empty((self.fft_size // 2 + 1), 16,
+                                             dtype=self.dtype)
+    self.code_ft_conj = pyfftw.n_byte_align_empty((self.fft_size), 16,
+                                                  dtype=self.dtype)
+
+    # Allocate aligned arrays for the inverse FFT.
+    self.corr_ft = pyfftw.n_byte_align_empty((self.fft_size), 16,
+                                              dtype=self.dtype)
+    self.corr = pyfftw.n_byte_align_empty((self.fft_size), 16,
+                                           dtype=self.dtype)
+
+    # Shorter integration Acquisition objects used for hierarchical Doppler
+    # searches, created on first use by `coarse_acquisition`.
+    self.coarse_acqs = {}
+
+    self.plan_ffts(threads)
+
     if samples is not None:
       self.init_samples(samples)
 
-    # Setup acquisition:
+  def plan_ffts(self, threads):
+    """
+    Create the FFTW plans using a given number of threads.
 
-    # Allocate aligned arrays for the code FFT.
-    self.code = pyfftw.n_byte_align_empty((self.n_integrate), 16,
-                                          dtype=np.complex128)
-    self.code_ft = pyfftw.n_byte_align_empty((self.n_integrate), 16,
-                                             dtype=np.complex128)
-    # Create an FFTW transforms which will execute the code FFT.
-    self.code_fft = pyfftw.FFTW(self.code, self.code_ft)
+    Any existing plans are replaced and the FFTW wisdom file saved. This is
+    also done for the shorter integration :class:`Acquisition` objects used
+    by hierarchical searches.
 
-    # Allocate aligned arrays for the inverse FFT.
-    self.corr_ft = pyfftw.n_byte_align_empty((self.n_integrate), 16,
-                                              dtype=np.complex128)
-    self.corr = pyfftw.n_byte_align_empty((self.n_integrate), 16,
-                                           dtype=np.complex128)
+    Parameters
+    ----------
+    threads : int
+      Number of threads used by each FFTW plan.
+
+    """
+    self.threads = threads
+
+    # Create an FFTW transform which will execute the sample FFTs.
+    self.short_sample_fft = pyfftw.FFTW(self.short_sample, self.short_sample_ft,
+                                        threads=self.threads)
+
+    # Create an FFTW transforms which will execute the code FFT.
+    self.code_fft = pyfftw.FFTW(self.code, self.code_ft, threads=self.threads)
 
     # Setup FFTW transforms for inverse FFT.
     self.corr_ifft = pyfftw.FFTW(self.corr_ft, self.corr,
-                                 direction='FFTW_BACKWARD')
+                                 direction='FFTW_BACKWARD',
+                                 threads=self.threads)
+
+    # Batched inverse FFT plans, created on first use as they depend on the
+    # number of frequencies or PRNs searched. Only the most recently used
+    # frequency chunk plan is kept.
+    self.batch_ifft = None
+    self.prn_batch_iffts = {}
+
+    # The FFTW plans created, as recorded in the wisdom file.
+    self.fft_plans = [('r2c' if self.real else 'c2c', self.fft_size,
+                       self.dtype.name, self.threads),
+                      ('r2c', self.fft_size, self.dtype.name, self.threads),
+                      ('c2c', self.fft_size, self.dtype.name, self.threads)]
 
     # Save FFTW wisdom for later
-    if wisdom_file is not None:
-      self.save_wisdom(wisdom_file)
+    if self.wisdom_file is not None:
+      self.save_wisdom(self.wisdom_file)
+
+    for coarse_acq in self.coarse_acqs.itervalues():
+      if coarse_acq.threads != threads:
+        coarse_acq.plan_ffts(threads)
 
   def init_samples(self, samples):
     """
@@ -162,11 +357,96 @@ class Acquisition:
     self.samples = samples
 
     # Create some short sets of data to correlate with
-    self.short_samples = [samples[off:(off + self.n_integrate)]
-                          for off in self.offsets]
+    if self.fft_size_mode == 'resample':
+      resample_indices = np.asarray(np.arange(self.fft_size) /
+                                    self.resample_ratio, dtype=np.int)
+      self.short_samples = [
+        samples[off + resample_indices[off + resample_indices < len(samples)]]
+        for off in self.offsets]
+    else:
+      self.short_samples = [samples[off:(off + self.fft_size)]
+                            for off in self.offsets]
+
+    # Pre-compute Fourier transforms of the short signals. Each spectrum is
+    # stored twice in a row so that the spectrum rotated by any number of
+    # bins is just a slice of this persistent buffer.
+    shape = (len(self.offsets), 2 * self.fft_size)
+    if getattr(self, 'short_samples_ft_2', None) is None or \
+       self.short_samples_ft_2.shape != shape:
+      self.short_samples_ft_2 = pyfftw.n_byte_align_empty(shape, 16,
+                                                          dtype=self.dtype)
+    for offset_i, samps in enumerate(self.short_samples):
+      # Zero-pad if we run out of samples.
+      self.short_sample[:len(samps)] = samps
+      self.short_sample[len(samps):] = 0
+      self.short_sample_fft.execute()
+      if self.real:
+        hermitian_extend(self.short_sample_ft,
+                         self.short_samples_ft_2[offset_i, :self.fft_size])
+      else:
+        self.short_samples_ft_2[offset_i, :self.fft_size] = \
+          self.short_sample_ft
+      self.short_samples_ft_2[offset_i, self.fft_size:] = \
+        self.short_samples_ft_2[offset_i, :self.fft_size]
+    self.short_samples_ft = [ft_2[:self.fft_size]
+                             for ft_2 in self.short_samples_ft_2]
+
+    for coarse_acq in self.coarse_acqs.itervalues():
+      coarse_acq.init_samples(samples)
+
+  def coarse_acquisition(self, n_codes_integrate):
+    """
+    Get an :class:`Acquisition` object for the same samples with a shorter
+    integration time, as used for the coarse pass of a hierarchical Doppler
+    search.
 
-    # Pre-compute Fourier transforms of the short signals
-    self.short_samples_ft = [np.fft.fft(samps) for samps in self.short_samples]
+    The object is created on first use and kept so that its FFT plans and
+    buffers are reused by later searches.
+
+    Parameters
+    ----------
+    n_codes_integrate : int
+      Number of code periods to integrate over.
+
+    Returns
+    -------
+    out : :class:`Acquisition`
+
+    """
+    if n_codes_integrate not in self.coarse_acqs:
+      self.coarse_acqs[n_codes_integrate] = Acquisition(
+        self.samples, self.sampling_freq, self.IF, self.samples_per_code,
+        self.code_length, n_codes_integrate=n_codes_integrate,
+        wisdom_file=self.wisdom_file, code_cache_dir=self.code_cache_dir,
+        batch=self.batch, threads=self.threads, real=self.real,
+        dtype=self.dtype, fft_size=self.fft_size_mode)
+    return self.coarse_acqs[n_codes_integrate]
+
+  def short_samples_ft_bb(self, offset_i, freq):
+    """
+    Get the spectrum of a short set of samples mixed down to baseband.
+
+    The carrier is removed by rotating the spectrum in the frequency domain.
+    The returned array is a view into a persistent buffer so no data is
+    copied.
+
+    Parameters
+    ----------
+    offset_i : int
+      Index into `offsets` of the short set of samples.
+    freq : float
+      Carrier frequency to remove in Hz.
+
+    Returns
+    -------
+    out : :class:`numpy.ndarray`, shape(`fft_size`,)
+      View of the rotated spectrum.
+
+    """
+    shift = int(round(float(freq) * self.fft_size /
+                      (self.sampling_freq * self.resample_ratio)))
+    shift %= self.fft_size
+    return self.short_samples_ft_2[offset_i, shift:shift + self.fft_size]
 
   def interpolate(self, S_0, S_1, S_2, interpolation='gaussian'):
     """
@@ -238,7 +518,8 @@ class Acquisition:
     else:
       raise ValueError("Unknown interpolation mode '%s'", interpolation)
 
-  def acquire(self, code, freqs, progress_callback=None):
+  def acquire(self, code, freqs, progress_callback=None, prn=None,
+              reduce=False):
     """
     Perform an acquisition with a given code.
 
@@ -258,72 +539,451 @@ class Acquisition:
 
         progress_callback(current_step_number, total_number_of_steps)
 
+    prn : int or `None`, optional
+      The PRN that `code` belongs to. If given, the Fourier transform of the
+      upsampled code is looked up in (or added to) the code spectrum cache
+      rather than being recomputed on every call.
+    reduce : bool, optional
+      If `True` then rather than the full array of correlation powers, only
+      the statistics needed by :meth:`find_peak` are kept while correlating.
+      The peak memory used is then proportional to `samples_per_code` rather
+      than to the number of frequencies and offsets searched.
+
     Returns
     -------
-    out : :class:`numpy.ndarray`, shape(len(`freqs`), `samples_per_code`)
+    out : :class:`numpy.ndarray`, shape(len(`freqs`), `samples_per_code`) or :class:`ReducedResults`
       2D array containing correlation powers at different frequencies and code
       phases. Code phase axis is in samples from zero to `samples_per_code`.
+      If `reduce` is `True`, a :class:`ReducedResults` object summarising the
+      same array.
 
     """
-    # Allocate array to hold results.
-    results = np.empty((len(self.offsets), len(freqs), self.samples_per_code))
+    if prn is None:
+      code_ft_conj = self.code_ft_conjugate(code)
+    else:
+      key = self.code_cache_key(prn)
+      code_ft_conj = self.code_cache.get(key)
+      if code_ft_conj is None:
+        code_ft_conj = self.code_cache.put(key, self.code_ft_conjugate(code))
+
+    if reduce:
+      reduced = ReducedResults(len(self.offsets), len(freqs),
+                               self.samples_per_code, self.real_dtype,
+                               self.samples_per_chip)
+    else:
+      reduced = None
+
+    if self.batch:
+      results = self._acquire_batch(code_ft_conj, freqs, progress_callback,
+                                    reduced)
+    else:
+      results = self._acquire_loop(code_ft_conj, freqs, progress_callback,
+                                   reduced)
 
-    # Upsample the code to our sampling frequency.
-    code_indices = np.arange(1.0, self.n_integrate + 1.0) / \
-                    self.samples_per_chip
+    if reduce:
+      return reduced
+
+    # Choose the nav-bit-declobber sample interval with the best correlation
+    max_indices = np.unravel_index(results.argmax(), results.shape)
+    return results[max_indices[0]]
+
+  def code_cache_key(self, prn):
+    """
+    Get the key identifying the code spectrum of a PRN in the code spectrum
+    cache for the sampling parameters of this :class:`Acquisition`.
+
+    """
+    return (prn, self.sampling_freq, self.samples_per_chip,
+            self.n_integrate, self.code_length, self.dtype.name,
+            self.fft_size, self.fft_size_mode)
+
+  def code_ft_conjugate(self, code):
+    """
+    Compute the conjugate Fourier transform of a code upsampled to our
+    sampling frequency.
+
+    Parameters
+    ----------
+    code : :class:`numpy.ndarray`, shape(`code_length`,)
+      A numpy array containing the code, one element per chip with value +/- 1.
+
+    Returns
+    -------
+    out : :class:`numpy.ndarray`, shape(`fft_size`,)
+      The conjugate Fourier transform of the upsampled code. This is an
+      internal buffer that is overwritten by the next call.
+
+    """
+    # When padding, the code only covers the integration period and is zero
+    # afterwards so that the correlation doesn't wrap around.
+    if self.fft_size_mode == 'pad':
+      n_code = self.n_integrate
+    else:
+      n_code = self.fft_size
+
+    # Upsample the code to our (possibly resampled) sampling frequency.
+    code_indices = np.arange(1.0, n_code + 1.0) / \
+                    (self.samples_per_chip * self.resample_ratio)
     code_indices = np.remainder(np.asarray(code_indices, np.int), self.code_length)
-    self.code[:] = code[code_indices]
+    self.code[:n_code] = code[code_indices]
+    self.code[n_code:] = 0
 
     # Find the conjugate Fourier transform of the code which will be used to
     # perform the correlation.
     self.code_fft.execute()
-    code_ft_conj = np.conj(self.code_ft)
+    hermitian_extend(self.code_ft, self.code_ft_conj)
+    return np.conj(self.code_ft_conj, out=self.code_ft_conj)
+
+  def correlation_power(self, corr, out=None):
+    """
+    Compute the correlation power at each code phase from the output of the
+    correlation inverse FFT.
+
+    Parameters
+    ----------
+    corr : :class:`numpy.ndarray`, shape(..., `fft_size`)
+      Correlation results along the last axis.
+    out : :class:`numpy.ndarray` or `None`, optional
+      Array of shape(..., `samples_per_code`) to write the powers into.
+
+    Returns
+    -------
+    out : :class:`numpy.ndarray`, shape(..., `samples_per_code`)
+      Correlation power with the code phase axis in samples of the original
+      sampling frequency.
+
+    """
+    if self.code_phase_indices is None:
+      corr = corr[..., :self.samples_per_code]
+    else:
+      corr = np.take(corr, self.code_phase_indices, axis=-1)
+    acq_mag = np.abs(corr, out=out)
+    return np.square(acq_mag, out=acq_mag)
+
+  def noise_power(self):
+    """
+    Get the expected correlation power of noise, relative to the power of the
+    noise in the samples.
+
+    The correlation sums the samples covered by the code, and the unnormalised
+    FFTs scale the result by `fft_size`, so the power grows with the
+    integration time and FFT length. This is used to compare correlation
+    powers found with different integration times.
+
+    """
+    if self.fft_size_mode == 'pad':
+      n_code = self.n_integrate
+    else:
+      n_code = self.fft_size
+    return float(self.fft_size) ** 2 * n_code
+
+  def _acquire_loop(self, code_ft_conj, freqs, progress_callback=None,
+                    reduced=None):
+    """
+    Correlate against each frequency bin in turn using the 1D FFTW plans.
+
+    Returns the full `(len(offsets), len(freqs), samples_per_code)` array of
+    correlation powers, or if `reduced` is a :class:`ReducedResults` object,
+    adds each row of powers to it and returns `None`.
+
+    """
+    # Allocate array to hold results.
+    if reduced is None:
+      results = np.empty((len(self.offsets), len(freqs),
+                          self.samples_per_code), dtype=self.real_dtype)
+    else:
+      results = None
+      row = np.empty(self.samples_per_code, dtype=self.real_dtype)
 
-    acq_mag = []
     for n, freq in enumerate(freqs):
       # Report on our progress
       if progress_callback:
         progress_callback(n + 1, len(freqs))
 
-      # Shift the signal in the frequency domain to remove the carrier
-      # i.e. mix down to baseband.
-      shift = round(float(freq) * len(self.short_samples_ft[0]) /
-                  self.sampling_freq)
-
       # Search over the possible nav bit offset intervals
       for offset_i in range(len(self.offsets)):
-        short_samples_ft_bb = np.append(self.short_samples_ft[offset_i][shift:],
-                                        self.short_samples_ft[offset_i][:shift])
+        # Shift the signal in the frequency domain to remove the carrier
+        # i.e. mix down to baseband.
+        short_samples_ft_bb = self.short_samples_ft_bb(offset_i, freq)
 
         # Multiplication in frequency <-> correlation in time.
-        self.corr_ft[:] = short_samples_ft_bb * code_ft_conj
+        np.multiply(short_samples_ft_bb, code_ft_conj, out=self.corr_ft)
 
         # Perform inverse Fourier transform to obtain correlation results.
         self.corr_ifft.execute()
-        acq_mag = np.abs(self.corr[:self.samples_per_code])
-        results[offset_i][n] = np.square(acq_mag)
+        if reduced is None:
+          self.correlation_power(self.corr, out=results[offset_i, n])
+        else:
+          reduced.add(offset_i, n, self.correlation_power(self.corr, out=row))
 
-    # Choose the nav-bit-declobber sample interval with the best correlation
-    max_indices = np.unravel_index(results.argmax(), results.shape)
-    return results[max_indices[0]]
+    return results
 
+  def _batch_ifft(self, n_freqs):
+    """
+    Get the batched inverse FFT plan for a search over `n_freqs` frequencies.
+
+    The plan transforms an aligned `(len(offsets), chunk, fft_size)` array
+    along its last axis, where the frequencies are split into chunks as equal
+    as possible of at most about `BATCH_CHUNK_BYTES` each. The plan is kept so
+    that repeated acquisitions with the same chunk size only plan once, a plan
+    for a different chunk size replaces it.
 
-  def find_peak(self, freqs, results, interpolation='gaussian'):
+    """
+    row_bytes = len(self.offsets) * self.fft_size * self.dtype.itemsize
+    max_chunk = max(1, BATCH_CHUNK_BYTES // row_bytes)
+    n_chunks = -(-n_freqs // max_chunk)
+    chunk = -(-n_freqs // n_chunks)
+    if self.batch_ifft is None or \
+       self.batch_ifft.input_array.shape[1] != chunk:
+      shape = (len(self.offsets), chunk, self.fft_size)
+      batch_corr_ft = pyfftw.n_byte_align_empty(shape, 16,
+                                                dtype=self.dtype)
+      batch_corr = pyfftw.n_byte_align_empty(shape, 16, dtype=self.dtype)
+      # Drop the old plan first so that only one set of buffers is held.
+      self.batch_ifft = None
+      # Measuring plans on an array this large takes many minutes, and the
+      # estimated plan performs within a few percent of the measured one.
+      self.batch_ifft = pyfftw.FFTW(batch_corr_ft, batch_corr,
+                                    axes=(-1,),
+                                    direction='FFTW_BACKWARD',
+                                    flags=('FFTW_ESTIMATE',),
+                                    threads=self.threads)
+    return self.batch_ifft
+
+  def _acquire_batch(self, code_ft_conj, freqs, progress_callback=None,
+                     reduced=None):
+    """
+    Correlate against the frequency bins and offsets with a batched inverse
+    FFT per chunk of frequencies.
+
+    Returns the full `(len(offsets), len(freqs), samples_per_code)` array of
+    correlation powers, or if `reduced` is a :class:`ReducedResults` object,
+    adds each row of powers to it and returns `None`.
+
+    """
+    batch_ifft = self._batch_ifft(len(freqs))
+    batch_corr_ft = batch_ifft.input_array
+    batch_corr = batch_ifft.output_array
+    chunk = batch_corr_ft.shape[1]
+
+    if reduced is None:
+      results = np.empty((len(self.offsets), len(freqs),
+                          self.samples_per_code), dtype=self.real_dtype)
+    else:
+      row = np.empty(self.samples_per_code, dtype=self.real_dtype)
+
+    for n0 in range(0, len(freqs), chunk):
+      chunk_freqs = freqs[n0:n0 + chunk]
+
+      # Shift the signal in the frequency domain to remove the carrier, i.e.
+      # mix down to baseband, and multiply by the code spectrum to correlate.
+      for k, freq in enumerate(chunk_freqs):
+        for offset_i in range(len(self.offsets)):
+          np.multiply(self.short_samples_ft_bb(offset_i, freq), code_ft_conj,
+                      out=batch_corr_ft[offset_i, k])
+
+      # Perform the inverse Fourier transforms for every frequency and offset
+      # in the chunk. Any rows past the end of the last chunk are left over
+      # from the previous one and ignored.
+      batch_ifft.execute()
+
+      if progress_callback:
+        progress_callback(n0 + len(chunk_freqs), len(freqs))
+
+      if reduced is None:
+        self.correlation_power(batch_corr[:, :len(chunk_freqs)],
+                               out=results[:, n0:n0 + len(chunk_freqs)])
+        continue
+      for k in range(len(chunk_freqs)):
+        for offset_i in range(len(self.offsets)):
+          reduced.add(offset_i, n0 + k,
+                      self.correlation_power(batch_corr[offset_i, k],
+                                             out=row))
+
+    if reduced is None:
+      return results
+
+  def _prn_batch_ifft(self, n_prns):
+    """
+    Get the batched inverse FFT plan used to correlate `n_prns` codes at once.
+
+    The plan transforms an aligned `(n_prns, fft_size)` array along its
+    last axis and is cached per number of PRNs.
+
+    """
+    if n_prns not in self.prn_batch_iffts:
+      shape = (n_prns, self.fft_size)
+      prns_corr_ft = pyfftw.n_byte_align_empty(shape, 16, dtype=self.dtype)
+      prns_corr = pyfftw.n_byte_align_empty(shape, 16, dtype=self.dtype)
+      self.prn_batch_iffts[n_prns] = pyfftw.FFTW(prns_corr_ft, prns_corr,
+                                                 axes=(-1,),
+                                                 direction='FFTW_BACKWARD',
+                                                 flags=('FFTW_ESTIMATE',),
+                                                 threads=self.threads)
+    return self.prn_batch_iffts[n_prns]
+
+  def acquire_prns(self, prns, freqs, progress_callback=None, reduce=False):
+    """
+    Perform an acquisition of several PRNs at once.
+
+    The conjugate code spectra of all the PRNs are stacked into a 2D array
+    which is multiplied against each Doppler shifted sample spectrum and
+    correlated with a single batched inverse FFT across all PRNs. Everything
+    runs in the calling process.
+
+    Parameters
+    ----------
+    prns : iterable
+      List of PRNs (0-indexed) to acquire.
+    freqs : :class:`numpy.ndarray`, shape(`n_freqs`,) or shape(len(`prns`), `n_freqs`)
+      Carrier frequencies in Hz to search over, either one list shared by all
+      PRNs or one row per PRN.
+    progress_callback : callable or `None`, optional
+      A function that is called to report on the progress of the acquisition,
+      see :meth:`acquire`.
+    reduce : bool, optional
+      If `True`, return a :class:`ReducedResults` object for each PRN instead
+      of the full array of correlation powers, see :meth:`acquire`.
+
+    Returns
+    -------
+    out : :class:`numpy.ndarray`, shape(len(`prns`), `n_freqs`, `samples_per_code`) or [:class:`ReducedResults`]
+      Array containing correlation powers at different frequencies and code
+      phases for each PRN, as would be returned by :meth:`acquire`.
+
+    """
+    prns = list(prns)
+    freqs = np.asarray(freqs)
+    n_freqs = freqs.shape[-1]
+    shared_freqs = freqs.ndim == 1
+
+    prns_ifft = self._prn_batch_ifft(len(prns))
+    prns_corr_ft = prns_ifft.input_array
+    prns_corr = prns_ifft.output_array
+
+    # Stack the conjugate code spectra.
+    codes_ft_conj = pyfftw.n_byte_align_empty((len(prns), self.fft_size), 16,
+                                              dtype=self.dtype)
+    for n, prn in enumerate(prns):
+      key = self.code_cache_key(prn)
+      code_ft_conj = self.code_cache.get(key)
+      if code_ft_conj is None:
+        code_ft_conj = self.code_cache.put(key,
+                                           self.code_ft_conjugate(caCodes[prn]))
+      codes_ft_conj[n] = code_ft_conj
+
+    if reduce:
+      reduced = [ReducedResults(len(self.offsets), n_freqs,
+                                self.samples_per_code, self.real_dtype,
+                                self.samples_per_chip)
+                 for prn in prns]
+      rows = np.empty((len(prns), self.samples_per_code),
+                      dtype=self.real_dtype)
+    else:
+      # The best nav-bit-declobber offset is chosen separately for each PRN so
+      # keep the results for the best offset so far and the current offset.
+      results = np.empty((len(prns), n_freqs, self.samples_per_code),
+                         dtype=self.real_dtype)
+      offset_results = np.empty_like(results)
+
+    for offset_i in range(len(self.offsets)):
+      for n in range(n_freqs):
+        if progress_callback:
+          progress_callback(offset_i * n_freqs + n + 1,
+                            len(self.offsets) * n_freqs)
+
+        # Mix down to baseband and multiply in frequency <-> correlate in time.
+        if shared_freqs:
+          np.multiply(self.short_samples_ft_bb(offset_i, freqs[n]),
+                      codes_ft_conj, out=prns_corr_ft)
+        else:
+          for prn_i in range(len(prns)):
+            np.multiply(self.short_samples_ft_bb(offset_i, freqs[prn_i, n]),
+                        codes_ft_conj[prn_i], out=prns_corr_ft[prn_i])
+
+        # Perform the inverse Fourier transforms for all PRNs at once.
+        prns_ifft.execute()
+        if reduce:
+          self.correlation_power(prns_corr, out=rows)
+          for prn_i in range(len(prns)):
+            reduced[prn_i].add(offset_i, n, rows[prn_i])
+        else:
+          self.correlation_power(prns_corr, out=offset_results[:, n])
+
+      if reduce:
+        continue
+      if offset_i == 0:
+        results, offset_results = offset_results, results
+      else:
+        better = offset_results.max(axis=(1, 2)) > results.max(axis=(1, 2))
+        results[better] = offset_results[better]
+
+    if reduce:
+      return reduced
+    return results
+
+  def find_candidates(self, freqs, results, n_candidates):
+    """
+    Find the frequencies of the strongest correlation peaks in a set of
+    acquisition results.
+
+    Each frequency bin is ranked by its greatest correlation power. Bins
+    adjacent to an already chosen bin are skipped as they usually hold the
+    same peak.
+
+    Parameters
+    ----------
+    freqs : iterable
+      List of frequencies mapping the results frequency index to a value in Hz.
+    results : :class:`numpy.ndarray`, shape(len(`freqs`), `samples_per_code`) or :class:`ReducedResults`
+      Results as returned by :meth:`acquire`.
+    n_candidates : int
+      Maximum number of frequencies to return.
+
+    Returns
+    -------
+    out : [float]
+      Candidate frequencies in Hz, strongest first.
+
+    """
+    if isinstance(results, ReducedResults):
+      freq_powers = results.row_max[results.offset_index]
+    else:
+      freq_powers = results.max(axis=1)
+
+    chosen = []
+    for n in np.argsort(freq_powers)[::-1]:
+      if len(chosen) >= n_candidates:
+        break
+      if all(abs(n - m) > 1 for m in chosen):
+        chosen.append(n)
+    return [freqs[n] for n in chosen]
+
+  def find_peak(self, freqs, results, interpolation='gaussian',
+                noise_mean=None):
     """
     Find the peak within an set of acquisition results.
 
     Finds the point in the acquisition results array with the greatest
     correlation power and determines the code phase and carrier frequency
     corresponding to that point. The Signal-to-Noise Ratio (SNR) of the peak is
-    also estimated.
+    also estimated. See :meth:`analyse_peaks`, which does the same for several
+    PRNs at once.
 
     Parameters
     ----------
     freqs : iterable
       List of frequencies mapping the results frequency index to a value in Hz.
-    results : :class:`numpy.ndarray`, shape(len(`freqs`), `samples_per_code`)
+    results : :class:`numpy.ndarray`, shape(len(`freqs`), `samples_per_code`) or :class:`ReducedResults`
       2D array containing correlation powers at different frequencies and code
       phases. Code phase axis is in samples from zero to `samples_per_code`.
+      Alternatively, the :class:`ReducedResults` summary of such an array.
+    interpolation : {'gaussian', 'parabolic', 'none'}, optional
+      Interpolation method, see :meth:`analyse_peaks`.
+    noise_mean : float or `None`, optional
+      Mean correlation power to estimate the SNR against. If `None` the mean
+      of `results` is used, which is only representative of the noise when
+      `results` covers the whole search.
 
     Returns
     -------
@@ -334,30 +994,255 @@ class Acquisition:
         (currently) in arbitrary units.
 
     """
-    # Find the results index of the maximum.
-    freq_index, cp_samples = np.unravel_index(results.argmax(),
-                                              results.shape)
+    code_phases, carr_freqs, snrs, _, _ = self.analyse_peaks(
+      freqs, _as_batch(results), interpolation,
+      None if noise_mean is None else [noise_mean])
+    return (float(code_phases[0]), float(carr_freqs[0]), float(snrs[0]))
 
-    if freq_index > 1 and freq_index < len(freqs)-1:
-      delta = self.interpolate(
-        results[freq_index-1][cp_samples],
-        results[freq_index][cp_samples],
-        results[freq_index+1][cp_samples],
-        interpolation
-      )
-      if delta > 0:
-        freq = freqs[freq_index] + (freqs[freq_index+1] - freqs[freq_index]) * delta
-      else:
-        freq = freqs[freq_index] - (freqs[freq_index-1] - freqs[freq_index]) * delta
+  def peak_statistics(self, results):
+    """
+    Estimate detection statistics for the peak of a set of acquisition
+    results, as found by :meth:`find_peak`.
+
+    Parameters
+    ----------
+    results : :class:`numpy.ndarray`, shape(`n_freqs`, `samples_per_code`) or :class:`ReducedResults`
+      Results as returned by :meth:`acquire`.
+
+    Returns
+    -------
+    out : (float, float)
+      | The tuple
+      |   `(peak_ratio, noise_floor)`
+      | See :meth:`analyse_peaks`.
+
+    """
+    freqs = np.arange(results.shape[0], dtype=np.float64)
+    _, _, _, peak_ratios, noise_floors = self.analyse_peaks(
+      freqs, _as_batch(results), 'none')
+    return (float(peak_ratios[0]), float(noise_floors[0]))
+
+  def analyse_peaks(self, freqs, results, interpolation='gaussian',
+                    noise_means=None):
+    """
+    Find and characterise the peaks in the acquisition results of several
+    PRNs at once.
+
+    The results of all the PRNs are processed together as arrays, so a batch
+    of PRNs costs a few NumPy calls rather than a Python loop per PRN. For each
+    PRN the point with the greatest correlation power is found and refined by
+    interpolating in both carrier frequency and code phase:
+
+    * In frequency, the powers of the frequency bins either side of the peak
+      at its code phase are interpolated by :meth:`interpolate`.
+    * In code phase, the correlation amplitude falls off linearly for a chip
+      either side of the peak, so a triangle is fitted to the amplitudes of
+      the peak and the code phase samples either side of it.
+
+    Along with the SNR two detection statistics are estimated:
+
+    * The peak ratio, the ratio of the peak to the second peak. The second
+      peak is the greatest correlation power at any frequency more than one
+      chip away from the peak in code phase.
+    * The noise floor, the median over the frequency bins of the median
+      correlation power of each bin, divided by :math:`\ln 2`. Noise powers
+      are exponentially distributed, so this estimates their mean, but unlike
+      the mean it is hardly affected by the signal. The medians are taken
+      over one code phase sample per half chip, as the samples within a chip
+      are strongly correlated anyway.
+
+    Parameters
+    ----------
+    freqs : :class:`numpy.ndarray`, shape(`n_freqs`,) or shape(`n_prns`, `n_freqs`)
+      Frequencies in Hz mapping the results frequency index to a value, either
+      shared by all PRNs or one row per PRN.
+    results : :class:`numpy.ndarray`, shape(`n_prns`, `n_freqs`, `samples_per_code`) or [:class:`ReducedResults`]
+      Results of each PRN, as returned by :meth:`acquire_prns`.
+    interpolation : {'gaussian', 'parabolic', 'none'}, optional
+      Frequency interpolation method, see :meth:`interpolate`. If `'none'`
+      the code phase isn't interpolated either.
+    noise_means : array_like or `None`, optional
+      Mean correlation power of each PRN to estimate the SNR against, see
+      :meth:`find_peak`. If `None` the mean of each PRN's results is used.
+
+    Returns
+    -------
+    out : (:class:`numpy.ndarray`, ...)
+      | The tuple
+      |   `(code_phases, carr_freqs, snrs, peak_ratios, noise_floors)`
+      | of arrays with one entry per PRN. Code phases are in chips and
+        frequencies in Hz.
+
+    Notes
+    -----
+    :class:`ReducedResults` only keep the maximum of each row of correlation
+    powers and the greatest power more than a chip from it. For the rows
+    other than the peak's and its neighbours' whose maximum is within a chip
+    of the peak, the second peak is therefore looked for more than a chip
+    from the row's own maximum rather than from the peak.
+
+    """
+    n_prns = len(results)
+    prn_indices = np.arange(n_prns)
+    reduced = n_prns > 0 and isinstance(results[0], ReducedResults)
+    if reduced:
+      n_freqs, n_code_phases = results[0].shape
+      freq_index = np.array([r.freq_index for r in results])
+      cp_index = np.array([r.code_phase_index for r in results])
+      peaks = np.array([r.max for r in results], dtype=np.float64)
+      means = np.array([r.mean() for r in results])
+      peak_rows = np.array([r.peak_rows for r in results], dtype=np.float64)
+      row_max = np.array([r.row_max[r.offset_index] for r in results])
+      row_argmax = np.array([r.row_argmax[r.offset_index] for r in results])
+      row_second = np.array([r.row_second[r.offset_index] for r in results])
+      row_median = np.array([r.row_median[r.offset_index] for r in results])
+      row_far = _code_phase_distance(row_argmax, cp_index[:, np.newaxis],
+                                     n_code_phases) > self.samples_per_chip
+      row_far_max = np.where(row_far, row_max, row_second)
     else:
-      freq = freqs[freq_index]
+      results = np.asarray(results)
+      n_freqs, n_code_phases = results.shape[1:]
+      flat = results.reshape(n_prns, -1)
+      flat_index = flat.argmax(axis=1)
+      freq_index, cp_index = np.unravel_index(flat_index, results.shape[1:])
+      peaks = np.asarray(flat[prn_indices, flat_index], dtype=np.float64)
+      means = flat.mean(axis=1)
+      rows = np.clip(freq_index[:, np.newaxis] + np.arange(-1, 2), 0,
+                     n_freqs - 1)
+      peak_rows = np.asarray(results[prn_indices[:, np.newaxis], rows],
+                             dtype=np.float64)
+      row_median = np.median(
+        results[:, :, ::_noise_stride(self.samples_per_chip)], axis=2)
+
+    cp_far = _code_phase_distance(np.arange(n_code_phases),
+                                  cp_index[:, np.newaxis],
+                                  n_code_phases) > self.samples_per_chip
+    if not reduced:
+      row_far_max = np.where(cp_far[:, np.newaxis, :], results,
+                             -np.inf).max(axis=2)
+
+    # The rows either side of the peak are known in full, outside the
+    # searched frequencies they are NaN.
+    rows = freq_index[:, np.newaxis] + np.arange(-1, 2)
+    in_range = (rows >= 0) & (rows < n_freqs)
+    peak_rows[~in_range] = np.nan
+    near_far_max = np.where(cp_far[:, np.newaxis, :] &
+                            in_range[:, :, np.newaxis],
+                            peak_rows, -np.inf).max(axis=2)
+    prn_i, k = np.nonzero(in_range)
+    row_far_max[prn_i, rows[prn_i, k]] = near_far_max[prn_i, k]
+
+    peak_ratios = peaks / row_far_max.max(axis=1)
+    noise_floors = np.median(row_median, axis=1) / np.log(2)
+    if noise_means is None:
+      noise_means = means
+    snrs = peaks / np.asarray(noise_means, dtype=np.float64)
+
+    # Interpolate the frequency between the neighbouring bins.
+    freqs = np.asarray(freqs, dtype=np.float64)
+    if freqs.ndim == 1:
+      freqs = np.broadcast_to(freqs, (n_prns, n_freqs))
+    S = peak_rows[prn_indices, :, cp_index]
+    freq = freqs[prn_indices, freq_index]
+    freq_next = freqs[prn_indices, np.minimum(freq_index + 1, n_freqs - 1)]
+    freq_prev = freqs[prn_indices, np.maximum(freq_index - 1, 0)]
+    with np.errstate(divide='ignore', invalid='ignore'):
+      delta = self.interpolate(S[:, 0], S[:, 1], S[:, 2], interpolation)
+      delta = np.where((freq_index > 1) & (freq_index < n_freqs - 1), delta,
+                       0)
+      carr_freqs = np.where(delta > 0, freq + (freq_next - freq) * delta,
+                            freq - (freq_prev - freq) * delta)
+
+    # Fit a triangle to the amplitudes of the peak and its neighbours in code
+    # phase. The neighbour on the far side of the apex is a whole sample down
+    # the slope, the difference between the neighbours then gives the offset
+    # of the apex.
+    if interpolation == 'none':
+      cp_delta = 0
+    else:
+      cps = np.remainder(cp_index[:, np.newaxis] + np.arange(-1, 2),
+                         n_code_phases)
+      A = np.sqrt(peak_rows[prn_indices[:, np.newaxis], 1, cps])
+      with np.errstate(divide='ignore', invalid='ignore'):
+        cp_delta = 0.5 * (A[:, 2] - A[:, 0]) / \
+                   (A[:, 1] - np.minimum(A[:, 0], A[:, 2]))
+      cp_delta = np.clip(np.nan_to_num(cp_delta), -0.5, 0.5)
+    code_phases = np.remainder((cp_index + cp_delta) / self.samples_per_chip,
+                               self.code_length)
+
+    return (code_phases, carr_freqs, snrs, peak_ratios, noise_floors)
+
+  def _acquire_prn(self, prn, freqs, reduce=False, coarse_codes_integrate=None,
+                   coarse_freqs=None, fine_offsets=None, n_candidates=3,
+                   progress_callback=None):
+    # Searches one PRN for `acquisition`, exhaustively or hierarchically.
+    # Returns the frequencies and results, as a batch of one, of the search
+    # whose peak is to be analysed and the noise means to use, if any.
+    # `progress_callback(step)` is given the number of frequencies searched.
+    def step_callback(step0):
+      if progress_callback is None:
+        return None
+      return lambda freq_num, num_freqs: progress_callback(step0 + freq_num)
+
+    if coarse_codes_integrate is None:
+      results = self.acquire(caCodes[prn], freqs,
+                             progress_callback=step_callback(0), prn=prn,
+                             reduce=reduce)
+      return freqs, _as_batch(results), None
+
+    coarse_acq = self.coarse_acquisition(coarse_codes_integrate)
+    noise_scale = self.noise_power() / coarse_acq.noise_power()
+    coarse_results = coarse_acq.acquire(
+      caCodes[prn], coarse_freqs, progress_callback=step_callback(0), prn=prn,
+      reduce=reduce)
+    candidates = self.find_candidates(coarse_freqs, coarse_results,
+                                      n_candidates)
+
+    # Refine each candidate with the full integration time, keeping the
+    # strongest.
+    best = None
+    for k, candidate in enumerate(candidates):
+      fine_freqs = candidate + fine_offsets
+      step0 = len(coarse_freqs) + k * len(fine_offsets)
+      fine_results = self.acquire(
+        caCodes[prn], fine_freqs, progress_callback=step_callback(step0),
+        prn=prn, reduce=reduce)
+      peak = fine_results.max if reduce else fine_results.max()
+      if best is None or peak > best[0]:
+        best = (peak, fine_freqs, fine_results)
+    return best[1], _as_batch(best[2]), [coarse_results.mean() * noise_scale]
+
+  def _make_results(self, prns, freqs, results, threshold, noise_means=None):
+    # The AcquisitionResults of `acquisition` for `prns`, their peaks are
+    # analysed together.
+    code_phases, carr_freqs, snrs, peak_ratios, noise_floors = \
+      self.analyse_peaks(freqs, results, interpolation='gaussian',
+                         noise_means=noise_means)
+    acq_results = []
+    for k, prn in enumerate(prns):
+      # If the result is above the threshold, then we have acquired the
+      # satellite.
+      status = '-'
+      if (snrs[k] > threshold):
+        status = 'A'
 
-    code_phase = float(cp_samples) / self.samples_per_chip
+      # Save properties of the detected satellite signal
+      acq_result = AcquisitionResult(prn,
+                                     float(carr_freqs[k]),
+                                     float(carr_freqs[k]) - self.IF,
+                                     float(code_phases[k]),
+                                     float(snrs[k]),
+                                     status,
+                                     float(peak_ratios[k]),
+                                     float(noise_floors[k]))
 
-    # Calculate SNR for the peak.
-    snr = np.max(results) / np.mean(results)
+      # If the acquisition was successful, log it
+      if (snrs[k] > threshold):
+        logger.debug("Acquired %s, peak ratio %.2f, noise floor %.3g" %
+                     (acq_result, peak_ratios[k], noise_floors[k]))
+      acq_results.append(acq_result)
 
-    return (code_phase, freq, snr)
+    return acq_results
 
   def acquisition(self,
                   prns=range(32),
@@ -366,7 +1251,11 @@ class Acquisition:
                   doppler_step = None,
                   threshold=DEFAULT_THRESHOLD,
                   show_progress=True,
-                  multi=True
+                  multi=True,
+                  batch_prns=False,
+                  reduce=False,
+                  coarse_codes_integrate=None,
+                  n_candidates=3
   ):
     """
     Perform an acquisition for a given list of PRNs.
@@ -382,6 +1271,16 @@ class Acquisition:
     estimate to within `doppler_step` Hz and then uses interpolation to refine
     the carrier frequency estimate.
 
+    If `coarse_codes_integrate` is given the search is hierarchical. The whole
+    Doppler range is first searched with the shorter integration time, whose
+    frequency bins are correspondingly wider. Only the `n_candidates`
+    strongest coarse bins are then searched at `doppler_step` with the full
+    integration time, each to within one coarse bin either side. The SNR of
+    the refined peak is estimated against the mean power of the coarse
+    search, scaled to the full integration time by :meth:`noise_power`, so
+    the same `threshold` applies as to an exhaustive search. Signals too weak
+    to stand out in the coarse search can still be missed.
+
     Parameters
     ----------
     prns : iterable, optional
@@ -399,6 +1298,23 @@ class Acquisition:
     show_progress : bool, optional
       When `True` a progress bar will be printed showing acquisition status and
       estimated time remaining.
+    multi : bool, optional
+      When `True` the PRNs are acquired in parallel in separate processes,
+      unless the FFTW plans are already multithreaded. The processes are kept
+      between calls, each with its own :class:`Acquisition` object that is
+      given the samples through shared memory.
+    batch_prns : bool, optional
+      When `True` all the PRNs are acquired together in this process using
+      :meth:`acquire_prns`, `multi` is ignored.
+    reduce : bool, optional
+      When `True` only a summary of the correlation powers is kept for each
+      PRN, see :meth:`acquire`.
+    coarse_codes_integrate : int or `None`, optional
+      Number of code periods to integrate over in the coarse pass of a
+      hierarchical search, see :meth:`coarse_acquisition`. If `None` the
+      full Doppler range is searched with the full integration time.
+    n_candidates : int, optional
+      Number of coarse Doppler bins to refine per PRN in a hierarchical search.
 
     Returns
     -------
@@ -409,6 +1325,12 @@ class Acquisition:
     logger.info("Acquisition starting")
     from peregrine.parallel_processing import parmap
 
+    # Re-plan the FFTs for the number of PRNs if threading is automatic.
+    if self.auto_threads:
+      threads, _ = plan_parallelism(self.fft_size, len(prns))
+      if threads != self.threads:
+        self.plan_ffts(threads)
+
     # If the Doppler step is not specified, compute it from the coarse
     # acquisition length.
     if doppler_step is None:
@@ -416,11 +1338,44 @@ class Acquisition:
       # This is slightly sub-optimal if power is split between two bins,
       # perhaps you could peak fit or look at pairs of bins to get true peak
       # magnitude.
-      doppler_step = self.sampling_freq / self.n_integrate
+      # This is the FFT bin spacing, which is finer than 1 / integration time
+      # when the FFT is padded.
+      doppler_step = self.sampling_freq * self.resample_ratio / self.fft_size
 
     if doppler_priors is None:
       doppler_priors = np.zeros_like(prns)
 
+    # Offsets from the Doppler priors to search, shared by all PRNs so that
+    # they all search the same number of frequencies.
+    doppler_offsets = np.arange(-doppler_search, doppler_search, doppler_step)
+    prns_freqs = [doppler_prior + doppler_offsets + self.IF
+                  for doppler_prior in doppler_priors]
+    n_steps = len(doppler_offsets)
+
+    if coarse_codes_integrate is not None:
+      coarse_acq = self.coarse_acquisition(coarse_codes_integrate)
+      coarse_step = coarse_acq.sampling_freq * coarse_acq.resample_ratio / \
+                    coarse_acq.fft_size
+      coarse_offsets = np.arange(-doppler_search, doppler_search, coarse_step)
+      prns_coarse_freqs = [doppler_prior + coarse_offsets + self.IF
+                           for doppler_prior in doppler_priors]
+      # Each candidate is refined over one coarse bin either side so that the
+      # fine peak has neighbours to interpolate with.
+      fine_offsets = np.arange(-coarse_step, coarse_step + doppler_step / 2,
+                               doppler_step)
+      n_steps = len(coarse_offsets) + n_candidates * len(fine_offsets)
+      # The refined peaks are compared against the noise over the whole
+      # coarse search, scaled to the full integration time, so that the SNR
+      # means the same as for an exhaustive search rather than depending on
+      # how much of the narrow refined window the peak covers.
+      noise_scale = self.noise_power() / coarse_acq.noise_power()
+    else:
+      prns_coarse_freqs = [None] * len(prns)
+      fine_offsets = None
+
+    # Arguments of `_acquire_prn` that are the same for all the PRNs.
+    kwargs = dict(reduce=reduce, coarse_codes_integrate=coarse_codes_integrate,
+                  fine_offsets=fine_offsets, n_candidates=n_candidates)
 
     # If progressbar is not available, disable show_progress.
     if show_progress and not _progressbar_available:
@@ -428,59 +1383,94 @@ class Acquisition:
       logger.warning("show_progress = True but progressbar module not found.")
 
     # Setup our progress bar if we need it
-    if show_progress and not multi:
+    if show_progress and (batch_prns or not multi or self.threads > 1):
       widgets = ['  Acquisition ',
                  progressbar.Attribute('prn', '(PRN: %02d)', '(PRN --)'), ' ',
                  progressbar.Percentage(), ' ',
                  progressbar.ETA(), ' ',
                  progressbar.Bar()]
       pbar = progressbar.ProgressBar(widgets=widgets,
-                                     maxval=len(prns) *
-                                     (2 * doppler_search / doppler_step + 1))
+                                     maxval=len(prns) * n_steps)
       pbar.start()
     else:
       pbar = None
 
     def do_acq(n):
-      prn = prns[n]
-      doppler_prior = doppler_priors[n]
-      freqs = np.arange(doppler_prior - doppler_search,
-                        doppler_prior + doppler_search, doppler_step) + self.IF
       if pbar:
-        def progress_callback(freq_num, num_freqs):
-          pbar.update(n*len(freqs) + freq_num, attr={'prn': prn + 1})
+        def progress_callback(step):
+          pbar.update(n*n_steps + step, attr={'prn': prns[n] + 1})
       else:
         progress_callback = None
+      freqs, results, noise_means = self._acquire_prn(
+        prns[n], prns_freqs[n], progress_callback=progress_callback,
+        coarse_freqs=prns_coarse_freqs[n], **kwargs)
+      return self._make_results([prns[n]], freqs, results, threshold,
+                                noise_means)[0]
 
-      coarse_results = self.acquire(caCodes[prn], freqs,
-                                    progress_callback=progress_callback)
-
-
-      code_phase, carr_freq, snr = self.find_peak(freqs, coarse_results,
-                                                  interpolation = 'gaussian')
-
-      # If the result is above the threshold, then we have acquired the
-      # satellite.
-      status = '-'
-      if (snr > threshold):
-        status = 'A'
-
-      # Save properties of the detected satellite signal
-      acq_result = AcquisitionResult(prn,
-                                     carr_freq,
-                                     carr_freq - self.IF,
-                                     code_phase,
-                                     snr,
-                                     status)
-
-      # If the acquisition was successful, log it
-      if (snr > threshold):
-        logger.debug("Acquired %s" % acq_result)
-
-      return acq_result
-
-    if multi:
-      acq_results = parmap(do_acq, range(len(prns)), show_progress=show_progress)
+    if batch_prns:
+      if pbar:
+        def progress_callback(step, num_steps):
+          pbar.update(step * pbar.maxval / num_steps)
+      else:
+        progress_callback = None
+      if np.all(np.asarray(doppler_priors) == doppler_priors[0]):
+        freqs = prns_freqs[0]
+      else:
+        freqs = np.array(prns_freqs)
+      if coarse_codes_integrate is None:
+        coarse_results = self.acquire_prns(prns, freqs,
+                                           progress_callback=progress_callback,
+                                           reduce=reduce)
+        acq_results = self._make_results(prns, np.array(prns_freqs),
+                                         coarse_results, threshold)
+      else:
+        if freqs.ndim == 1:
+          coarse_freqs = prns_coarse_freqs[0]
+        else:
+          coarse_freqs = np.array(prns_coarse_freqs)
+        coarse_results = coarse_acq.acquire_prns(prns, coarse_freqs,
+                                                 reduce=reduce)
+        prns_candidates = [
+          self.find_candidates(prns_coarse_freqs[n], coarse_results[n],
+                               n_candidates)
+          for n in range(len(prns))]
+
+        # Refine the k-th candidate of every PRN together, one row of
+        # frequencies per PRN, keeping the strongest for each PRN.
+        best = [None] * len(prns)
+        for k in range(n_candidates):
+          prns_k = [n for n in range(len(prns))
+                    if k < len(prns_candidates[n])]
+          if not prns_k:
+            break
+          fine_freqs = np.array([prns_candidates[n][k] + fine_offsets
+                                 for n in prns_k])
+          fine_results = self.acquire_prns([prns[n] for n in prns_k],
+                                           fine_freqs, reduce=reduce)
+          for i, n in enumerate(prns_k):
+            peak = fine_results[i].max if reduce else fine_results[i].max()
+            if best[n] is None or peak > best[n][0]:
+              best[n] = (peak, fine_freqs[i], fine_results[i])
+          if pbar:
+            pbar.update(pbar.maxval * (k + 1) / n_candidates)
+        acq_results = self._make_results(
+          prns, np.array([b[1] for b in best]), [b[2] for b in best],
+          threshold,
+          [coarse_results[n].mean() * noise_scale for n in range(len(prns))])
+    elif multi and self.threads == 1:
+      _, nprocs = plan_parallelism(self.fft_size, len(prns),
+                                   threads=self.threads)
+      # The workers are kept between calls, so rather than inheriting this
+      # object they each keep their own, given the samples in shared memory.
+      shared = _SharedAcquisition(self)
+      try:
+        acq_results = parmap(_acquire_prn_shared,
+                             [(shared, prns[n], prns_freqs[n],
+                               prns_coarse_freqs[n], threshold, kwargs)
+                              for n in range(len(prns))],
+                             nprocs=nprocs, show_progress=show_progress)
+      finally:
+        shared.free()
     else:
       acq_results = map(do_acq, range(len(prns)))
 
@@ -498,15 +1488,554 @@ class Acquisition:
     return acq_results
 
   def load_wisdom(self, wisdom_file=DEFAULT_WISDOM_FILE):
-    """Load saved FFTW wisdom from file."""
-    with open(wisdom_file, 'rb') as f:
-      wisdom = cPickle.load(f)
-      pyfftw.import_wisdom(wisdom)
+    """Load saved FFTW wisdom from file, see :class:`WisdomStore`."""
+    get_wisdom_store(wisdom_file).load()
 
   def save_wisdom(self, wisdom_file=DEFAULT_WISDOM_FILE):
-    """Save FFTW wisdom to file."""
-    with open(wisdom_file, 'wb') as f:
-      cPickle.dump(pyfftw.export_wisdom(), f, protocol=cPickle.HIGHEST_PROTOCOL)
+    """
+    Save FFTW wisdom to file if new wisdom has been generated, see
+    :class:`WisdomStore`.
+
+    """
+    get_wisdom_store(wisdom_file).save(self.fft_plans)
+
+
+class ReducedResults(object):
+  """
+  Running summary of the correlation powers found by an acquisition.
+
+  Rows of correlation powers, one per nav-bit-declobber offset and frequency,
+  are added with :meth:`add` as they are computed. Only a few statistics of
+  each row are kept, along with the rows either side in frequency of the
+  greatest peak seen so far. This is all that :meth:`Acquisition.find_peak`
+  needs for interpolation and to estimate the SNR, and all that
+  :meth:`Acquisition.analyse_peaks` needs to estimate the detection
+  statistics.
+
+  For each offset, rows must be added in order of increasing frequency index.
+
+  Parameters
+  ----------
+  n_offsets : int
+    Number of nav-bit-declobber offsets searched.
+  n_freqs : int
+    Number of frequencies searched.
+  samples_per_code : int
+    Length of each row of correlation powers.
+  dtype : :class:`numpy.dtype`, optional
+    Type of the correlation powers.
+  samples_per_chip : float, optional
+    Number of code phase samples per chip.
+
+  Attributes
+  ----------
+  max : float
+    The greatest correlation power seen.
+  offset_index : int
+    Offset index of the greatest correlation power.
+  freq_index : int
+    Frequency index of the greatest correlation power.
+  code_phase_index : int
+    Code phase, in samples, of the greatest correlation power.
+  peak_rows : :class:`numpy.ndarray`, shape(3, `samples_per_code`)
+    The rows of correlation powers at frequency indices `freq_index` - 1,
+    `freq_index` and `freq_index` + 1 for `offset_index`. Rows outside the
+    searched frequencies are filled with NaN.
+  row_max, row_argmax, row_sum : :class:`numpy.ndarray`, shape(`n_offsets`, `n_freqs`)
+    Maximum, index of the maximum and sum of every row.
+  row_second : :class:`numpy.ndarray`, shape(`n_offsets`, `n_freqs`)
+    Greatest power of every row more than a chip from the row's maximum.
+  row_median : :class:`numpy.ndarray`, shape(`n_offsets`, `n_freqs`)
+    Median power of every row, over one code phase sample per half chip.
+
+  """
+
+  def __init__(self, n_offsets, n_freqs, samples_per_code, dtype=np.float64,
+               samples_per_chip=1.0):
+    self.shape = (n_freqs, samples_per_code)
+    self.samples_per_chip = samples_per_chip
+    self.max = -np.inf
+    self.offset_index = None
+    self.freq_index = None
+    self.code_phase_index = None
+    self.row_max = np.zeros((n_offsets, n_freqs))
+    self.row_argmax = np.zeros((n_offsets, n_freqs), dtype=np.int)
+    self.row_sum = np.zeros((n_offsets, n_freqs))
+    self.row_second = np.zeros((n_offsets, n_freqs))
+    self.row_median = np.zeros((n_offsets, n_freqs))
+    self.peak_rows = np.empty((3, samples_per_code), dtype=dtype)
+    self.peak_rows[:] = np.nan
+    self._prev_rows = np.empty((n_offsets, samples_per_code), dtype=dtype)
+    self._pending_row = None
+
+  def add(self, offset_i, n, row):
+    """
+    Add the row of correlation powers for offset index `offset_i` and
+    frequency index `n`. The row is copied if needed.
+
+    """
+    argmax = row.argmax()
+    self.row_max[offset_i, n] = row[argmax]
+    self.row_argmax[offset_i, n] = argmax
+    self.row_sum[offset_i, n] = row.sum()
+    self.row_second[offset_i, n] = _max_outside(row, argmax,
+                                                self.samples_per_chip)
+    self.row_median[offset_i, n] = np.median(
+      row[::_noise_stride(self.samples_per_chip)])
+
+    # Capture the row after the peak once it arrives.
+    if self._pending_row == (offset_i, n):
+      self.peak_rows[2] = row
+      self._pending_row = None
+
+    if row[argmax] > self.max:
+      self.max = row[argmax]
+      self.offset_index = offset_i
+      self.freq_index = n
+      self.code_phase_index = argmax
+      if n > 0:
+        self.peak_rows[0] = self._prev_rows[offset_i]
+      else:
+        self.peak_rows[0] = np.nan
+      self.peak_rows[1] = row
+      self.peak_rows[2] = np.nan
+      self._pending_row = (offset_i, n + 1)
+
+    self._prev_rows[offset_i] = row
+
+  def mean(self):
+    """Mean correlation power over all frequencies for the best offset."""
+    return self.row_sum[self.offset_index].sum() / \
+           (self.shape[0] * self.shape[1])
+
+
+def _as_batch(results):
+  # The results of a single PRN as a batch of one, see
+  # Acquisition.analyse_peaks.
+  if isinstance(results, ReducedResults):
+    return [results]
+  return results[np.newaxis]
+
+
+def _code_phase_distance(a, b, n):
+  # Distance between code phase indices, wrapping around at `n`.
+  d = np.remainder(np.abs(a - b), n)
+  return np.minimum(d, n - d)
+
+
+def _max_outside(row, index, width):
+  # Greatest value of `row` more than `width` from `index`, wrapping around.
+  n = len(row)
+  lo = index - int(width)
+  hi = index + int(width) + 1
+  if lo < 0:
+    parts = [row[hi:n + lo]]
+  elif hi > n:
+    parts = [row[hi - n:lo]]
+  else:
+    parts = [row[:lo], row[hi:]]
+  parts = [part for part in parts if len(part)]
+  if not parts:
+    return -np.inf
+  return max(part.max() for part in parts)
+
+
+def _noise_stride(samples_per_chip):
+  # Step between the code phase samples the noise floor is estimated over, one
+  # per half chip.
+  return max(1, int(samples_per_chip / 2))
+
+
+class _SharedAcquisition(object):
+  # A picklable reference to the samples and settings of an Acquisition, sent
+  # to the persistent workers of Acquisition.acquisition. The samples are
+  # copied to shared memory once per call rather than with every task.
+
+  def __init__(self, acq):
+    from peregrine.parallel_processing import SharedArray
+    samples = np.asarray(acq.samples)
+    self.samples = SharedArray(samples.shape, samples.dtype)
+    self.samples.array[:] = samples
+    self.kwargs = acq.kwargs
+    # The plans found by this process, so the workers don't measure them
+    # again.
+    self.wisdom = pyfftw.export_wisdom()
+
+  def acquisition(self):
+    # The worker's Acquisition object for these samples. Like
+    # AcquisitionEngine, each worker keeps one and only recreates it if the
+    # settings change, so its FFT plans and buffers are reused between calls.
+    global _worker_acq, _worker_samples
+    if _worker_acq is None or _worker_acq.kwargs != self.kwargs:
+      pyfftw.import_wisdom(self.wisdom)
+      _worker_acq = Acquisition(self.samples.array, threads=1, **self.kwargs)
+    elif _worker_samples != self.samples.filename:
+      _worker_acq.init_samples(self.samples.array)
+    _worker_samples = self.samples.filename
+    return _worker_acq
+
+  def free(self):
+    self.samples.free()
+
+_worker_acq = None
+_worker_samples = None
+
+
+def _acquire_prn_shared(args):
+  # Acquires one PRN in a worker process for Acquisition.acquisition.
+  shared, prn, freqs, coarse_freqs, threshold, kwargs = args
+  acq = shared.acquisition()
+  freqs, results, noise_means = acq._acquire_prn(
+    prn, freqs, coarse_freqs=coarse_freqs, **kwargs)
+  return acq._make_results([prn], freqs, results, threshold, noise_means)[0]
+
+
+def next_fast_len(n, factors=(2, 3, 5, 7)):
+  """
+  Find the smallest FFT length of at least `n` that is fast to compute.
+
+  FFTW is fastest for lengths that are products of small primes.
+
+  Parameters
+  ----------
+  n : int
+    The minimum length.
+  factors : iterable, optional
+    The allowed prime factors.
+
+  Returns
+  -------
+  out : int
+    The smallest integer no smaller than `n` with no prime factors other than
+    `factors`.
+
+  """
+  n = int(n)
+  while True:
+    m = n
+    for factor in factors:
+      while m % factor == 0:
+        m //= factor
+    if m == 1:
+      return n
+    n += 1
+
+
+def hermitian_extend(half_ft, out):
+  """
+  Reconstruct the full spectrum of a real signal from its non-negative
+  frequency half.
+
+  The spectrum :math:`X` of a real signal of length :math:`N` satisfies
+  :math:`X[N-k] = X[k]^*` so the output of a real-to-complex FFT determines
+  the whole spectrum. Rotating the full spectrum then mixes the real signal
+  down to baseband exactly as for a complex signal.
+
+  Parameters
+  ----------
+  half_ft : :class:`numpy.ndarray`, shape(`N` // 2 + 1,)
+    Output of a real-to-complex FFT of length `N`.
+  out : :class:`numpy.ndarray`, shape(`N`,)
+    Array to write the full spectrum into.
+
+  Returns
+  -------
+  out : :class:`numpy.ndarray`, shape(`N`,)
+    The full spectrum, i.e. `out`.
+
+  """
+  n = len(out)
+  n_half = len(half_ft)
+  out[:n_half] = half_ft
+  np.conj(half_ft[n - n_half:0:-1], out=out[n_half:])
+  return out
+
+
+def plan_parallelism(fft_size, n_jobs, threads=None, n_cpus=None):
+  """
+  Choose between thread-level FFT parallelism and job-level process
+  parallelism for an acquisition.
+
+  Independent jobs, e.g. PRNs, are spread over processes first as this
+  scales best. Only when there are fewer jobs than CPUs are the spare CPUs
+  used as FFTW threads, and then only for transforms of at least
+  `THREADED_FFT_MIN_SIZE` points as small transforms do not parallelise well.
+
+  Parameters
+  ----------
+  fft_size : int
+    The FFT length.
+  n_jobs : int
+    The number of independent jobs (e.g. PRNs) to run.
+  threads : int or `None`, optional
+    If not `None` the number of FFT threads has already been fixed and only
+    the number of processes is chosen.
+  n_cpus : int or `None`, optional
+    The number of CPUs available, if `None` then
+    :func:`multiprocessing.cpu_count` is used.
+
+  Returns
+  -------
+  out : (int, int)
+    | The tuple
+    |   `(threads, nprocs)`
+    | Where `threads` is the number of threads to use per FFTW plan and
+      `nprocs` the number of processes to spread the jobs over.
+
+  """
+  if n_cpus is None:
+    n_cpus = mp.cpu_count()
+  if threads is None:
+    if fft_size >= THREADED_FFT_MIN_SIZE:
+      threads = max(1, n_cpus // max(1, n_jobs))
+    else:
+      threads = 1
+  nprocs = max(1, min(n_jobs, n_cpus // threads))
+  return threads, nprocs
+
+
+class CodeSpectrumCache(object):
+  """
+  Cache of the conjugate Fourier transforms of upsampled codes.
+
+  The transform of a code only depends on the PRN and the sampling parameters
+  so batch runs over many sample files only need to compute each one once.
+  Spectra are held in memory and, if `cache_dir` is given, stored on disk as
+  `.npy` files which are memory-mapped when loaded.
+
+  Parameters
+  ----------
+  cache_dir : string or `None`, optional
+    Directory in which to store the code spectra, created if it doesn't exist.
+    If `None` then spectra are only cached in memory.
+
+  """
+
+  def __init__(self, cache_dir=None):
+    self.cache_dir = cache_dir
+    self.spectra = {}
+
+  def filename(self, key):
+    """Get the filename under `cache_dir` used to store the spectrum `key`."""
+    (prn, sampling_freq, samples_per_chip, n_integrate, code_length, dtype,
+     fft_size, fft_size_mode) = key
+    return os.path.join(self.cache_dir,
+                        "code_ft_prn%02d_%.0fHz_%r_%d_%d_%s_%d%s.npy" %
+                        (prn + 1, sampling_freq, samples_per_chip,
+                         n_integrate, code_length, dtype,
+                         fft_size, fft_size_mode or ''))
+
+  def get(self, key):
+    """
+    Look up a code spectrum.
+
+    A file on disk that can't be read, e.g. because it was truncated, or
+    whose shape or type doesn't match `key` is treated as a miss so that it is
+    rewritten by :meth:`put`.
+
+    Returns
+    -------
+    out : :class:`numpy.ndarray` or `None`
+      The (read-only) spectrum or `None` if it is not in the cache.
+
+    """
+    if key in self.spectra:
+      return self.spectra[key]
+    if self.cache_dir is not None:
+      filename = self.filename(key)
+      try:
+        spectrum = np.load(filename, mmap_mode='r')
+      except IOError:
+        return None
+      except ValueError:
+        logger.warning("Ignoring corrupt code spectrum cache file '%s'.",
+                       filename)
+        return None
+      fft_size, dtype = key[6], key[5]
+      if spectrum.shape != (fft_size,) or spectrum.dtype != dtype:
+        logger.warning("Ignoring code spectrum cache file '%s' with shape %s "
+                       "and type %s.", filename, spectrum.shape,
+                       spectrum.dtype)
+        return None
+      self.spectra[key] = spectrum
+      return spectrum
+    return None
+
+  def put(self, key, spectrum):
+    """
+    Add a code spectrum to the cache.
+
+    A copy of `spectrum` is stored. On disk, the file is written to a
+    temporary name and then renamed so that concurrent processes never see a
+    partially written spectrum.
+
+    Returns
+    -------
+    out : :class:`numpy.ndarray`
+      The cached (read-only) copy of `spectrum`.
+
+    """
+    spectrum = np.array(spectrum)
+    spectrum.flags.writeable = False
+    self.spectra[key] = spectrum
+    if self.cache_dir is not None:
+      try:
+        if not os.path.isdir(self.cache_dir):
+          os.makedirs(self.cache_dir)
+        fd, tmp_filename = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+          np.save(f, spectrum)
+        os.rename(tmp_filename, self.filename(key))
+      except (IOError, OSError):
+        logger.warning("Couldn't save code spectrum to cache directory '%s'.",
+                       self.cache_dir)
+    return spectrum
+
+_code_spectrum_caches = {}
+
+def get_code_spectrum_cache(cache_dir=None):
+  """
+  Get the process-wide :class:`CodeSpectrumCache` for a cache directory.
+
+  All :class:`Acquisition` objects using the same `cache_dir` share the same
+  in-memory cache.
+
+  """
+  if cache_dir not in _code_spectrum_caches:
+    _code_spectrum_caches[cache_dir] = CodeSpectrumCache(cache_dir)
+  return _code_spectrum_caches[cache_dir]
+
+
+class WisdomStore(object):
+  """
+  A file of FFTW wisdom shared between processes.
+
+  The file holds the wisdom along with a record of the FFTW plans it was
+  generated for, as `(kind, size, dtype, threads)` tuples where `kind` is
+  `'r2c'` or `'c2c'`. Plain pickled wisdom files, as saved by earlier versions
+  of Peregrine, can also be loaded.
+
+  The file is only rewritten when new wisdom has been generated since it was
+  last loaded or saved. Saving holds an exclusive lock on a `.lock` file next
+  to it while wisdom saved by other processes in the meantime is merged in and
+  the file rewritten, so concurrent saves never lose each other's wisdom. The
+  file is written to a temporary name and then renamed so that readers never
+  see a partially written file.
+
+  Parameters
+  ----------
+  filename : string
+    Filename of the wisdom file, the directory is created if it doesn't exist.
+
+  Attributes
+  ----------
+  plans : set
+    The plans recorded in the file.
+
+  """
+
+  def __init__(self, filename):
+    self.filename = filename
+    self.plans = set()
+    self.wisdom = None
+    self.digest = None
+
+  @contextlib.contextmanager
+  def lock(self):
+    """
+    Context manager holding an exclusive lock on the wisdom file.
+
+    The lock is taken on a separate `.lock` file as the wisdom file itself is
+    replaced when saved.
+
+    """
+    with open(self.filename + '.lock', 'a') as f:
+      fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+      try:
+        yield
+      finally:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+  def load(self):
+    """
+    Import the wisdom from the file, unless its contents haven't changed since
+    it was last loaded or saved by this store.
+
+    Raises
+    ------
+    IOError
+      If the file can't be opened.
+
+    """
+    with open(self.filename, 'rb') as f:
+      data = f.read()
+    digest = hashlib.sha1(data).digest()
+    if digest == self.digest:
+      return
+    contents = cPickle.loads(data)
+    if isinstance(contents, dict):
+      wisdom, plans = contents['wisdom'], contents['plans']
+    else:
+      wisdom, plans = contents, []
+    pyfftw.import_wisdom(wisdom)
+    self.plans.update(plans)
+    self.wisdom = pyfftw.export_wisdom()
+    self.digest = digest
+
+  def save(self, plans=()):
+    """
+    Save the wisdom to the file if there is any new wisdom or plans.
+
+    Parameters
+    ----------
+    plans : iterable, optional
+      Plans to record as covered by the wisdom.
+
+    Returns
+    -------
+    out : bool
+      `True` if the file was written.
+
+    """
+    plans = set(plans)
+    if pyfftw.export_wisdom() == self.wisdom and plans <= self.plans:
+      return False
+
+    dirname = os.path.dirname(self.filename) or '.'
+    try:
+      if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+      with self.lock():
+        # Merge in anything saved by other processes since we last loaded.
+        try:
+          self.load()
+        except (IOError, EOFError, cPickle.UnpicklingError):
+          pass
+        self.plans.update(plans)
+        wisdom = pyfftw.export_wisdom()
+        data = cPickle.dumps({'wisdom': wisdom, 'plans': sorted(self.plans)},
+                             protocol=cPickle.HIGHEST_PROTOCOL)
+        fd, tmp_filename = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+          f.write(data)
+        os.rename(tmp_filename, self.filename)
+    except (IOError, OSError):
+      logger.warning("Couldn't save FFTW wisdom file '%s'.", self.filename)
+      return False
+    self.wisdom = wisdom
+    self.digest = hashlib.sha1(data).digest()
+    return True
+
+_wisdom_stores = {}
+
+def get_wisdom_store(filename):
+  """
+  Get the process-wide :class:`WisdomStore` for a wisdom file.
+
+  """
+  if filename not in _wisdom_stores:
+    _wisdom_stores[filename] = WisdomStore(filename)
+  return _wisdom_stores[filename]
 
 
 class AcquisitionResult:
@@ -531,18 +2060,34 @@ class AcquisitionResult:
       * `'A'` : The satellite has been successfully acquired.
       * `'-'` : The acquisition was not successful, the SNR was below the
                 acquisition threshold.
+  peak_ratio : float or `None`, optional
+    Ratio of the peak to the next strongest peak, see
+    :meth:`Acquisition.peak_statistics`.
+  noise_floor : float or `None`, optional
+    Mean correlation power of the noise, see
+    :meth:`Acquisition.peak_statistics`.
 
   """
 
-  __slots__ = ('prn', 'carr_freq', 'doppler', 'code_phase', 'snr', 'status')
+  __slots__ = ('prn', 'carr_freq', 'doppler', 'code_phase', 'snr', 'status',
+               'peak_ratio', 'noise_floor')
 
-  def __init__(self, prn, carr_freq, doppler, code_phase, snr, status):
+  def __init__(self, prn, carr_freq, doppler, code_phase, snr, status,
+               peak_ratio=None, noise_floor=None):
     self.prn = prn
     self.snr = snr
     self.carr_freq = carr_freq
     self.doppler = doppler
     self.code_phase = code_phase
     self.status = status
+    self.peak_ratio = peak_ratio
+    self.noise_floor = noise_floor
+
+  def __setstate__(self, state):
+    # Results saved before the detection statistics were added lack them.
+    self.peak_ratio = None
+    self.noise_floor = None
+    self.__dict__.update(state)
 
   def __str__(self):
     return "PRN %2d SNR %6.2f @ CP %6.1f, %+8.2f Hz %s" % \
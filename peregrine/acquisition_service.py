@@ -0,0 +1,446 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2014 Swift Navigation Inc.
+#
+# This source is subject to the license found in the file 'LICENSE' which must
+# be be distributed together with this source. All other rights reserved.
+#
+# THIS CODE AND INFORMATION IS PROVIDED "AS IS" WITHOUT WARRANTY OF ANY KIND,
+# EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A PARTICULAR PURPOSE.
+
+"""
+A long-lived acquisition engine for processing many sample captures.
+
+Creating an :class:`peregrine.acquisition.Acquisition` object loads FFTW
+wisdom, plans the FFTs and allocates aligned buffers, which can take longer
+than the acquisition itself for a short capture. :class:`AcquisitionEngine`
+keeps one :class:`peregrine.acquisition.Acquisition` object alive and feeds
+each new capture to it with :meth:`Acquisition.init_samples
+<peregrine.acquisition.Acquisition.init_samples>`, so the plans, buffers and
+code spectra are reused.
+
+The engine can be driven from another process through a local socket with
+:func:`serve` and :func:`request`, or from the command line with
+``peregrine-acq-service``. Messages are pickled, so connections are always
+authenticated with a key that only the user running the service can read, see
+:func:`load_key`.
+
+"""
+
+import os
+import sys
+import time
+import errno
+import argparse
+import binascii
+import tempfile
+import traceback
+import numpy as np
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client
+
+import peregrine.defaults as defaults
+from peregrine.samples import load_samples
+from peregrine.acquisition import Acquisition, save_acq_results
+from peregrine.acquisition import DEFAULT_WISDOM_FILE
+from peregrine.log import default_logging_config
+from peregrine.initSettings import initSettings
+
+__all__ = ['AcquisitionEngine', 'serve', 'request', 'load_key',
+           'DEFAULT_ADDRESS', 'DEFAULT_KEY_FILE']
+
+import logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_ADDRESS = ('localhost', 6001)
+"""The default address that :func:`serve` listens on."""
+
+DEFAULT_KEY_FILE = "acq_service_key"
+"""The default filename, in the cache directory, of the key that connections
+to the service are authenticated with."""
+
+
+class AcquisitionEngine(object):
+  """
+  Acquires on a stream of sample captures with a single, persistent
+  :class:`peregrine.acquisition.Acquisition` object.
+
+  The :class:`peregrine.acquisition.Acquisition` object is created for the
+  first capture and only recreated if a later capture switches between real
+  and complex samples, as that changes the FFT plans needed.
+
+  Parameters
+  ----------
+  acquisition_kwargs : dict, optional
+    Passed to :meth:`Acquisition.acquisition
+    <peregrine.acquisition.Acquisition.acquisition>` for each capture, unless
+    overridden in the call to :meth:`acquire`.
+  **kwargs
+    Passed to the :class:`peregrine.acquisition.Acquisition` constructor.
+
+  Attributes
+  ----------
+  n_captures : int
+    Number of captures acquired.
+  n_samples : int
+    Total number of samples acquired on.
+  busy_time : float
+    Total time in seconds spent acquiring, including loading sample files.
+
+  """
+
+  def __init__(self, acquisition_kwargs={}, **kwargs):
+    self.acquisition_kwargs = dict(show_progress=False)
+    self.acquisition_kwargs.update(acquisition_kwargs)
+    self.kwargs = kwargs
+    self.acq = None
+    self.n_captures = 0
+    self.n_samples = 0
+    self.busy_time = 0.0
+    self.start_time = time.time()
+
+  def acquire(self, samples, **acquisition_kwargs):
+    """
+    Acquire on a block of samples.
+
+    Parameters
+    ----------
+    samples : :class:`numpy.ndarray`
+      Samples to acquire on.
+    **acquisition_kwargs
+      Passed to :meth:`Acquisition.acquisition
+      <peregrine.acquisition.Acquisition.acquisition>`.
+
+    Returns
+    -------
+    out : [:class:`peregrine.acquisition.AcquisitionResult`]
+      The acquisition results, one per PRN searched.
+
+    """
+    t0 = time.time()
+    real = not np.iscomplexobj(samples)
+    if self.acq is None or self.acq.real != real:
+      self.acq = Acquisition(samples, **self.kwargs)
+    else:
+      self.acq.init_samples(samples)
+
+    kwargs = dict(self.acquisition_kwargs)
+    kwargs.update(acquisition_kwargs)
+    acq_results = self.acq.acquisition(**kwargs)
+
+    self.n_captures += 1
+    self.n_samples += len(samples)
+    self.busy_time += time.time() - t0
+    return acq_results
+
+  def acquire_file(self, filename, file_format=defaults.file_format,
+                   num_samples=None, num_skip=0, results_file=None,
+                   **acquisition_kwargs):
+    """
+    Load samples from a file and acquire on them.
+
+    Parameters
+    ----------
+    filename : string
+      Filename of the sample data file.
+    file_format : string, optional
+      Format of the sample data file, see
+      :func:`peregrine.samples.load_samples`.
+    num_samples : int or `None`, optional
+      Number of samples to load, if `None` then 11 code periods are loaded as
+      in :func:`peregrine.run.main`.
+    num_skip : int, optional
+      Number of samples to skip from the beginning of the file.
+    results_file : string or `None`, optional
+      If not `None`, the acquisition results are also saved to this file with
+      :func:`peregrine.acquisition.save_acq_results`.
+    **acquisition_kwargs
+      Passed to :meth:`acquire`.
+
+    Returns
+    -------
+    out : [:class:`peregrine.acquisition.AcquisitionResult`]
+      The acquisition results, one per PRN searched.
+
+    """
+    t0 = time.time()
+    if num_samples is None:
+      samples_per_code = self.kwargs.get('samples_per_code',
+                                         defaults.samples_per_code)
+      num_samples = 11 * int(round(samples_per_code))
+    samples = load_samples(filename, num_samples, num_skip,
+                           file_format=file_format)
+    t_load = time.time() - t0
+
+    acq_results = self.acquire(samples, **acquisition_kwargs)
+    self.busy_time += t_load
+
+    if results_file is not None:
+      save_acq_results(results_file, acq_results)
+    return acq_results
+
+  def throughput(self):
+    """
+    Number of captures acquired per second of busy time, or zero if nothing
+    has been acquired yet.
+
+    """
+    if self.busy_time == 0:
+      return 0.0
+    return self.n_captures / self.busy_time
+
+  def stats(self):
+    """
+    Get the engine's counters.
+
+    Returns
+    -------
+    out : dict
+      Dictionary with keys `'n_captures'`, `'n_samples'`, `'busy_time'`,
+      `'uptime'` (in seconds) and `'throughput'` (see :meth:`throughput`).
+
+    """
+    return {'n_captures': self.n_captures,
+            'n_samples': self.n_samples,
+            'busy_time': self.busy_time,
+            'uptime': time.time() - self.start_time,
+            'throughput': self.throughput()}
+
+
+def load_key(filename=None, create=False):
+  """
+  Load the key used to authenticate connections to the acquisition service.
+
+  The key file must be owned by the current user and not be accessible by
+  anyone else, as anyone holding the key can send the service pickled
+  messages, and unpickling can run arbitrary code.
+
+  Parameters
+  ----------
+  filename : string or `None`, optional
+    Filename of the key file, if `None` then `DEFAULT_KEY_FILE` in the cache
+    directory is used.
+  create : bool, optional
+    If `True` and the file doesn't exist, a new random key is written to it,
+    readable only by the current user.
+
+  Returns
+  -------
+  out : string
+    The key.
+
+  Raises
+  ------
+  IOError
+    If the file doesn't exist and `create` is `False`, or if it is empty, not
+    owned by the current user or accessible by other users.
+
+  """
+  if filename is None:
+    filename = os.path.join(initSettings().cacheDir, DEFAULT_KEY_FILE)
+
+  if create and not os.path.exists(filename):
+    dirname = os.path.dirname(filename) or '.'
+    if not os.path.isdir(dirname):
+      os.makedirs(dirname)
+    # The temporary file is created readable only by us and linked into place
+    # so that a key file is never seen half written or overwritten.
+    fd, tmp_filename = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+    try:
+      with os.fdopen(fd, 'wb') as f:
+        f.write(binascii.hexlify(os.urandom(32)))
+      try:
+        os.link(tmp_filename, filename)
+      except OSError as e:
+        if e.errno != errno.EEXIST:
+          raise
+    finally:
+      os.unlink(tmp_filename)
+
+  with open(filename, 'rb') as f:
+    st = os.fstat(f.fileno())
+    if st.st_uid != os.getuid() or st.st_mode & 0077:
+      raise IOError("Acquisition service key file '%s' must be owned by and "
+                    "only accessible to the current user." % filename)
+    key = f.read().strip()
+  if not key:
+    raise IOError("Acquisition service key file '%s' is empty." % filename)
+  return key
+
+
+def serve(engine, address=DEFAULT_ADDRESS, authkey=None):
+  """
+  Serve acquisition requests from other processes until asked to shut down.
+
+  Requests are handled one connection at a time, in order. Each message on a
+  connection is a tuple whose first element names the request:
+
+    * `('acquire', filename, kwargs)` : Call
+      :meth:`AcquisitionEngine.acquire_file` with `filename` and the
+      dictionary `kwargs`, replying with the acquisition results.
+    * `('stats',)` : Reply with :meth:`AcquisitionEngine.stats`.
+    * `('shutdown',)` : Reply with `None` and stop serving.
+
+  Replies are tuples `('ok', value)` or, if the request raised an exception,
+  `('error', traceback)` where `traceback` is the formatted traceback string.
+
+  Messages are pickled, and unpickling a message can run arbitrary code, so
+  connections are always authenticated. Connections that fail to
+  authenticate are dropped.
+
+  Parameters
+  ----------
+  engine : :class:`AcquisitionEngine`
+    The engine used to handle requests.
+  address : (string, int) or string, optional
+    Address to listen on, see :class:`multiprocessing.connection.Listener`.
+  authkey : string or `None`, optional
+    Authentication key that clients must present. If `None` the key is loaded
+    from the default key file, which is created if needed, see
+    :func:`load_key`.
+
+  """
+  if authkey is None:
+    authkey = load_key(create=True)
+  listener = Listener(address, authkey=authkey)
+  logger.info("Acquisition service listening on %s", listener.address)
+  try:
+    running = True
+    while running:
+      try:
+        conn = listener.accept()
+      except (AuthenticationError, EOFError, IOError):
+        logger.warning("Rejected acquisition service connection that failed "
+                       "to authenticate.")
+        continue
+      try:
+        while running:
+          try:
+            msg = conn.recv()
+          except EOFError:
+            break
+          try:
+            if msg[0] == 'acquire':
+              _, filename, kwargs = msg
+              reply = ('ok', engine.acquire_file(filename, **kwargs))
+              logger.info("Acquired '%s', %.2f captures/s", filename,
+                          engine.throughput())
+            elif msg[0] == 'stats':
+              reply = ('ok', engine.stats())
+            elif msg[0] == 'shutdown':
+              reply = ('ok', None)
+              running = False
+            else:
+              raise ValueError("Unknown request '%s'" % (msg[0],))
+          except Exception:
+            logger.exception("Request %r failed", msg)
+            reply = ('error', traceback.format_exc())
+          conn.send(reply)
+      finally:
+        conn.close()
+  finally:
+    listener.close()
+  logger.info("Acquisition service stopped")
+
+
+def request(msg, address=DEFAULT_ADDRESS, authkey=None):
+  """
+  Send a request to an acquisition service started with :func:`serve`.
+
+  Parameters
+  ----------
+  msg : tuple
+    The request, see :func:`serve`.
+  address : (string, int) or string, optional
+    Address of the service.
+  authkey : string or `None`, optional
+    Authentication key of the service, if `None` then the key is loaded from
+    the default key file, see :func:`load_key`.
+
+  Returns
+  -------
+  out : object
+    The value replied by the service.
+
+  Raises
+  ------
+  RuntimeError
+    If the request failed in the service, the message contains the service's
+    traceback.
+
+  """
+  if authkey is None:
+    authkey = load_key()
+  conn = Client(address, authkey=authkey)
+  try:
+    conn.send(msg)
+    status, value = conn.recv()
+  finally:
+    conn.close()
+  if status == 'error':
+    raise RuntimeError("Acquisition service request failed:\n" + value)
+  return value
+
+
+def main():
+  default_logging_config()
+
+  parser = argparse.ArgumentParser()
+  parser.add_argument("command", choices=['serve', 'acquire', 'stats',
+                                          'shutdown'],
+                      help="run the service, or send it a request")
+  parser.add_argument("files", nargs='*',
+                      help="sample data files to acquire on")
+  parser.add_argument("-f", "--file-format", default=defaults.file_format,
+                      help="the format of the sample data files "
+                      "(e.g. 'piksi', 'int8', '1bit', '1bitrev')")
+  parser.add_argument("-p", "--port", type=int, default=DEFAULT_ADDRESS[1],
+                      help="local port the service listens on")
+  parser.add_argument("-n", "--n-codes-integrate", type=int, default=4,
+                      help="number of code periods to integrate over")
+  parser.add_argument("-k", "--key-file",
+                      help="file holding the key that connections are "
+                      "authenticated with (default: %s in the cache "
+                      "directory)" % DEFAULT_KEY_FILE)
+  args = parser.parse_args()
+  address = (DEFAULT_ADDRESS[0], args.port)
+
+  try:
+    authkey = load_key(args.key_file, create=args.command == 'serve')
+  except IOError as e:
+    logger.critical("Couldn't load the acquisition service key: %s", e)
+    sys.exit(1)
+
+  if args.command == 'serve':
+    settings = initSettings()
+    engine = AcquisitionEngine(n_codes_integrate=args.n_codes_integrate,
+                               wisdom_file=os.path.join(settings.cacheDir,
+                                                        DEFAULT_WISDOM_FILE),
+                               code_cache_dir=settings.cacheDir)
+    serve(engine, address, authkey)
+
+  elif args.command == 'acquire':
+    for filename in args.files:
+      kwargs = {'file_format': args.file_format,
+                'results_file': filename + ".acq_results"}
+      try:
+        acq_results = request(('acquire', filename, kwargs), address,
+                              authkey)
+      except RuntimeError as e:
+        logger.error(str(e))
+        sys.exit(1)
+      for acq_result in acq_results:
+        if acq_result.status == 'A':
+          print acq_result
+
+  elif args.command == 'stats':
+    stats = request(('stats',), address, authkey)
+    for key in sorted(stats):
+      print "%s: %s" % (key, stats[key])
+
+  elif args.command == 'shutdown':
+    request(('shutdown',), address, authkey)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,512 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2014 Swift Navigation Inc.
+#
+# This source is subject to the license found in the file 'LICENSE' which must
+# be be distributed together with this source. All other rights reserved.
+#
+# THIS CODE AND INFORMATION IS PROVIDED "AS IS" WITHOUT WARRANTY OF ANY KIND,
+# EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A PARTICULAR PURPOSE.
+
+"""Functions for benchmarking the performance critical parts of Peregrine."""
+
+import time
+import argparse
+import multiprocessing as mp
+import numpy as np
+
+import peregrine.defaults as defaults
+from peregrine.acquisition import Acquisition
+from peregrine.include.generateCAcode import caCodes
+import peregrine.correlator
+from peregrine.samples import decode_samples
+
+__all__ = ['random_samples', 'synthetic_samples', 'time_call',
+           'acquisition_engines', 'acquisition_precision',
+           'acquisition_fft_sizes', 'acquisition_parallelism',
+           'tracking_correlators', 'sample_decoding']
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def random_samples(n_samples, seed=0):
+  """
+  Generate a block of random 3-bit samples.
+
+  Acquisition and tracking run times do not depend on the signal content so
+  random samples are sufficient for benchmarking.
+
+  Parameters
+  ----------
+  n_samples : int
+    Number of samples to generate.
+  seed : int, optional
+    Seed for the random number generator so benchmarks are repeatable.
+
+  Returns
+  -------
+  out : :class:`numpy.ndarray`, shape(`n_samples`,)
+    Array of `int8` samples taking the values +/-1, +/-3, +/-5, +/-7.
+
+  """
+  rng = np.random.RandomState(seed)
+  return (2 * rng.randint(-4, 4, n_samples) + 1).astype(np.int8)
+
+
+def synthetic_samples(n_samples, signals, noise_std=8.0, seed=0,
+                      sampling_freq=defaults.sampling_freq, IF=defaults.IF,
+                      chipping_rate=defaults.chipping_rate):
+  """
+  Generate 3-bit samples containing C/A code signals in noise.
+
+  Parameters
+  ----------
+  n_samples : int
+    Number of samples to generate.
+  signals : [(int, float, float)]
+    List of `(prn, code_phase, doppler)` tuples, one per signal, with `prn`
+    0-indexed, `code_phase` in chips (as reported by acquisition) and
+    `doppler` in Hz.
+  noise_std : float, optional
+    Standard deviation of the noise relative to a signal amplitude of one.
+  seed : int, optional
+    Seed for the random number generator so benchmarks are repeatable.
+
+  Returns
+  -------
+  out : :class:`numpy.ndarray`, shape(`n_samples`,)
+    Array of `int8` samples taking the values +/-1, +/-3, +/-5, +/-7.
+
+  """
+  rng = np.random.RandomState(seed)
+  t = np.arange(n_samples) / sampling_freq
+  signal = noise_std * rng.randn(n_samples)
+  for prn, code_phase, doppler in signals:
+    code_freq = chipping_rate * (1 + doppler / 1.57542e9)
+    chips = np.asarray(np.floor(t * code_freq - code_phase), dtype=np.int)
+    code = caCodes[prn][np.remainder(chips, len(caCodes[prn]))]
+    signal += code * np.cos(2 * np.pi * (IF + doppler) * t)
+  # Quantize to 3-bit sign-magnitude levels.
+  scale = 3.0 / noise_std
+  samples = 2 * np.floor(np.clip(signal * scale, -4, 3.999)) + 1
+  return samples.astype(np.int8)
+
+
+def time_call(f, repeat=3):
+  """
+  Time a function call.
+
+  Parameters
+  ----------
+  f : callable
+    Function taking no arguments to time.
+  repeat : int, optional
+    Number of times to call `f`.
+
+  Returns
+  -------
+  out : float
+    The shortest of the `repeat` run times in seconds.
+
+  """
+  best = None
+  for _ in range(repeat):
+    t0 = time.time()
+    f()
+    t = time.time() - t0
+    if best is None or t < best:
+      best = t
+  return best
+
+
+def acquisition_engines(samples=None,
+                        n_codes_integrate=4,
+                        doppler_search=7000,
+                        prns=range(4),
+                        wisdom_file=None,
+                        repeat=3):
+  """
+  Compare the per-PRN run time of the acquisition engines.
+
+  Parameters
+  ----------
+  samples : :class:`numpy.ndarray` or `None`, optional
+    Samples to acquire on, if `None` then random samples are used.
+  n_codes_integrate : int, optional
+    Number of code periods to integrate over.
+  doppler_search : float, optional
+    Maximum Doppler frequency to search in Hz.
+  prns : iterable, optional
+    List of PRNs (0-indexed) to time.
+  wisdom_file : string or `None`, optional
+    FFTW wisdom file passed to :class:`peregrine.acquisition.Acquisition`.
+  repeat : int, optional
+    Number of times to repeat each measurement.
+
+  Returns
+  -------
+  out : dict
+    Mapping from engine name to the mean time per PRN in seconds.
+
+  """
+  samples_per_code = int(round(defaults.samples_per_code))
+  if samples is None:
+    samples = random_samples(3 * n_codes_integrate * samples_per_code)
+
+  acq = Acquisition(samples, n_codes_integrate=n_codes_integrate,
+                    wisdom_file=wisdom_file)
+  doppler_step = acq.sampling_freq / acq.n_integrate
+  freqs = np.arange(-doppler_search, doppler_search, doppler_step) + acq.IF
+
+  engines = [('loop', False), ('batch', True)]
+  timings = {}
+  for name, batch in engines:
+    acq.batch = batch
+    # Run once before timing so plan creation is not included.
+    acq.acquire(caCodes[prns[0]], freqs)
+    t = time_call(lambda: [acq.acquire(caCodes[prn], freqs) for prn in prns],
+                  repeat)
+    timings[name] = t / len(prns)
+
+  return timings
+
+
+def acquisition_precision(signals=((0, 123.4, 1250.0), (14, 512.0, -3300.0),
+                                   (27, 998.7, 40.0)),
+                          n_codes_integrate=4,
+                          wisdom_file=None,
+                          repeat=3):
+  """
+  Compare the run time of single and double precision acquisition.
+
+  Synthetic signals are acquired with both `numpy.complex128` and
+  `numpy.complex64` :class:`peregrine.acquisition.Acquisition` objects. The
+  results are returned for inspection, their agreement is checked by the
+  test suite.
+
+  Parameters
+  ----------
+  signals : [(int, float, float)]
+    List of `(prn, code_phase, doppler)` tuples, see
+    :func:`synthetic_samples`.
+  n_codes_integrate : int, optional
+    Number of code periods to integrate over.
+  wisdom_file : string or `None`, optional
+    FFTW wisdom file passed to :class:`peregrine.acquisition.Acquisition`.
+  repeat : int, optional
+    Number of times to repeat each timing measurement.
+
+  Returns
+  -------
+  out : dict
+    Mapping from dtype name to a tuple of the mean time per PRN in seconds
+    and the list of :class:`peregrine.acquisition.AcquisitionResult` objects.
+
+  """
+  samples_per_code = int(round(defaults.samples_per_code))
+  samples = synthetic_samples(3 * n_codes_integrate * samples_per_code,
+                              signals)
+  prns = [prn for prn, _, _ in signals]
+
+  results = {}
+  for dtype in (np.complex128, np.complex64):
+    acq = Acquisition(samples, n_codes_integrate=n_codes_integrate,
+                      wisdom_file=wisdom_file, dtype=dtype)
+    acq_results = acq.acquisition(prns, show_progress=False, multi=False)
+    t = time_call(lambda: acq.acquisition(prns, show_progress=False,
+                                          multi=False), repeat)
+    results[np.dtype(dtype).name] = (t / len(prns), acq_results)
+
+  return results
+
+
+def acquisition_fft_sizes(samples=None,
+                          n_codes_integrate=15,
+                          doppler_search=7000,
+                          prns=range(4),
+                          wisdom_file=None,
+                          repeat=3):
+  """
+  Compare acquisition with the natural, padded and resampled FFT lengths.
+
+  Parameters
+  ----------
+  samples : :class:`numpy.ndarray` or `None`, optional
+    Samples to acquire on, if `None` then random samples are used.
+  n_codes_integrate : int, optional
+    Number of code periods to integrate over.
+  doppler_search : float, optional
+    Maximum Doppler frequency to search in Hz.
+  prns : iterable, optional
+    List of PRNs (0-indexed) to time.
+  wisdom_file : string or `None`, optional
+    FFTW wisdom file passed to :class:`peregrine.acquisition.Acquisition`.
+  repeat : int, optional
+    Number of times to repeat each measurement.
+
+  Returns
+  -------
+  out : dict
+    Mapping from FFT size mode to a tuple of the FFT length, the time taken
+    to create the :class:`peregrine.acquisition.Acquisition` object (mostly
+    FFTW planning) and the mean time per PRN, both in seconds. Each PRN is
+    searched at the default Doppler step for that mode.
+
+  """
+  samples_per_code = int(round(defaults.samples_per_code))
+  if samples is None:
+    samples = random_samples(3 * (n_codes_integrate + 1) * samples_per_code)
+
+  timings = {}
+  for mode in (None, 'pad', 'resample'):
+    t0 = time.time()
+    acq = Acquisition(samples, n_codes_integrate=n_codes_integrate,
+                      wisdom_file=wisdom_file, fft_size=mode)
+    t_plan = time.time() - t0
+    doppler_step = acq.sampling_freq * acq.resample_ratio / acq.fft_size
+    freqs = np.arange(-doppler_search, doppler_search, doppler_step) + acq.IF
+    t = time_call(lambda: [acq.acquire(caCodes[prn], freqs) for prn in prns],
+                  repeat)
+    timings[mode or 'none'] = (acq.fft_size, t_plan, t / len(prns))
+
+  return timings
+
+
+def acquisition_parallelism(samples=None,
+                            n_codes_integrate=(1, 2, 4, 8, 15),
+                            doppler_search=7000,
+                            prns=range(4),
+                            n_cpus=None,
+                            wisdom_file=None,
+                            repeat=3):
+  """
+  Compare multithreaded FFTs against one process per PRN for acquisition.
+
+  This is the measurement behind
+  :data:`peregrine.acquisition.THREADED_FFT_MIN_SIZE`, the transform size
+  from which the threaded FFTs should win.
+
+  Parameters
+  ----------
+  samples : :class:`numpy.ndarray` or `None`, optional
+    Samples to acquire on, if `None` then random samples are used.
+  n_codes_integrate : iterable, optional
+    Numbers of code periods to integrate over, one measurement each.
+  doppler_search : float, optional
+    Maximum Doppler frequency to search in Hz.
+  prns : iterable, optional
+    List of PRNs (0-indexed) to acquire.
+  n_cpus : int or `None`, optional
+    Number of threads and processes to use, if `None` then
+    :func:`multiprocessing.cpu_count` is used.
+  wisdom_file : string or `None`, optional
+    FFTW wisdom file passed to :class:`peregrine.acquisition.Acquisition`.
+  repeat : int, optional
+    Number of times to repeat each measurement.
+
+  Returns
+  -------
+  out : dict
+    Mapping from FFT length to a tuple of the time in seconds to acquire all
+    of `prns` with `n_cpus` FFT threads in this process, and with single
+    threaded FFTs in up to `n_cpus` processes.
+
+  """
+  if n_cpus is None:
+    n_cpus = mp.cpu_count()
+  samples_per_code = int(round(defaults.samples_per_code))
+  if samples is None:
+    samples = random_samples(3 * max(n_codes_integrate) * samples_per_code)
+
+  timings = {}
+  for n in n_codes_integrate:
+    times = []
+    for threads in (n_cpus, 1):
+      acq = Acquisition(samples, n_codes_integrate=n, wisdom_file=wisdom_file,
+                        threads=threads)
+      times.append(time_call(
+        lambda: acq.acquisition(prns, doppler_search=doppler_search,
+                                show_progress=False, multi=threads == 1),
+        repeat))
+    timings[acq.fft_size] = tuple(times)
+
+  return timings
+
+
+def tracking_correlators(prn=0, doppler=1250.0, n_blocks=100, noise_std=1.0,
+                         correlators=None, repeat=3):
+  """
+  Compare the run time and correlation loss of the tracking correlators.
+
+  A synthetic signal is correlated code period by code period with replicas
+  aligned to it, as by a tracking loop in lock. The loss of each correlator
+  is measured against :func:`peregrine.correlator.track_correlate`, which
+  evaluates the replicas exactly.
+
+  Parameters
+  ----------
+  prn : int, optional
+    PRN (0-indexed) of the synthetic signal.
+  doppler : float, optional
+    Doppler frequency of the synthetic signal in Hz.
+  n_blocks : int, optional
+    Number of code periods to correlate.
+  noise_std : float, optional
+    Standard deviation of the noise, see :func:`synthetic_samples`.
+  correlators : dict or `None`, optional
+    Mapping from name to correlator to compare. If `None` then
+    :func:`swiftnav.correlate.track_correlate` (if available),
+    :func:`peregrine.correlator.track_correlate` and
+    :class:`peregrine.correlator.LUTCorrelator` with 16, 64 and 256 carrier
+    phase steps are compared.
+  repeat : int, optional
+    Number of times to repeat each measurement.
+
+  Returns
+  -------
+  out : dict
+    Mapping from correlator name to a tuple of the mean time per code period
+    in seconds and the correlation loss in dB, the ratio of the mean prompt
+    correlation magnitude to the exact one.
+
+  """
+  if correlators is None:
+    correlators = {'numpy': peregrine.correlator.track_correlate}
+    for steps in (16, 64, 256):
+      correlators['lut%d' % steps] = peregrine.correlator.LUTCorrelator(steps)
+    try:
+      import swiftnav.correlate
+      correlators['swiftnav'] = swiftnav.correlate.track_correlate
+    except ImportError:
+      logger.warning("swiftnav not available, not benchmarking its correlator")
+
+  samples_per_code = int(round(defaults.samples_per_code))
+  samples = synthetic_samples((n_blocks + 2) * samples_per_code,
+                              [(prn, 0.0, doppler)], noise_std=noise_std)
+  code = np.concatenate(([caCodes[prn][-1]], caCodes[prn], [caCodes[prn][0]]))
+  code_freq = defaults.chipping_rate * (1 + doppler / 1.57542e9)
+  carr_freq = defaults.IF + doppler
+
+  def run(correlator):
+    sample_index = 0
+    code_phase = 0.0
+    carr_phase = 0.0
+    P = np.empty(n_blocks, dtype=np.complex128)
+    for n in range(n_blocks):
+      _, P[n], _, blksize, code_phase, carr_phase = correlator(
+        samples[sample_index:], code_freq, code_phase, carr_freq, carr_phase,
+        code, defaults.sampling_freq)
+      sample_index += blksize
+    return P
+
+  reference = np.mean(np.abs(run(peregrine.correlator.track_correlate)))
+  results = {}
+  for name, correlator in correlators.iteritems():
+    loss = 20 * np.log10(np.mean(np.abs(run(correlator))) / reference)
+    t = time_call(lambda: run(correlator), repeat)
+    results[name] = (t / n_blocks, loss)
+
+  return results
+
+
+def sample_decoding(n_bytes=2**22, file_formats=('piksi', 'piksinew', '1bit',
+                                                 '1bitrev'), repeat=3):
+  """
+  Measure the throughput of decoding sample data files.
+
+  Random bytes are decoded with :func:`peregrine.samples.decode_samples` into
+  a preallocated output buffer, as when reading a file in blocks.
+
+  Parameters
+  ----------
+  n_bytes : int, optional
+    Number of bytes to decode.
+  file_formats : sequence of strings, optional
+    File formats to measure, see :func:`peregrine.samples.load_samples`.
+  repeat : int, optional
+    Number of times to repeat each measurement.
+
+  Returns
+  -------
+  out : dict
+    Mapping from file format to a tuple of the throughput in MB/s of file
+    data and in millions of samples per second.
+
+  """
+  packed = np.random.RandomState(0).randint(0, 256, n_bytes).astype(np.uint8)
+  results = {}
+  for file_format in file_formats:
+    out = decode_samples(packed, file_format)
+    n_samples = len(out)
+    t = time_call(lambda: decode_samples(packed, file_format, out), repeat)
+    results[file_format] = (n_bytes / t * 1e-6, n_samples / t * 1e-6)
+  return results
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("benchmark", nargs='?', default='acquisition',
+                      choices=['acquisition', 'precision', 'fft-size',
+                               'parallelism', 'correlator', 'decoding'],
+                      help="the benchmark to run")
+  parser.add_argument("-n", "--n-codes-integrate", type=int, default=4,
+                      help="number of code periods to integrate over")
+  parser.add_argument("-r", "--repeat", type=int, default=3,
+                      help="number of times to repeat each measurement")
+  args = parser.parse_args()
+
+  if args.benchmark == 'acquisition':
+    timings = acquisition_engines(n_codes_integrate=args.n_codes_integrate,
+                                  repeat=args.repeat)
+    print "Acquisition, %d ms integration:" % args.n_codes_integrate
+    for name in sorted(timings):
+      print "  %-8s %8.1f ms/PRN  (x%.2f)" % (name, timings[name] * 1e3,
+                                             timings['loop'] / timings[name])
+
+  elif args.benchmark == 'precision':
+    results = acquisition_precision(n_codes_integrate=args.n_codes_integrate,
+                                    repeat=args.repeat)
+    print "Acquisition precision, %d ms integration:" % args.n_codes_integrate
+    for name in sorted(results):
+      t, acq_results = results[name]
+      print "  %-10s %8.1f ms/PRN" % (name, t * 1e3)
+      for acq_result in acq_results:
+        print "    %s" % acq_result
+
+  elif args.benchmark == 'fft-size':
+    timings = acquisition_fft_sizes(n_codes_integrate=args.n_codes_integrate,
+                                    repeat=args.repeat)
+    print "Acquisition FFT size, %d ms integration:" % args.n_codes_integrate
+    for name in sorted(timings):
+      fft_size, t_plan, t = timings[name]
+      print "  %-8s %8d  plan %8.1f s  %8.1f ms/PRN" % (name, fft_size, t_plan,
+                                                       t * 1e3)
+
+  elif args.benchmark == 'parallelism':
+    timings = acquisition_parallelism(repeat=args.repeat)
+    print "Acquisition parallelism, %d CPUs:" % mp.cpu_count()
+    for fft_size in sorted(timings):
+      t_threads, t_procs = timings[fft_size]
+      print "  %8d  threads %8.1f ms  processes %8.1f ms  (x%.2f)" % (
+        fft_size, t_threads * 1e3, t_procs * 1e3, t_procs / t_threads)
+
+  elif args.benchmark == 'correlator':
+    results = tracking_correlators(repeat=args.repeat)
+    samples_per_code = defaults.samples_per_code
+    print "Tracking correlators:"
+    for name in sorted(results):
+      t, loss = results[name]
+      print "  %-8s %8.3f ms/code  %6.1f Msps  loss %7.4f dB" % (
+        name, t * 1e3, samples_per_code / t * 1e-6, loss)
+
+  elif args.benchmark == 'decoding':
+    results = sample_decoding(repeat=args.repeat)
+    print "Sample decoding:"
+    for name in sorted(results):
+      mb_per_s, msps = results[name]
+      print "  %-8s %8.1f MB/s  %8.1f Msps" % (name, mb_per_s, msps)
+
+if __name__ == "__main__":
+  main()
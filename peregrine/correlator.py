@@ -0,0 +1,352 @@
+# Copyright (C) 2014 Swift Navigation Inc.
+#
+# This source is subject to the license found in the file 'LICENSE' which must
+# be be distributed together with this source. All other rights reserved.
+#
+# THIS CODE AND INFORMATION IS PROVIDED "AS IS" WITHOUT WARRANTY OF ANY KIND,
+# EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A PARTICULAR PURPOSE.
+
+"""
+Correlators for tracking implemented with NumPy.
+
+These follow the conventions of :func:`swiftnav.correlate.track_correlate`.
+Each call correlates the samples from the current code phase up to the next
+code rollover against early, prompt and late code replicas, spaced half a chip
+apart, and a carrier replica. The code arrays have one chip of padding from
+the other end of the code at each end so that the early and late replicas can
+be looked up directly. The in-phase correlation is with the sine of the
+carrier phase and the quadrature correlation with the cosine, the
+correlations are returned as complex numbers :math:`I + Qj`.
+
+"""
+
+import numpy as np
+
+__all__ = ['track_correlate', 'track_correlate_multi',
+           'track_correlate_block', 'LUTCorrelator']
+
+CARRIER_FINE_STEPS = 128
+"""Length of the fine carrier table, see :func:`track_correlate_multi`."""
+
+
+def track_correlate_multi(samples, sample_indices, code_freqs, code_phases,
+                          carr_freqs, carr_phases, codes, sampling_freq,
+                          code_length=1023):
+  """
+  Correlate the next code period of several channels at once.
+
+  The blocks of all the channels are processed as the rows of 2D arrays, so
+  the Python overhead is paid once per call rather than once per channel.
+  The samples are only multiplied by the carrier replica, the code replicas
+  are applied to sums of the baseband over each half chip.
+
+  Parameters
+  ----------
+  samples : :class:`numpy.ndarray`
+    Samples to correlate.
+  sample_indices : array_like of int, shape(`n_channels`,)
+    Index in `samples` of the first sample to correlate for each channel.
+  code_freqs : array_like, shape(`n_channels`,)
+    Code phase rates in chips per second.
+  code_phases : array_like, shape(`n_channels`,)
+    Code phases of the first samples in chips.
+  carr_freqs : array_like, shape(`n_channels`,)
+    Carrier frequencies in Hz.
+  carr_phases : array_like, shape(`n_channels`,)
+    Carrier phases of the first samples in radians.
+  codes : :class:`numpy.ndarray`, shape(`n_channels`, `code_length` + 2)
+    Code of each channel with one chip of padding at each end.
+  sampling_freq : float
+    Sampling frequency in Hz.
+  code_length : int, optional
+    Number of chips in a code period.
+
+  Returns
+  -------
+  out : (:class:`numpy.ndarray`, ...)
+    | The tuple
+    |   `(E, P, L, blksizes, code_phases, carr_phases)`
+    | of arrays with one entry per channel. `E`, `P` and `L` are the complex
+      correlations, `blksizes` the number of samples correlated and
+      `code_phases` and `carr_phases` the phases of the sample following
+      the block.
+
+  """
+  sample_indices = np.asarray(sample_indices, dtype=np.int)
+  code_phases = np.asarray(code_phases, dtype=np.float64)
+  carr_phases = np.asarray(carr_phases, dtype=np.float64)
+  code_steps = np.asarray(code_freqs, dtype=np.float64) / sampling_freq
+  carr_steps = np.asarray(carr_freqs, dtype=np.float64) * 2*np.pi / sampling_freq
+  n_channels = len(code_phases)
+
+  blksizes = np.asarray(np.ceil((code_length - code_phases) / code_steps),
+                        dtype=np.int)
+  # Rows are at least one sample longer than the longest block.
+  n_coarse = blksizes.max() // CARRIER_FINE_STEPS + 1
+  n_samples = n_coarse * CARRIER_FINE_STEPS
+  rows = np.arange(n_channels)[:, np.newaxis]
+
+  # Copy each channel's block of samples into a row, zero padded if the
+  # samples run out.
+  block = np.zeros((n_channels, n_samples), dtype=samples.dtype)
+  for n, sample_index in enumerate(sample_indices):
+    samples_ = samples[sample_index:sample_index + n_samples]
+    block[n, :len(samples_)] = samples_
+
+  # The carrier replica sin(phi) + cos(phi)j = exp(-phi j) j is the outer
+  # product of a coarse and a fine table for each channel, which needs far
+  # fewer calls to exp than evaluating it at every sample.
+  fine = np.exp(-1j * carr_steps[:, np.newaxis] *
+                np.arange(CARRIER_FINE_STEPS))
+  coarse = 1j * np.exp(-1j * (carr_phases[:, np.newaxis] +
+                              carr_steps[:, np.newaxis] * CARRIER_FINE_STEPS *
+                              np.arange(n_coarse)))
+  baseband = coarse[:, :, np.newaxis] * fine[:, np.newaxis, :]
+  baseband = baseband.reshape(n_channels, n_samples)
+  baseband *= block
+
+  # The code replicas are constant over each half chip, so rather than
+  # multiplying every sample by the early, prompt and late chips the baseband
+  # is summed over each half chip and the sums multiplied by the chips. Sample
+  # k is in half chip m = ceil(2*(code_phase + k*code_step)), half chip m
+  # starts at the first sample past (m - 1)/2 chips.
+  half_phases = 2 * code_phases[:, np.newaxis]
+  half_steps = 2 * code_steps[:, np.newaxis]
+  first_half_chips = np.ceil(half_phases)
+  n_half_chips = int(np.max(np.ceil(half_phases + (blksizes[:, np.newaxis] - 1)
+                                    * half_steps) - first_half_chips)) + 1
+  half_chips = first_half_chips + np.arange(n_half_chips + 1)
+  starts = np.floor((half_chips - 1 - half_phases) / half_steps) + 1
+  starts = np.asarray(np.clip(starts, 0, blksizes[:, np.newaxis]), dtype=np.int)
+
+  # Each row has one more start than half chips, the extra sum runs from the
+  # end of the block to the start of the next row and is dropped. Half chips
+  # past the end of shorter blocks are empty, reduceat gives a single sample
+  # for those so they are zeroed.
+  sums = np.add.reduceat(baseband.ravel(),
+                         (starts + rows * n_samples).ravel())
+  sums = sums.reshape(n_channels, n_half_chips + 1)[:, :-1]
+  sums[starts[:, 1:] == starts[:, :-1]] = 0
+
+  # The early, prompt and late chips of half chip m are the chips
+  # ceil((m - 1)/2), ceil(m/2) and ceil((m + 1)/2).
+  half_chips = np.asarray(half_chips[:, :-1], dtype=np.int)
+  corrs = []
+  for offset in (-1, 0, 1):
+    chips = np.clip((half_chips + offset + 1) // 2, 0, code_length + 1)
+    corrs.append(np.sum(codes[rows, chips] * sums, axis=1))
+  E, P, L = corrs
+
+  code_phases = code_phases + blksizes * code_steps - code_length
+  carr_phases = np.fmod(carr_phases + blksizes * carr_steps, 2*np.pi)
+
+  return (E, P, L, blksizes, code_phases, carr_phases)
+
+
+def track_correlate(samples, code_freq, code_phase, carr_freq, carr_phase,
+                    code, sampling_freq):
+  """
+  Correlate the next code period of a single channel.
+
+  A drop-in replacement for :func:`swiftnav.correlate.track_correlate`, see
+  :func:`track_correlate_multi`.
+
+  Returns
+  -------
+  out : (complex, complex, complex, int, float, float)
+    | The tuple
+    |   `(E, P, L, blksize, code_phase, carr_phase)`
+
+  """
+  E, P, L, blksize, code_phase, carr_phase = track_correlate_multi(
+    samples, [0], [code_freq], [code_phase], [carr_freq], [carr_phase],
+    np.asarray(code)[np.newaxis], sampling_freq, len(code) - 2)
+  return (E[0], P[0], L[0], int(blksize[0]), code_phase[0], carr_phase[0])
+
+
+def track_correlate_block(samples, code_freq, code_phase, carr_freq,
+                          carr_phase, code, sampling_freq, n_periods):
+  """
+  Correlate consecutive code periods of a single channel with fixed code and
+  carrier frequencies.
+
+  The result is the same as calling :func:`track_correlate` `n_periods` times
+  with the phases returned by the previous call, but all the periods are
+  correlated by one call of :func:`track_correlate_multi`.
+
+  Parameters
+  ----------
+  n_periods : int
+    Number of code periods to correlate.
+
+  Other parameters as :func:`track_correlate`.
+
+  Returns
+  -------
+  out : (:class:`numpy.ndarray`, ...)
+    | The tuple
+    |   `(E, P, L, blksizes, code_phases, carr_phases)`
+    | of arrays with one entry per code period, see
+      :func:`track_correlate_multi`.
+
+  """
+  code_length = len(code) - 2
+  code_step = code_freq / sampling_freq
+  carr_step = carr_freq * 2*np.pi / sampling_freq
+
+  sample_indices = np.empty(n_periods, dtype=np.int)
+  code_phases = np.empty(n_periods)
+  carr_phases = np.empty(n_periods)
+  sample_index = 0
+  for n in range(n_periods):
+    sample_indices[n] = sample_index
+    code_phases[n] = code_phase
+    carr_phases[n] = carr_phase
+    blksize = int(np.ceil((code_length - code_phase) / code_step))
+    sample_index += blksize
+    code_phase = code_phase + blksize * code_step - code_length
+    carr_phase = np.fmod(carr_phase + blksize * carr_step, 2*np.pi)
+
+  return track_correlate_multi(samples, sample_indices,
+                               np.repeat(code_freq, n_periods), code_phases,
+                               np.repeat(carr_freq, n_periods), carr_phases,
+                               np.tile(code, (n_periods, 1)), sampling_freq,
+                               code_length)
+
+
+class LUTCorrelator(object):
+  """
+  Correlator built on lookup tables of the carrier and code replicas.
+
+  A drop-in replacement for :func:`swiftnav.correlate.track_correlate`, pass
+  an instance as the `correlator` argument of
+  :func:`peregrine.tracking.track`.
+
+  The carrier and code phases are advanced as fixed point numerically
+  controlled oscillators, the carrier phase in units of :math:`2^{-32}`
+  cycles and the code phase in units of :math:`2^{-32}` half chips. The top
+  bits of the carrier phase index a table of `carrier_steps` replica values
+  taken at the centres of the phase steps. The integer half chip indexes a
+  table built for each code with the early, prompt and late chips of every
+  half chip, so that with the half chip spacing of the early and late
+  replicas the same chips are selected as by
+  :func:`swiftnav.correlate.track_correlate`. The only correlation loss is
+  from the carrier phase quantization, about :math:`(\\pi/N)^2/3` of the power
+  for `N` steps.
+
+  The code and carrier phases returned for the next block are computed in
+  floating point as by :func:`swiftnav.correlate.track_correlate`, so the
+  quantization error does not accumulate from block to block.
+
+  The carrier wiped off baseband is summed over each half chip before the
+  code is applied, so the code replica costs one multiply per half chip
+  rather than per sample. With ``peregrine-benchmark correlator`` at
+  16.368 MHz it correlates a code period in about 290 us against about
+  385 us for :func:`track_correlate`, for any of 16, 64 or 256 carrier phase
+  steps. It has not been measured against
+  :func:`swiftnav.correlate.track_correlate`, which tracking uses by default;
+  compare them on the target machine before choosing it for speed.
+
+  Parameters
+  ----------
+  carrier_steps : int, optional
+    Number of steps in the carrier phase table, a power of two.
+
+  """
+
+  def __init__(self, carrier_steps=64):
+    carrier_bits = int(round(np.log2(carrier_steps)))
+    if carrier_steps != 1 << carrier_bits:
+      raise ValueError("carrier_steps must be a power of two, got %r" %
+                       (carrier_steps,))
+    self.carrier_steps = carrier_steps
+    self.carrier_shift = 32 - carrier_bits
+    phases = (np.arange(carrier_steps) + 0.5) * 2*np.pi / carrier_steps
+    self.carrier_table = np.column_stack((np.sin(phases), np.cos(phases)))
+    self.code_tables = {}
+    # Sample indices, extended as needed for the longest code period.
+    self.ramp = np.arange(0, dtype=np.int64)
+
+  def code_table(self, code):
+    """
+    Get the early, prompt and late chips of each half chip of a code.
+
+    Parameters
+    ----------
+    code : :class:`numpy.ndarray`
+      Code with one chip of padding at each end.
+
+    Returns
+    -------
+    out : :class:`numpy.ndarray`, shape(2 * `len(code)`, 3)
+      Row `m` holds the chips used for code phases in
+      :math:`(m/2 - 1/2, m/2]`, measured from the start of the unpadded code.
+
+    """
+    key = code.tostring()
+    table = self.code_tables.get(key)
+    if table is None:
+      half_chips = np.arange(2 * len(code))
+      table = np.empty((len(half_chips), 3))
+      for n, offset in enumerate((0, 1, 2)):
+        table[:, n] = code[np.minimum((half_chips + offset) // 2,
+                                      len(code) - 1)]
+      self.code_tables[key] = table
+    return table
+
+  def __call__(self, samples, code_freq, code_phase, carr_freq, carr_phase,
+               code, sampling_freq):
+    """
+    Correlate the next code period.
+
+    Parameters and return value as :func:`track_correlate`.
+
+    """
+    code_length = len(code) - 2
+    code_step = code_freq / sampling_freq
+    carr_step = carr_freq * 2*np.pi / sampling_freq
+    blksize = int(np.ceil((code_length - code_phase) / code_step))
+    if len(self.ramp) < blksize:
+      self.ramp = np.arange(blksize, dtype=np.int64)
+    ramp = self.ramp[:blksize]
+
+    # Carrier NCO, the top bits of the phase index the carrier table. Each
+    # row of baseband is the in-phase and quadrature product of a sample.
+    phase = int(np.floor(carr_phase / (2*np.pi) * 2**32)) % 2**32
+    phase_step = int(round(carr_step / (2*np.pi) * 2**32))
+    carrier_index = ramp * phase_step
+    carrier_index += phase
+    carrier_index >>= self.carrier_shift
+    carrier_index &= self.carrier_steps - 1
+    baseband = self.carrier_table.take(carrier_index, axis=0)
+    baseband *= samples[:blksize, np.newaxis]
+
+    # Code NCO in half chips, offset so that the integer part is the index
+    # ceil(2*code_phase) of the half chip. The replicas are constant over a
+    # half chip so the baseband is summed over each half chip, from the
+    # sample at which the NCO reaches it, and then correlated with the chips
+    # of the half chips.
+    phase = int(np.ceil(2 * code_phase * 2**32)) + 2**32 - 1
+    phase_step = int(round(2 * code_step * 2**32))
+    first = phase >> 32
+    last = (phase + (blksize - 1) * phase_step) >> 32
+    starts = np.zeros(last - first + 1, dtype=np.int64)
+    starts[1:] = np.arange(first + 1, last + 1, dtype=np.int64) << 32
+    starts[1:] += phase_step - 1 - phase
+    starts[1:] //= phase_step
+    sums = np.add.reduceat(baseband, starts, axis=0)
+    # Half chips with no samples, when the code advances more than a half
+    # chip per sample.
+    sums[:-1][starts[1:] == starts[:-1]] = 0
+    chips = self.code_table(code)[first:last + 1]
+
+    # Each row of corrs is the in-phase and quadrature correlation of one of
+    # the early, prompt and late replicas.
+    corrs = np.dot(chips.T, sums)
+    E, P, L = corrs[:, 0] + 1j * corrs[:, 1]
+
+    code_phase = code_phase + blksize * code_step - code_length
+    carr_phase = np.fmod(carr_phase + blksize * carr_step, 2*np.pi)
+
+    return (E, P, L, blksize, code_phase, carr_phase)
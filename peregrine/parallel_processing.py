@@ -3,71 +3,402 @@
 
 import progressbar as pb
 import multiprocessing as mp
-import time
+import numpy as np
+import os
+import tempfile
+import Queue
+import cPickle
+import traceback
 
-def spawn(f):
-    def worker(q_in, q_out, q_progress):
+# Directory for SharedArray segments, /dev/shm is backed by memory on Linux.
+SHARED_MEMORY_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+class WorkerError(Exception):
+    """
+    Raised when a function run by a :class:`WorkerPool` worker raises an
+    exception. The message is the worker's formatted traceback.
+    """
+    pass
+
+class SharedArray(object):
+    """
+    A numpy array in a named shared memory segment.
+
+    The segment is a `.npy` file in `SHARED_MEMORY_DIR` that is memory mapped
+    by each process using it. Forked workers inherit the mapping and a
+    pickled `SharedArray` only contains the segment name, so sending one to
+    a worker attaches to the same memory rather than copying the data.
+
+    Parameters
+    ----------
+    shape : tuple
+        Shape of the array.
+    dtype : :class:`numpy.dtype`, optional
+        Type of the array.
+    filename : string or `None`, optional
+        Attach to an existing segment rather than creating a new one, `shape`
+        and `dtype` are then ignored.
+
+    Attributes
+    ----------
+    array : :class:`numpy.ndarray`
+        The shared array.
+    """
+
+    def __init__(self, shape, dtype=np.float64, filename=None):
+        if filename is None:
+            fd, filename = tempfile.mkstemp(prefix='peregrine-', suffix='.npy',
+                                            dir=SHARED_MEMORY_DIR)
+            os.close(fd)
+            self.array = np.lib.format.open_memmap(filename, mode='w+',
+                                                   dtype=dtype, shape=shape)
+        else:
+            self.array = np.lib.format.open_memmap(filename, mode='r+')
+        self.filename = filename
+
+    def __getstate__(self):
+        return self.filename
+
+    def __setstate__(self, filename):
+        self.__init__(None, filename=filename)
+
+    def free(self):
+        """
+        Remove the segment's name. Existing mappings, including views of
+        `array`, remain valid until they are no longer referenced.
+        """
+        try:
+            os.unlink(self.filename)
+        except OSError:
+            pass
+
+class _ProgressQueue(object):
+    # Passed to functions as `q_progress`, progress increments are sent on the
+    # results queue so the parent only has to wait on one queue.
+    def __init__(self, q_out):
+        self.q_out = q_out
+
+    def put(self, increment):
+        self.q_out.put(('progress', None, increment))
+
+def _worker(f, q_in, q_out):
+    q_progress = _ProgressQueue(q_out)
+    # The pickled function of the last task and the function itself, so that
+    # it is only unpickled once per call.
+    pickled, g = None, f
+    while True:
+        task = q_in.get()
+        if task is None:
+            break
+        pickled_f, func_progress, chunk = task
+        if pickled_f is None:
+            g = f
+        elif pickled_f != pickled:
+            g = cPickle.loads(pickled_f)
+        pickled = pickled_f
+        for i, x in chunk:
+            try:
+                if func_progress:
+                    q_out.put(('result', i, g(x, q_progress=q_progress)))
+                else:
+                    q_out.put(('result', i, g(x)))
+            except Exception:
+                q_out.put(('error', i, traceback.format_exc()))
+
+def _pickle(f):
+    # `f` pickled, or None if it can't be.
+    try:
+        return cPickle.dumps(f, cPickle.HIGHEST_PROTOCOL)
+    except Exception:
+        return None
+
+class WorkerPool(object):
+    """
+    A pool of worker processes.
+
+    Workers are forked on first use. Functions that can be pickled, such as
+    module level functions, are pickled once per call and sent to the running
+    workers with each task, and the workers are kept between calls. Large
+    arrays they need are best passed as :class:`SharedArray` objects. Closures
+    can't be pickled so
+    workers are forked with the closure for each call, inheriting it and any
+    data it captures without copying, and are stopped at the end of the call
+    so that they don't keep that data alive.
+
+    Parameters
+    ----------
+    nprocs : int, optional
+        Number of worker processes.
+    """
+
+    def __init__(self, nprocs=mp.cpu_count()):
+        self.nprocs = nprocs
+        self.procs = []
+        self.f = None
+
+    def _start(self, f):
+        self.shutdown()
+        self.q_in = mp.Queue()
+        self.q_out = mp.Queue()
+        self.f = f
+        self.procs = [mp.Process(target=_worker,
+                                 args=(f, self.q_in, self.q_out))
+                      for _ in range(self.nprocs)]
+        for p in self.procs:
+            p.daemon = True
+            p.start()
+
+    def _prepare(self, f):
+        # Returns the pickled function to send with each task, or None if the
+        # workers were forked with it. It is only pickled once per call.
+        pickled = _pickle(f)
+        if pickled is not None:
+            if not self.procs:
+                self._start(None)
+            return pickled
+        if not self.procs or self.f is not f:
+            self._start(f)
+        return None
+
+    def imap(self, f, X, chunksize=1, func_progress=False,
+             progress_callback=None):
+        """
+        Apply `f` to each element of `X` in the workers, yielding the results
+        in order as they become available.
+
+        Parameters
+        ----------
+        f : callable
+            Function to apply.
+        X : iterable
+            Arguments to apply `f` to.
+        chunksize : int, optional
+            Number of elements of `X` sent to a worker at a time.
+        func_progress : bool, optional
+            If `True`, `f` is called with a `q_progress` keyword argument, an
+            object with a `put` method to which it passes increments of its
+            progress.
+        progress_callback : callable or `None`, optional
+            Called as `progress_callback(progress, len(X))` as results or
+            progress increments arrive.
+
+        Results and progress increments arrive on a single queue so the
+        calling process sleeps until a worker has something to report, only
+        waking once a second to check that the workers are still alive.
+
+        Raises
+        ------
+        WorkerError
+            If `f` raised an exception in a worker. The workers are stopped.
+
+        Notes
+        -----
+        If `f` can't be pickled the workers are forked for this call and
+        stopped when it finishes, pass a module level function to reuse them.
+        """
+        X = list(X)
+        g = self._prepare(f)
+        tasks = list(enumerate(X))
+        for k in range(0, len(tasks), chunksize):
+            self.q_in.put((g, func_progress, tasks[k:k + chunksize]))
+
+        results = {}
+        next_i = 0
+        progress = 0
+        finished = False
+        try:
+            while next_i < len(X):
+                tag, i, r = self._get()
+                if tag == 'progress':
+                    progress += r
+                else:
+                    results[i] = r
+                    if not func_progress:
+                        progress += 1
+                if progress_callback and progress <= len(X):
+                    progress_callback(progress, len(X))
+                while next_i in results:
+                    yield results.pop(next_i)
+                    next_i += 1
+            finished = True
+        finally:
+            self._finish(g, finished)
+
+    def _finish(self, g, finished):
+        # Tasks from an abandoned call would still be in the queues. Workers
+        # forked with a closure hold on to whatever it captured.
+        if not finished:
+            self.terminate()
+        elif g is None:
+            self.shutdown()
+
+    def _get(self):
+        # Wait for the next result or progress message from the workers.
         while True:
-            i,x = q_in.get()
-            if i is None:
-                break
             try:
-                if q_progress:
-                    q_out.put((i,f(x, q_progress=q_progress)))
+                tag, i, r = self.q_out.get(timeout=1.0)
+            except Queue.Empty:
+                if not all(p.is_alive() for p in self.procs):
+                    raise WorkerError("Worker process died")
+                continue
+            if tag == 'error':
+                raise WorkerError(r)
+            return tag, i, r
+
+    def chains(self, f, X, priority=None, func_progress=False,
+               progress_callback=None, callback=None):
+        """
+        Run chains of dependent calls of `f` in the workers.
+
+        Each element of `X` starts a chain. `f(x)` returns a tuple `(done,
+        x)` and, unless `done`, `f` is called again with the new `x`. Calls in
+        the same chain run one after another but may run on different
+        workers, so `x` must be picklable. Whenever a worker is free the next
+        call of a ready chain is submitted to it.
+
+        Parameters
+        ----------
+        f : callable
+            Function to apply.
+        X : iterable
+            Initial arguments of the chains.
+        priority : callable or `None`, optional
+            If given, the ready chain with the greatest `priority(x)` is run
+            first, otherwise chains are run in turn.
+        func_progress : bool, optional
+            See :meth:`imap`.
+        progress_callback : callable or `None`, optional
+            See :meth:`imap`, without `func_progress` the progress is the
+            number of finished chains.
+        callback : callable or `None`, optional
+            Called as `callback(i, x)` in the calling process with each new
+            `x` of chain `i` as it arrives.
+
+        Returns
+        -------
+        out : list
+            The final `x` of each chain, in the order of `X`.
+
+        Raises
+        ------
+        WorkerError
+            If `f` raised an exception in a worker. The workers are stopped.
+        """
+        states = list(X)
+        g = self._prepare(f)
+        ready = range(len(states))
+        n_running = 0
+        n_done = 0
+        progress = 0
+        finished = False
+        try:
+            while n_done < len(states):
+                # Only as many calls as workers are queued so that the order
+                # of the rest can still change.
+                if priority:
+                    ready.sort(key=lambda i: priority(states[i]), reverse=True)
+                while ready and n_running < self.nprocs:
+                    i = ready.pop(0)
+                    self.q_in.put((g, func_progress, [(i, states[i])]))
+                    n_running += 1
+
+                tag, i, r = self._get()
+                if tag == 'progress':
+                    progress += r
                 else:
-                    q_out.put((i,f(x)))
-            except Exception as err:
-                print "Subprocess raised exception:"
-                print err
-                q_out.put(None)
-    return worker
-
-def parmap(f, X, nprocs = mp.cpu_count(), show_progress=True, func_progress=False):
-    q_in   = mp.Queue()
-    q_out  = mp.Queue()
-    if func_progress:
-        q_progress = mp.Queue(100)
-    else:
-        q_progress = None
+                    n_running -= 1
+                    done, states[i] = r
+                    if callback:
+                        callback(i, states[i])
+                    if done:
+                        n_done += 1
+                        if not func_progress:
+                            progress += 1
+                    else:
+                        ready.append(i)
+                if progress_callback and progress <= len(states):
+                    progress_callback(progress, len(states))
+            finished = True
+        finally:
+            self._finish(g, finished)
+        return states
+
+    def map(self, f, X, **kwargs):
+        """Like :meth:`imap` but returns a list of the results."""
+        return list(self.imap(f, X, **kwargs))
+
+    def shutdown(self):
+        """Stop the workers once they finish their current tasks."""
+        for _ in self.procs:
+            self.q_in.put(None)
+        for p in self.procs:
+            p.join()
+        self.procs = []
+        self.f = None
 
-    proc = [mp.Process(target=spawn(f),args=(q_in, q_out, q_progress)) for _ in range(nprocs)]
+    def terminate(self):
+        """Stop the workers immediately."""
+        for p in self.procs:
+            p.terminate()
+            p.join()
+        self.procs = []
+        self.f = None
 
-    for p in proc:
-        p.daemon = True
-        p.start()
+_pool = None
 
+def get_pool(nprocs=mp.cpu_count()):
+    """
+    Get the process-wide :class:`WorkerPool`, created on first use and
+    restarted if `nprocs` changes. Its workers are only kept between calls
+    made with functions that can be pickled.
+    """
+    global _pool
+    if _pool is None:
+        _pool = WorkerPool(nprocs)
+    elif _pool.nprocs != nprocs:
+        _pool.shutdown()
+        _pool.nprocs = nprocs
+    return _pool
+
+def shutdown():
+    """Shut down the process-wide :class:`WorkerPool`, if it was started."""
+    if _pool is not None:
+        _pool.shutdown()
+
+def parchain(f, X, nprocs = mp.cpu_count(), priority=None, show_progress=True,
+             func_progress=False, callback=None):
+    """Like :func:`parmap` for chains of calls, see :meth:`WorkerPool.chains`."""
+    X = list(X)
     if show_progress:
         pbar = pb.ProgressBar(widgets=[pb.Percentage(), ' ', pb.ETA()], maxval=len(X)).start()
+        progress_callback = lambda progress, n: pbar.update(progress)
+    else:
+        progress_callback = None
 
-    [q_in.put((i, x)) for i, x in enumerate(X)]
+    res = get_pool(nprocs).chains(f, X, priority=priority,
+                                  func_progress=func_progress,
+                                  progress_callback=progress_callback,
+                                  callback=callback)
 
-    [q_in.put((None,None)) for _ in range(nprocs)]
+    if show_progress:
+        pbar.finish()
 
-    n_done = 0
-    progress = 0
-    res = []
-    t0 = time.time()
-    while n_done < len(X):
-        if func_progress:
-            time.sleep(0.02)
-        else:
-            res.append(q_out.get())
-            n_done += 1
-        while not q_out.empty():
-            res.append(q_out.get())
-            n_done += 1
-        if q_progress:
-            while not q_progress.empty():
-                progress_increment = q_progress.get_nowait()
-                progress += progress_increment
-        else:
-            progress = n_done
-        if show_progress and progress <= len(X):
-            pbar.update(progress)
+    return res
 
+def parmap(f, X, nprocs = mp.cpu_count(), show_progress=True, func_progress=False,
+           chunksize=1):
+    X = list(X)
     if show_progress:
-        pbar.finish()
+        pbar = pb.ProgressBar(widgets=[pb.Percentage(), ' ', pb.ETA()], maxval=len(X)).start()
+        progress_callback = lambda progress, n: pbar.update(progress)
+    else:
+        progress_callback = None
 
-    [p.join() for p in proc]
+    res = get_pool(nprocs).map(f, X, chunksize=chunksize,
+                               func_progress=func_progress,
+                               progress_callback=progress_callback)
+
+    if show_progress:
+        pbar.finish()
 
-    return [x for i,x in sorted(res)]
+    return res
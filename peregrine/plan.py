@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2014 Swift Navigation Inc.
+#
+# This source is subject to the license found in the file 'LICENSE' which must
+# be be distributed together with this source. All other rights reserved.
+#
+# THIS CODE AND INFORMATION IS PROVIDED "AS IS" WITHOUT WARRANTY OF ANY KIND,
+# EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A PARTICULAR PURPOSE.
+
+"""Pre-generate FFTW wisdom for the configured acquisition sizes."""
+
+import os
+import time
+import argparse
+import itertools
+import numpy as np
+
+from peregrine.acquisition import Acquisition, DEFAULT_WISDOM_FILE
+from peregrine.acquisition import get_wisdom_store
+from peregrine.log import default_logging_config
+from initSettings import initSettings
+
+__all__ = ['plan']
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def plan(settings, wisdom_file, n_codes_integrate=(1, 4, 8),
+         fft_sizes=(None,), dtypes=(np.complex128,), real=(True,), threads=1):
+  """
+  Generate FFTW wisdom for every combination of the given acquisition
+  parameters.
+
+  Parameters
+  ----------
+  settings : :class:`peregrine.initSettings.initSettings`
+    Settings giving the sampling parameters.
+  wisdom_file : string
+    Wisdom file to add the wisdom to, see
+    :class:`peregrine.acquisition.WisdomStore`.
+  n_codes_integrate : iterable, optional
+    Integration lengths in code periods. The defaults cover the coarse
+    hierarchical search, :func:`peregrine.run.main` and
+    :func:`peregrine.warm_start.warm_start`.
+  fft_sizes : iterable, optional
+    FFT size modes, see :class:`peregrine.acquisition.Acquisition`.
+  dtypes : iterable, optional
+    Complex types of the FFTs.
+  real : iterable, optional
+    Whether the samples are real valued.
+  threads : int or `None`, optional
+    Number of threads used by each plan.
+
+  """
+  samples_per_code = settings.samplingFreq * settings.codeLength / \
+                     settings.codeFreqBasis
+  for n, fft_size, dtype, r in itertools.product(n_codes_integrate, fft_sizes,
+                                                 dtypes, real):
+    t0 = time.time()
+    acq = Acquisition(None, settings.samplingFreq, settings.IF,
+                      samples_per_code, settings.codeLength,
+                      n_codes_integrate=n, wisdom_file=wisdom_file,
+                      threads=threads, real=r, dtype=dtype, fft_size=fft_size)
+    logger.info("Planned %d ms %s %s FFTs of size %d in %.1f s", n,
+                'real' if r else 'complex', np.dtype(dtype).name,
+                acq.fft_size, time.time() - t0)
+
+
+def main():
+  default_logging_config()
+  settings = initSettings()
+
+  parser = argparse.ArgumentParser()
+  parser.add_argument("-n", "--n-codes-integrate", type=int, nargs='+',
+                      default=[1, 4, 8],
+                      help="integration lengths to plan for, in code periods")
+  parser.add_argument("--fft-size", nargs='+', default=['none'],
+                      choices=['none', 'pad', 'resample'],
+                      help="FFT size modes to plan for")
+  parser.add_argument("--dtype", nargs='+', default=['complex128'],
+                      choices=['complex128', 'complex64'],
+                      help="FFT precisions to plan for")
+  parser.add_argument("--complex", action="store_true",
+                      help="also plan for complex valued samples")
+  parser.add_argument("-t", "--threads", type=int, default=1,
+                      help="number of threads used by each plan")
+  parser.add_argument("-w", "--wisdom-file",
+                      default=os.path.join(settings.cacheDir,
+                                           DEFAULT_WISDOM_FILE),
+                      help="the wisdom file to update")
+  parser.add_argument("-l", "--list", action="store_true",
+                      help="only list the plans in the wisdom file")
+  args = parser.parse_args()
+
+  if not args.list:
+    plan(settings, args.wisdom_file,
+         n_codes_integrate=args.n_codes_integrate,
+         fft_sizes=[None if f == 'none' else f for f in args.fft_size],
+         dtypes=[np.dtype(d).type for d in args.dtype],
+         real=[True, False] if args.complex else [True],
+         threads=args.threads)
+
+  store = get_wisdom_store(args.wisdom_file)
+  try:
+    store.load()
+  except IOError:
+    print "No wisdom file '%s'." % args.wisdom_file
+    return
+  print "Plans in '%s':" % args.wisdom_file
+  for kind, size, dtype, threads in sorted(store.plans):
+    print "  %s %8d %-10s %d thread%s" % (kind, size, dtype, threads,
+                                          '' if threads == 1 else 's')
+
+if __name__ == "__main__":
+  main()
@@ -9,6 +9,7 @@
 # EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE IMPLIED
 # WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A PARTICULAR PURPOSE.
 
+import os
 import sys
 import argparse
 import cPickle
@@ -16,10 +17,12 @@ import logging
 from operator import attrgetter
 import numpy as np
 
-from peregrine.samples import load_samples
+from peregrine.samples import load_samples, SampleStream
 from peregrine.acquisition import Acquisition, load_acq_results, save_acq_results
+from peregrine.acquisition import DEFAULT_WISDOM_FILE
 from peregrine.navigation import navigation
-from peregrine.tracking import track
+from peregrine.tracking import track, load_track_results, save_track_results
+from peregrine.tracking import CheckpointError
 from peregrine.log import default_logging_config
 import defaults
 
@@ -67,7 +70,9 @@ def main():
     acq_samples = load_samples(args.file, 11*samplesPerCode,
                                settings.skipNumberOfBytes,
                                file_format=args.file_format)
-    acq = Acquisition(acq_samples)
+    acq = Acquisition(acq_samples,
+                      wisdom_file=os.path.join(settings.cacheDir,
+                                               DEFAULT_WISDOM_FILE))
     acq_results = acq.acquisition()
 
     try:
@@ -91,21 +96,32 @@ def main():
   if args.skip_tracking:
     logging.info("Skipping tracking, loading saved tracking results.")
     try:
-      with open(track_results_file, 'rb') as f:
-        track_results = cPickle.load(f)
+      track_results = load_track_results(track_results_file)
     except IOError:
       logging.critical("Couldn't open tracking results file '%s'.",
                        track_results_file)
       sys.exit(1)
+    except ValueError as e:
+      logging.critical("%s Run without --skip-tracking.", e)
+      sys.exit(1)
   else:
-    signal = load_samples(args.file,
+    # The samples are read in blocks as they are tracked. The results are
+    # written to the results file as they are tracked and an interrupted run
+    # is resumed from its last checkpoint.
+    signal = SampleStream(args.file,
                           int(settings.samplingFreq*1e-3*(settings.msToProcess+22)),
                           settings.skipNumberOfBytes,
                           file_format=args.file_format)
-    track_results = track(signal, acq_results, settings.msToProcess)
     try:
-      with open(track_results_file, 'wb') as f:
-        cPickle.dump(track_results, f, protocol=cPickle.HIGHEST_PROTOCOL)
+      track_results = track(signal, acq_results, settings.msToProcess,
+                            results_file=track_results_file + '.npy',
+                            checkpoint_file=track_results_file + ".checkpoint")
+    except CheckpointError as e:
+      logging.warning("%s, tracking without checkpoints.", e)
+      track_results = track(signal, acq_results, settings.msToProcess,
+                            results_file=track_results_file + '.npy')
+    try:
+      save_track_results(track_results_file, track_results)
       logging.debug("Saving tracking results as '%s'" % track_results_file)
     except IOError:
       logging.error("Couldn't save tracking results file '%s'.",
@@ -9,9 +9,123 @@
 
 """Functions for handling sample data and sample data files."""
 
+import os
 import numpy as np
 
-__all__ = ['load_samples', 'save_samples']
+__all__ = ['load_samples', 'save_samples', 'decode_samples', 'SampleFile',
+           'SampleStream']
+
+# Number of samples packed in each byte of the single stream file formats.
+_SAMPLES_PER_BYTE = {
+  'int8': 1,
+  'piksinew': 1,
+  'piksi': 2,
+  '1bit': 8,
+  '1bitrev': 8,
+}
+
+def _unpack_piksi(packed):
+  # Piksi format is packed 3-bit sign-magnitude samples, 2 samples per byte.
+  #
+  # Bits:
+  # [1..0] Flags (reserved for future use)
+  # [3..2] Sample 2 magnitude
+  # [4]    Sample 2 sign (1 is -ve)
+  # [6..5] Sample 1 magnitude
+  # [7]    Sample 1 sign (1 is -ve)
+  samples = np.empty(len(packed) * 2, dtype=np.int8)
+  # Unpack 2 samples from each byte
+  samples[::2] = (packed >> 5)
+  samples[1::2] = (packed >> 2) & 7
+  # Sign-magnitude to two's complement mapping
+  return (1-2*(samples>>2)) * (2*(samples&3)+1)
+
+def _unpack_1bit(packed):
+  samples = np.unpackbits(packed).view('int8')
+  samples *= 2
+  samples -= 1
+  return samples
+
+def _unpack_1bitrev(packed):
+  return np.reshape(_unpack_1bit(packed), (-1, 8))[:, ::-1].flatten()
+
+def _lookup_table(unpack):
+  # Table of the samples unpacked from each of the 256 byte values, viewed as
+  # one unsigned integer per byte value so that decoding is a single gather.
+  samples = unpack(np.arange(256, dtype=np.uint8)).reshape(256, -1)
+  return samples.view('u%d' % samples.shape[1]).ravel()
+
+# Lookup tables of the formats packing several samples in each byte.
+_LOOKUP_TABLES = {
+  'piksi': _lookup_table(_unpack_piksi),
+  '1bit': _lookup_table(_unpack_1bit),
+  '1bitrev': _lookup_table(_unpack_1bitrev),
+}
+
+# Number of bytes decoded at a time with a lookup table. The table indices are
+# converted to `numpy.intp` a chunk at a time, which is much faster than
+# letting :func:`numpy.take` convert all of them.
+_DECODE_CHUNK = 2**16
+
+def decode_samples(packed, file_format, out=None):
+  """
+  Decode the bytes of a sample data file.
+
+  The formats packing several samples in each byte are decoded by looking
+  each byte up in a 256 entry table of the samples it contains, a single
+  gather per byte without any intermediate arrays.
+
+  Parameters
+  ----------
+  packed : :class:`numpy.ndarray`
+    Array of `uint8` bytes to decode.
+  file_format : {'piksi', 'piksinew', 'int8', '1bit', '1bitrev'}
+    Format of the bytes, see :func:`load_samples`.
+  out : :class:`numpy.ndarray` or `None`, optional
+    Contiguous `int8` array of all the samples in `packed` to write the
+    samples to. If `None` then a new array is allocated.
+
+  Returns
+  -------
+  out : :class:`numpy.ndarray`
+    The samples.
+
+  Raises
+  ------
+  ValueError
+    If `file_format` is unrecognised or `out` has the wrong shape or type.
+
+  """
+  if file_format not in _SAMPLES_PER_BYTE:
+    raise ValueError("Unknown file type '%s'" % file_format)
+  num_samples = len(packed) * _SAMPLES_PER_BYTE[file_format]
+  if out is None:
+    out = np.empty(num_samples, dtype=np.int8)
+  elif (out.shape != (num_samples,) or out.dtype != np.int8 or
+        not out.flags.c_contiguous):
+    raise ValueError("Output must be a contiguous int8 array of %d samples"
+                     % num_samples)
+
+  if file_format == 'int8':
+    out[:] = packed.view(np.int8)
+  elif file_format == 'piksinew':
+    np.subtract(packed >> 6, 1, out=out.view(np.uint8))
+  else:
+    table = _LOOKUP_TABLES[file_format]
+    out = out.view(table.dtype)
+    indices = np.empty(min(len(packed), _DECODE_CHUNK), dtype=np.intp)
+    for start in range(0, len(packed), _DECODE_CHUNK):
+      chunk = packed[start:start + _DECODE_CHUNK]
+      chunk_indices = indices[:len(chunk)]
+      chunk_indices[:] = chunk
+      np.take(table, chunk_indices, out=out[start:start + _DECODE_CHUNK],
+              mode='clip')
+    out = out.view(np.int8)
+  return out
+
+# Blocks of a SampleStream start on a multiple of this many samples so that
+# they start on a byte boundary in all of the packed formats.
+_BLOCK_ALIGNMENT = 8
 
 def load_samples(filename, num_samples=-1, num_skip=0, file_format='piksi'):
   """
@@ -55,11 +169,7 @@ def load_samples(filename, num_samples=-1, num_skip=0, file_format='piksi'):
     If `file_format` is unrecognised.
 
   """
-  if file_format == 'int8':
-    with open(filename, 'rb') as f:
-      f.seek(num_skip)
-      samples = np.fromfile(f, dtype=np.int8, count=num_samples)
-  elif file_format == 'c8c8':
+  if file_format == 'c8c8':
     # Interleaved complex samples from two receivers, i.e. first four bytes are
     # I0 Q0 I1 Q1
     s_file = np.memmap(filename, offset=num_skip, dtype=np.int8, mode='r')
@@ -83,73 +193,9 @@ def load_samples(filename, num_samples=-1, num_skip=0, file_format='piksi'):
       samples[rx][2::4] = -s_file[2 * rx     : : 2 * n_rx]
       samples[rx][3::4] =  s_file[2 * rx + 1 : : 2 * n_rx]
 
-  elif file_format == 'piksinew':
-    packed = np.memmap(filename, offset=num_skip, dtype=np.uint8, mode='r')
-    if num_samples > 0:
-      packed = packed[:num_samples]
-    samples = np.empty(len(packed), dtype=np.int8)
-    samples[:] = (packed >> 6) - 1
-
-  elif file_format == 'piksi':
-    """
-    Piksi format is packed 3-bit sign-magnitude samples, 2 samples per byte.
-
-    Bits:
-    [1..0] Flags (reserved for future use)
-    [3..2] Sample 2 magnitude
-    [4]    Sample 2 sign (1 is -ve)
-    [6..5] Sample 1 magnitude
-    [7]    Sample 1 sign (1 is -ve)
-
-    """
-    if num_samples > 0:
-      num_skip_bytes = num_skip / 2
-      num_skip_samples = num_skip % 2
-      num_bytes = num_samples/2 + 1
-    else:
-      # Read whole file
-      num_skip_bytes = 0
-      num_skip_samples = 0
-      num_bytes = -1
-
-    packed = np.memmap(filename, offset=num_skip_bytes, dtype=np.uint8, mode='r')
-    if num_bytes > 0:
-      packed = packed[:num_bytes]
-
-    samples = np.empty(len(packed) * 2, dtype=np.int8)
-
-    # Unpack 2 samples from each byte
-    samples[::2] = (packed >> 5)
-    samples[1::2] = (packed >> 2) & 7
-    # Sign-magnitude to two's complement mapping
-    samples = (1-2*(samples>>2)) * (2*(samples&3)+1)
-
-    samples = samples[num_skip_samples:]
-    if num_samples > 0:
-      samples = samples[:num_samples]
-
-  elif file_format == '1bit' or file_format == '1bitrev':
-    if num_samples > 0:
-      num_skip_bytes = num_skip / 8
-      num_skip_samples = num_skip % 8
-      num_bytes = num_samples/8 + 1
-    else:
-      # Read whole file
-      num_skip_bytes = 0
-      num_skip_samples = 0
-      num_bytes = -1
-    with open(filename, 'rb') as f:
-      f.seek(num_skip_bytes)
-      sample_bytes = np.fromfile(f, dtype=np.uint8, count=num_bytes)
-#    samples = 2*np.unpackbits(sample_bytes).astype(np.int8) - 1
-    samples = np.unpackbits(sample_bytes).view('int8')
-    samples *= 2
-    samples -= 1
-    if file_format == '1bitrev':
-        samples = np.reshape(samples,(-1,8))[:,::-1].flatten();
-    samples = samples[num_skip_samples:]
-    if num_samples > 0:
-      samples = samples[:num_samples]
+  elif file_format in _SAMPLES_PER_BYTE:
+    sample_file = SampleFile(filename, num_samples, num_skip, file_format)
+    samples = sample_file[:]
 
   else:
     raise ValueError("Unknown file type '%s'" % file_format)
@@ -207,3 +253,172 @@ def save_samples(filename, samples, file_format='int8'):
 
   else:
     raise ValueError("Unknown file type '%s'" % file_format)
+
+class SampleFile(object):
+  """
+  Sample data file that is decoded as it is sliced.
+
+  The file is memory mapped and indexing or slicing, e.g. `sample_file[a:b]`,
+  only decodes the bytes containing the requested samples, so windows of a
+  recording of any length can be read with little memory overhead.
+
+  Parameters
+  ----------
+  filename : string
+    Filename of sample data file.
+  num_samples : int, optional
+    Number of samples in the file, ``-1`` means up to the end of the file.
+  num_skip : int, optional
+    Number of samples to discard from the beginning of the file.
+  file_format : {'piksi', 'piksinew', 'int8', '1bit', '1bitrev'}, optional
+    Format of the sample data file, see :func:`load_samples`.
+
+  Raises
+  ------
+  ValueError
+    If `file_format` is unrecognised.
+
+  """
+
+  def __init__(self, filename, num_samples=-1, num_skip=0,
+               file_format='piksi'):
+    if file_format not in _SAMPLES_PER_BYTE:
+      raise ValueError("Unknown file type '%s'" % file_format)
+    self.filename = filename
+    self.num_skip = num_skip
+    self.file_format = file_format
+    self._packed = self._map()
+    file_samples = len(self._packed) * _SAMPLES_PER_BYTE[file_format]
+    self.num_samples = max(0, file_samples - num_skip)
+    if num_samples >= 0:
+      self.num_samples = min(self.num_samples, num_samples)
+
+  def _map(self):
+    with open(self.filename, 'rb') as f:
+      # Empty files can't be memory mapped.
+      if os.fstat(f.fileno()).st_size == 0:
+        return np.empty(0, dtype=np.uint8)
+      return np.memmap(f, dtype=np.uint8, mode='r')
+
+  def __getstate__(self):
+    # The file is mapped again when unpickled rather than pickling its data.
+    state = self.__dict__.copy()
+    del state['_packed']
+    return state
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    self._packed = self._map()
+
+  def __len__(self):
+    return self.num_samples
+
+  def __getitem__(self, key):
+    if isinstance(key, slice):
+      start, stop, step = key.indices(self.num_samples)
+      if step > 0:
+        return self.read(start, stop - start)[::step]
+      indices = np.arange(start, stop, step)
+      if len(indices) == 0:
+        return self.read(0, 0)
+      return self.read(stop + 1, start - stop)[indices - stop - 1]
+    index = key + self.num_samples if key < 0 else key
+    if not 0 <= index < self.num_samples:
+      raise IndexError("Sample index out of range")
+    return self.read(index, 1)[0]
+
+  def read(self, start, num_samples, out=None):
+    """
+    Read samples from the file.
+
+    Parameters
+    ----------
+    start : int
+      Index of the first sample to read.
+    num_samples : int
+      Number of samples to read, fewer are returned at the end of the file.
+    out : :class:`numpy.ndarray` or `None`, optional
+      Contiguous `int8` array of at least `num_samples` samples to write the
+      samples to the start of, so that buffers can be reused between reads.
+      If `None` then a new array is allocated.
+
+    Returns
+    -------
+    out : :class:`numpy.ndarray`
+      The samples.
+
+    """
+    num_samples = max(0, min(num_samples, self.num_samples - start))
+    samples_per_byte = _SAMPLES_PER_BYTE[self.file_format]
+    first = self.num_skip + start
+    first_byte = first // samples_per_byte
+    end_byte = -(-(first + num_samples) // samples_per_byte)
+    packed = self._packed[first_byte:end_byte]
+    skip = first - first_byte * samples_per_byte
+    if out is None:
+      return decode_samples(packed, self.file_format)[skip:skip + num_samples]
+    out = out[:num_samples]
+    if skip == 0 and len(packed) * samples_per_byte == num_samples:
+      return decode_samples(packed, self.file_format, out)
+    # The read doesn't start or end on a byte boundary.
+    out[:] = decode_samples(packed, self.file_format)[skip:skip + num_samples]
+    return out
+
+
+class SampleStream(SampleFile):
+  """
+  Sample data file that is read in blocks as it is needed.
+
+  Only the blocks in use are held in memory so recordings of any length can be
+  processed, e.g. by :func:`peregrine.tracking.track`. Blocks start on a
+  multiple of 8 samples, so the packed formats are read from a byte boundary.
+  Each block overlaps the next by `overlap` samples, any `overlap` consecutive
+  samples are therefore contained in a single block.
+
+  Parameters
+  ----------
+  filename, num_samples, num_skip, file_format
+    See :class:`SampleFile`.
+  block_size : int, optional
+    Number of samples between the starts of consecutive blocks, a multiple of
+    8.
+  overlap : int, optional
+    Number of samples by which each block overlaps the next.
+
+  Raises
+  ------
+  ValueError
+    If `file_format` is unrecognised or `block_size` isn't a multiple of 8.
+
+  """
+
+  def __init__(self, filename, num_samples=-1, num_skip=0,
+               file_format='piksi', block_size=2**22, overlap=2**20):
+    if block_size <= 0 or block_size % _BLOCK_ALIGNMENT:
+      raise ValueError("Block size must be a multiple of %d samples"
+                       % _BLOCK_ALIGNMENT)
+    SampleFile.__init__(self, filename, num_samples, num_skip, file_format)
+    self.block_size = block_size
+    self.overlap = overlap
+
+  def blocks(self, start=0):
+    """
+    Iterate over the blocks of the stream.
+
+    Parameters
+    ----------
+    start : int, optional
+      Index of the first sample required, the first block starts at or just
+      before it.
+
+    Returns
+    -------
+    out : iterator
+      Iterator yielding tuples `(index, block)` of the index of the first
+      sample of each block and an array of its samples.
+
+    """
+    index = start - start % _BLOCK_ALIGNMENT
+    while index < self.num_samples:
+      yield index, self.read(index, self.block_size + self.overlap)
+      index += self.block_size
@@ -265,12 +265,18 @@ def plot_refine_results(acq_result, sweeps):
     plt.title("Final code phase search (coherent)")
     plt.xlabel('Code phase offset')
 
+def _refine_ob(args):
+    # refine_ob of a signal in a SharedArray, for refine_obs.
+    shared, acq_result, settings, print_results = args
+    return refine_ob(np.asarray(shared.array), acq_result, settings,
+                     print_results = print_results, return_sweeps = True)
+
 def refine_obs(signal, acq_results, settings,
                print_results = True,
                plot = True,
                multi = True):
 
-    from peregrine.parallel_processing import parmap
+    from peregrine.parallel_processing import parmap, SharedArray
     mapper = parmap if multi else map
 
     obs_cp = {}
@@ -280,9 +286,15 @@ def refine_obs(signal, acq_results, settings,
         print "PRN\tAcquisition:\tNon-coherent\tNavigation bit:\tCoherent\tCoherent"
         print "\tDopp\tSNR\tcode phase\tHyp #\tPhase\tdoppler\t\tcode phase"
 
-    res = mapper(lambda a: refine_ob(signal, a, settings,
-                                   print_results = print_results, return_sweeps = True),
-              acq_results)
+    # The signal is passed to the pool workers in shared memory rather than
+    # with each acquisition result.
+    shared = SharedArray(np.shape(signal), np.asarray(signal).dtype)
+    shared.array[:] = signal
+    try:
+        res = mapper(_refine_ob, [(shared, a, settings, print_results)
+                                  for a in acq_results])
+    finally:
+        shared.free()
     for i, a in enumerate(acq_results):
         ob_cp, ob_dopp, sweeps = res[i]
         obs_cp[a.prn] = ob_cp
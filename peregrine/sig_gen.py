@@ -359,22 +359,48 @@ def gen_signal(ephems, traj,
 #    nav_msgs = {prn: None for prn in prns}
 #    cacodes = {prn: np.ones(1023) for prn in prns}
     chunk_len = 10
-    def gen_chunk(i, n):
-        ss = []
-        for ix in range(i, i + n):
-            def gen_signal_step_sat(prn):
-                x, v = sat_los(step_tow[ix], step_pv[ix], ephems[prn])
-                return gen_signal_sat_los(step_tow[ix], x, v, step_samps, fs, fi, cacodes[prn], nav_msgs[prn], nav_msg_tow0, jitter) * step_prn_snrs[ix][prn]
-            sp = map(lambda prn: gen_signal_step_sat(prn), step_prn_snrs[ix].keys())
-            s = np.sum(sp,0)# + np.random.normal(size=step_samps)
-            s = np.int8(s * scale)
-            ss.append(s)
-        return np.concatenate(ss)
-    
-    sss = pp.parmap(lambda i: gen_chunk(i, min(chunk_len, len(step_t)-i)),
-                    range(0, len(step_t), chunk_len))
+
+    # The chunks are generated by module level functions in the persistent
+    # pool workers, the codes and nav messages of every PRN are passed to them
+    # in shared memory rather than with each chunk.
+    prn_rows = {prn: row for row, prn in enumerate(prns)}
+    shared_cacodes = pp.SharedArray((len(prns), gps.chips_per_code), np.int64)
+    shared_nav_msgs = pp.SharedArray((len(prns), len(nav_msgs[prns[0]])),
+                                     np.int64)
+    for prn, row in prn_rows.items():
+        shared_cacodes.array[row] = cacodes[prn]
+        shared_nav_msgs.array[row] = nav_msgs[prn]
+    prn_ephems = {prn: ephems[prn] for prn in prns}
+    try:
+        sss = pp.parmap(gen_chunk,
+                        [(step_tow[i:i + chunk_len], step_pv[i:i + chunk_len],
+                          step_prn_snrs[i:i + chunk_len], prn_ephems,
+                          prn_rows, shared_cacodes, shared_nav_msgs,
+                          nav_msg_tow0, step_samps, fs, fi, jitter, scale)
+                         for i in range(0, len(step_t), chunk_len)])
+    finally:
+        shared_cacodes.free()
+        shared_nav_msgs.free()
     return np.concatenate(sss)
 
+def gen_chunk(args):
+    ''' Generate the samples of a chunk of trajectory steps for gen_signal.
+    The codes and nav messages are SharedArrays with a row per PRN.
+    '''
+    (step_tow, step_pv, step_prn_snrs, ephems, prn_rows, cacodes, nav_msgs,
+     nav_msg_tow0, step_samps, fs, fi, jitter, scale) = args
+    ss = []
+    for ix in range(len(step_tow)):
+        def gen_signal_step_sat(prn):
+            x, v = sat_los(step_tow[ix], step_pv[ix], ephems[prn])
+            row = prn_rows[prn]
+            return gen_signal_sat_los(step_tow[ix], x, v, step_samps, fs, fi, np.asarray(cacodes.array[row]), np.asarray(nav_msgs.array[row]), nav_msg_tow0, jitter) * step_prn_snrs[ix][prn]
+        sp = map(lambda prn: gen_signal_step_sat(prn), step_prn_snrs[ix].keys())
+        s = np.sum(sp,0)# + np.random.normal(size=step_samps)
+        s = np.int8(s * scale)
+        ss.append(s)
+    return np.concatenate(ss)
+
 def add_noise(s, level):
     rem = len(s)
     noise = np.random.randn(16*1024*1024)*level
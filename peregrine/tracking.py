@@ -11,8 +11,14 @@ import numpy as np
 from include.generateCAcode import caCodes
 import gps_constants
 import progressbar
+import os
+import sys
 import math
+import copy
+import cPickle
 import parallel_processing as pp
+from samples import SampleFile, SampleStream
+from correlator import track_correlate_block
 
 import swiftnav.track
 import swiftnav.correlate
@@ -30,6 +36,14 @@ except ImportError:
   _progressbar_available = False
 
 
+class CheckpointError(ValueError):
+  """
+  Raised by :func:`track` when it is given a `checkpoint_file` but the
+  tracking can't be checkpointed.
+  """
+  pass
+
+
 class TrackingLoop(object):
   """
   Abstract base class for a tracking loop.
@@ -113,14 +127,93 @@ def track(samples, channels,
           correlator=swiftnav.correlate.track_correlate,
           stage2_coherent_ms=None,
           stage2_loop_filter_params=None,
-          multi=True):
+          multi=True,
+          segment_ms=1000,
+          vector_correlator=None,
+          block_ms=None,
+          block_correlator=None,
+          precision=np.float64,
+          results_file=None,
+          checkpoint_file=None,
+          checkpoint_ms=10000,
+          sample_offset=0):
+  """
+  Track the signals of a set of acquired satellites.
+
+  Parameters
+  ----------
+  samples : :class:`numpy.ndarray` or :class:`peregrine.samples.SampleFile`
+    Samples to track. A :class:`peregrine.samples.SampleFile` is read in
+    blocks as each channel advances.
+  channels : [:class:`peregrine.acquisition.AcquisitionResult`]
+    Acquisition results of the satellites to track, one channel each.
+  ms_to_track : int or `None`, optional
+    Number of ms to track, if `None` as much as the samples allow.
+  sampling_freq, chipping_rate, IF : float, optional
+    Sampling frequency, code chipping rate and intermediate frequency in Hz.
+  show_progress : bool, optional
+    Whether to show a progress bar.
+  loop_filter_class : class, optional
+    Class of the tracking loop filters, created with
+    `stage1_loop_filter_params`.
+  stage1_loop_filter_params : tuple, optional
+    Loop filter parameters used with 1 ms integrations.
+  correlator : callable, optional
+    Correlates the samples of one code period.
+  stage2_coherent_ms : int or `None`, optional
+    Coherent integration time in ms once the nav bit phase is known. If `None`
+    the 1 ms integrations are kept.
+  stage2_loop_filter_params : tuple or `None`, optional
+    Loop filter parameters used with `stage2_coherent_ms` integrations.
+  multi : bool, optional
+    If `True` the channels are tracked in parallel worker processes.
+  segment_ms : int or `None`, optional
+    With `multi`, each channel is tracked in segments of this many ms, which
+    are scheduled on whichever worker is free. If `None` each channel is
+    tracked in a single task. Segments pass the tracking state, including the
+    loop filter and C/N0 estimator objects, between processes; if it can't be
+    pickled a warning is logged and each channel is tracked in a single task.
+  vector_correlator : callable or `None`, optional
+    If given, all the channels are tracked in lockstep in this process, with
+    one call correlating a code period of every channel, see
+    :func:`peregrine.correlator.track_correlate_multi`.
+  block_ms : int or `None`, optional
+    If given, the NCO is only updated every `block_ms` ms rather than after
+    every integration.
+  block_correlator : callable or `None`, optional
+    Correlates the code periods of a block in one call in block mode, see
+    :func:`peregrine.correlator.track_correlate_block`, the default. If
+    another `correlator` is given it is called for each code period instead.
+  precision : {`numpy.float64`, `numpy.float32`}, optional
+    Floating point type in which the results are stored.
+  results_file : string or `None`, optional
+    If given, the results are written to this `.npy` file as they are
+    tracked rather than kept in memory.
+  checkpoint_file : string or `None`, optional
+    If given, the tracking state is saved to this file every `checkpoint_ms`
+    and tracking resumes from it if it was saved with the same settings.
+    Requires `results_file`, a tracking state that can be pickled and, with
+    `multi`, `segment_ms`, otherwise a :class:`CheckpointError` is raised.
+  checkpoint_ms : int, optional
+    Interval in ms between checkpoints.
+  sample_offset : int, optional
+    Index in the original samples of the first of `samples`, only when
+    resuming from a checkpoint.
+
+  Returns
+  -------
+  out : [:class:`TrackResults`]
+    The tracking results, one per channel.
+
+  """
 
   n_channels = len(channels)
 
   # Add 22ms for safety, the corellator might try to access data a bit past
   # just the number of milliseconds specified.
   # TODO: Fix the correlator so this isn't an issue.
-  samples_length_ms = int(1e3 * len(samples) / sampling_freq - 22)
+  samples_length_ms = int(1e3 * (sample_offset + len(samples)) / sampling_freq
+                          - 22)
 
   if ms_to_track is None:
     ms_to_track = samples_length_ms
@@ -145,6 +238,16 @@ def track(samples, channels,
     show_progress = False
     logger.warning("show_progress = True but progressbar module not found.")
 
+  # In block mode the code periods of a block are correlated in one call,
+  # unless a correlator other than the default is given to be called for each.
+  if (block_ms and block_correlator is None and
+      correlator is swiftnav.correlate.track_correlate):
+    block_correlator = track_correlate_block
+
+  # Channels tracked with a vector correlator are all run in this process.
+  if vector_correlator is not None:
+    multi = False
+
   # Setup our progress bar if we need it
   if show_progress and not multi:
     widgets = ['  Tracking ',
@@ -161,10 +264,49 @@ def track(samples, channels,
   else:
     pbar = None
 
-  # Run tracking for each channel
-  def do_channel(chan, n=None, q_progress=None):
+  # The samples can also be a SampleStream, which each channel reads in blocks
+  # as it advances. The current block of each channel is cached in the process
+  # tracking it. Other SampleFiles are read as a stream with the default
+  # blocks.
+  if isinstance(samples, SampleFile) and not isinstance(samples, SampleStream):
+    samples = SampleStream(samples.filename, samples.num_samples,
+                           samples.num_skip, samples.file_format)
+  streamed = isinstance(samples, SampleStream)
+  sample_blocks = {}
+
+  def get_samples(key, start, n_ms):
+    # Returns an array of samples containing at least `n_ms` ms of samples
+    # from index `start`, and the index of its first sample.
+    if not streamed:
+      return samples, sample_offset
+    start = int(start)
+    end = start + int(math.ceil((n_ms + 1) * sampling_freq * 1e-3))
+    if end - start > samples.block_size + samples.overlap:
+      # Too long to be contained in a block.
+      return samples.read(start, end - start), start
+    if key in sample_blocks:
+      blocks, index, block = sample_blocks[key]
+      if index <= start and end <= index + len(block):
+        return block, index
+      # Move on to the next block if it contains the samples, otherwise start
+      # reading blocks again from `start`.
+      next_index = index + samples.block_size
+      if (next_index <= start and
+          end <= next_index + samples.block_size + samples.overlap):
+        index, block = next(blocks, (index, block))
+        sample_blocks[key] = blocks, index, block
+        return block, index
+    blocks = samples.blocks(start)
+    index, block = next(blocks)
+    sample_blocks[key] = blocks, index, block
+    return block, index
+
+  # Tracking of each channel is split into three steps so that it can be run
+  # in resumable segments. All of the tracking state is kept in a dictionary
+  # which is passed between the steps.
+  def start_channel(chan, results):
     loop_filter = loop_filter_class(*stage1_loop_filter_params)
-    track_result = TrackResults(num_points)
+    track_result = TrackResults(num_points, results)
     track_result.prn = chan.prn
 
     # Convert acquisition SNR to C/N0
@@ -177,9 +319,7 @@ def track(samples, channels,
                      gps_constants.chip_rate / gps_constants.l1
     code_freq_init = 0
     loop_filter.start(code_freq_init, chan.carr_freq - IF)
-    code_phase = 0.0
-    carr_phase = 0.0
-    
+
     # Get a vector with the C/A code sampled 1x/chip
     ca_code = caCodes[chan.prn]
 
@@ -189,37 +329,228 @@ def track(samples, channels,
     # Number of samples to seek ahead in file
     samples_per_chip = int(round(sampling_freq / chipping_rate))
 
-    # Set sample_index to start on a code rollover
-    sample_index = chan.code_phase * samples_per_chip
-
-    # Start in 1ms integration until we know the nav bit phase
-    stage1 = True
-
-    carr_phase_acc = 0.0
-    code_phase_acc = 0.0
+    return {
+      'loop_filter': loop_filter,
+      'track_result': track_result,
+      'cn0_est': cn0_est,
+      'ca_code': ca_code,
+      'code_phase': 0.0,
+      'carr_phase': 0.0,
+      # Set sample_index to start on a code rollover
+      'sample_index': chan.code_phase * samples_per_chip,
+      # Start in 1ms integration until we know the nav bit phase
+      'stage1': True,
+      'carr_phase_acc': 0.0,
+      'code_phase_acc': 0.0,
+      'progress': 0,
+      'ms_tracked': 0,
+      'i': 0,
+    }
+
+  def stage2_due(state):
+    # Whether to switch to stage 2, once the nav bit phase is known.
+    nav_msg = state['track_result'].nav_msg
+    return bool(state['stage1'] and stage2_coherent_ms and
+                nav_msg.bit_phase == nav_msg.bit_phase_ref)
+
+  def begin_integration(state):
+    # Switch to stage 2 once the nav bit phase is known. Returns the number of
+    # ms to integrate over next.
+    track_result = state['track_result']
+    if stage2_due(state):
+      #print "PRN %02d transition to stage 2 at %d ms" % (chan.prn+1, ms_tracked)
+      state['stage1'] = False
+      state['loop_filter'].retune(*stage2_loop_filter_params)
+      state['cn0_est'] = swiftnav.track.CN0Estimator(
+        1e3/stage2_coherent_ms, track_result.cn0[state['i']-1], 10,
+        1e3/stage2_coherent_ms)
+
+    return 1 if state['stage1'] else stage2_coherent_ms
+
+  def end_integration(state, E, P, L, coherent_ms, q_progress=None):
+    # Update the loop filter with the integrated correlations and record the
+    # results.
+    loop_filter = state['loop_filter']
+    track_result = state['track_result']
+    i = state['i']
+
+    loop_filter.update(E, P, L)
+    track_result.coherent_ms[i] = coherent_ms
+
+    track_result.nav_bit_sync.update(np.real(P), coherent_ms)
+
+    tow = track_result.nav_msg.update(np.real(P), coherent_ms)
+    track_result.nav_msg_bit_phase_ref[i] = track_result.nav_msg.bit_phase_ref
+    track_result.tow[i] = tow or (track_result.tow[i-1] + coherent_ms)
+
+    track_result.carr_phase[i] = state['carr_phase']
+    track_result.carr_phase_acc[i] = state['carr_phase_acc']
+    track_result.carr_freq[i] = loop_filter.carr_freq + IF
+
+    track_result.code_phase[i] = state['code_phase']
+    track_result.code_phase_acc[i] = state['code_phase_acc']
+    track_result.code_freq[i] = loop_filter.code_freq + chipping_rate
+
+    # Record stuff for postprocessing
+    track_result.absolute_sample[i] = state['sample_index']
+
+    track_result.E[i] = E
+    track_result.P[i] = P
+    track_result.L[i] = L
+
+    track_result.cn0[i] = state['cn0_est'].update(P.real, P.imag)
+
+    i += 1
+    state['i'] = i
+    state['ms_tracked'] += coherent_ms
+
+    if q_progress and (i % 200 == 0):
+      p = 1.0 * state['ms_tracked'] / ms_to_track;
+      q_progress.put(p - state['progress'])
+      state['progress'] = p
+
+  def run_block(state, coherent_ms, q_progress=None):
+    # Correlate up to the next multiple of `block_ms` with the NCO frozen at
+    # the loop filter's current frequencies, then run the loop filter over the
+    # integrations of the block and record their results with slice
+    # assignments. Blocks don't depend on where segments end so segmented
+    # tracking gives the same results.
+    loop_filter = state['loop_filter']
+    track_result = state['track_result']
+    i = state['i']
+
+    ms_tracked = state['ms_tracked']
+    block_end = min(ms_to_track, (ms_tracked // block_ms + 1) * block_ms)
+    n_int = max(1, (block_end - ms_tracked) // coherent_ms)
+    n_periods = n_int * coherent_ms
+    code_freq = loop_filter.code_freq
+    carr_freq = loop_filter.carr_freq
+
+    block, index = get_samples(track_result.prn, state['sample_index'],
+                               n_periods)
+    if block_correlator:
+      corrs = block_correlator(
+        block[int(state['sample_index'] - index):],
+        code_freq + chipping_rate, state['code_phase'],
+        carr_freq + IF, state['carr_phase'],
+        state['ca_code'],
+        sampling_freq,
+        n_periods
+      )
+    else:
+      corrs = [[] for _ in range(6)]
+      code_phase = state['code_phase']
+      carr_phase = state['carr_phase']
+      sample_index = state['sample_index']
+      for k in range(n_periods):
+        corr = correlator(
+          block[int(sample_index - index):],
+          code_freq + chipping_rate, code_phase,
+          carr_freq + IF, carr_phase,
+          state['ca_code'],
+          sampling_freq
+        )
+        _, _, _, blksize, code_phase, carr_phase = corr
+        sample_index += blksize
+        for c, v in zip(corrs, corr):
+          c.append(v)
+    E, P, L, blksizes, code_phases, carr_phases = map(np.asarray, corrs)
+
+    # Quantities at the end of each integration. The accumulated phases are
+    # summed from the initial value in order, as in run_channel.
+    ends = slice(coherent_ms - 1, None, coherent_ms)
+    E, P, L = [c.reshape(n_int, coherent_ms).sum(axis=1) for c in (E, P, L)]
+    sample_index = np.cumsum(np.concatenate(([state['sample_index']],
+                                             blksizes)))[1:][ends]
+    carr_phase_acc = np.cumsum(np.concatenate((
+      [state['carr_phase_acc']], carr_freq * blksizes / sampling_freq)))[1:][ends]
+    code_phase_acc = np.cumsum(np.concatenate((
+      [state['code_phase_acc']], code_freq * blksizes / sampling_freq)))[1:][ends]
+    code_phase = code_phases[ends]
+    carr_phase = carr_phases[ends]
+
+    code_freqs = np.empty(n_int)
+    carr_freqs = np.empty(n_int)
+    bit_phase_refs = np.empty(n_int)
+    tows = np.empty(n_int)
+    cn0s = np.empty(n_int)
+    tow_prev = track_result.tow[i-1]
+    cn0_est = state['cn0_est']
+    for m in range(n_int):
+      loop_filter.update(E[m], P[m], L[m])
+      code_freqs[m] = loop_filter.code_freq
+      carr_freqs[m] = loop_filter.carr_freq
+      track_result.nav_bit_sync.update(P[m].real, coherent_ms)
+      tow = track_result.nav_msg.update(P[m].real, coherent_ms)
+      bit_phase_refs[m] = track_result.nav_msg.bit_phase_ref
+      tow_prev = tows[m] = tow or (tow_prev + coherent_ms)
+      cn0s[m] = cn0_est.update(P[m].real, P[m].imag)
+      # The rest of the block is dropped when switching to stage 2, the next
+      # integration must use the new coherent integration time.
+      if stage2_due(state):
+        n_int = m + 1
+        break
+
+    block = slice(i, i + n_int)
+    track_result.coherent_ms[block] = coherent_ms
+    track_result.nav_msg_bit_phase_ref[block] = bit_phase_refs[:n_int]
+    track_result.tow[block] = tows[:n_int]
+    track_result.carr_phase[block] = carr_phase[:n_int]
+    track_result.carr_phase_acc[block] = carr_phase_acc[:n_int]
+    track_result.carr_freq[block] = carr_freqs[:n_int] + IF
+    track_result.code_phase[block] = code_phase[:n_int]
+    track_result.code_phase_acc[block] = code_phase_acc[:n_int]
+    track_result.code_freq[block] = code_freqs[:n_int] + chipping_rate
+    track_result.absolute_sample[block] = sample_index[:n_int]
+    track_result.E[block] = E[:n_int]
+    track_result.P[block] = P[:n_int]
+    track_result.L[block] = L[:n_int]
+    track_result.cn0[block] = cn0s[:n_int]
+
+    state.update({
+      'code_phase': code_phase[n_int-1],
+      'carr_phase': carr_phase[n_int-1],
+      'sample_index': sample_index[n_int-1],
+      'carr_phase_acc': carr_phase_acc[n_int-1],
+      'code_phase_acc': code_phase_acc[n_int-1],
+      'ms_tracked': state['ms_tracked'] + n_int * coherent_ms,
+      'i': i + n_int,
+    })
+
+    if q_progress and (i + n_int) // 200 > i // 200:
+      p = 1.0 * state['ms_tracked'] / ms_to_track;
+      q_progress.put(p - state['progress'])
+      state['progress'] = p
+
+  def run_channel(state, ms_end, n=None, q_progress=None):
+    loop_filter = state['loop_filter']
+    ca_code = state['ca_code']
 
-    progress = 0
-    ms_tracked = 0
-    i = 0
     # Process the specified number of ms
-    while ms_tracked < ms_to_track:
+    while state['ms_tracked'] < ms_end:
       if pbar:
-        pbar.update(ms_tracked + n * num_points, attr={'chan': n+1})
+        pbar.update(state['ms_tracked'] + n * num_points, attr={'chan': n+1})
 
-      E = 0+0.j; P = 0+0.j; L = 0+0.j
+      coherent_ms = begin_integration(state)
 
-      if stage1 and stage2_coherent_ms and track_result.nav_msg.bit_phase == track_result.nav_msg.bit_phase_ref:
-        #print "PRN %02d transition to stage 2 at %d ms" % (chan.prn+1, ms_tracked)
-        stage1 = False
-        loop_filter.retune(*stage2_loop_filter_params)
-        cn0_est = swiftnav.track.CN0Estimator(1e3/stage2_coherent_ms,
-                                              track_result.cn0[i-1], 10,
-                                              1e3/stage2_coherent_ms)
+      # In block mode the NCO is only updated every `block_ms`.
+      if block_ms:
+        run_block(state, coherent_ms, q_progress)
+        continue
 
-      coherent_ms = 1 if stage1 else stage2_coherent_ms
-      
+      # Unpack the phases into locals for speed in the loop below.
+      code_phase = state['code_phase']
+      carr_phase = state['carr_phase']
+      sample_index = state['sample_index']
+      carr_phase_acc = state['carr_phase_acc']
+      code_phase_acc = state['code_phase_acc']
+
+      E = 0+0.j; P = 0+0.j; L = 0+0.j
+
+      block, index = get_samples(state['track_result'].prn, sample_index,
+                                 coherent_ms)
       for j in range(coherent_ms):
-        samples_ = samples[sample_index:]
+        samples_ = block[int(sample_index - index):]
 
         E_, P_, L_, blksize, code_phase, carr_phase = correlator(
           samples_,
@@ -234,55 +565,288 @@ def track(samples, channels,
 
         E += E_; P += P_; L += L_
 
-      loop_filter.update(E, P, L)
-      track_result.coherent_ms[i] = coherent_ms
-        
-      track_result.nav_bit_sync.update(np.real(P), coherent_ms)
-
-      tow = track_result.nav_msg.update(np.real(P), coherent_ms)
-      track_result.nav_msg_bit_phase_ref[i] = track_result.nav_msg.bit_phase_ref
-      track_result.tow[i] = tow or (track_result.tow[i-1] + coherent_ms)
-
-      track_result.carr_phase[i] = carr_phase
-      track_result.carr_phase_acc[i] = carr_phase_acc
-      track_result.carr_freq[i] = loop_filter.carr_freq + IF
-
-      track_result.code_phase[i] = code_phase
-      track_result.code_phase_acc[i] = code_phase_acc
-      track_result.code_freq[i] = loop_filter.code_freq + chipping_rate
-
-      # Record stuff for postprocessing
-      track_result.absolute_sample[i] = sample_index
-
-      track_result.E[i] = E
-      track_result.P[i] = P
-      track_result.L[i] = L
-
-      track_result.cn0[i] = cn0_est.update(P.real, P.imag)
-
-      i += 1
-      ms_tracked += coherent_ms
-
-      if q_progress and (i % 200 == 0):
-        p = 1.0 * ms_tracked / ms_to_track;
-        q_progress.put(p - progress)
-        progress = p
+      state.update({
+        'code_phase': code_phase,
+        'carr_phase': carr_phase,
+        'sample_index': sample_index,
+        'carr_phase_acc': carr_phase_acc,
+        'code_phase_acc': code_phase_acc,
+      })
+      end_integration(state, E, P, L, coherent_ms, q_progress)
+
+  def run_channels_vectorized(states, ms_end):
+    # Track all the channels in lockstep, correlating the next block of every
+    # channel with one call of `vector_correlator`. Each channel accumulates
+    # blocks until its own coherent integration period is complete.
+    codes = np.array([state['ca_code'] for state in states])
+    integrations = {}
+    active = [n for n, state in enumerate(states)
+              if state['ms_tracked'] < ms_end]
+
+    while active:
+      if pbar:
+        pbar.update(min(sum(state['ms_tracked'] for state in states),
+                        n_channels * num_points),
+                    attr={'chan': len(active)})
+
+      for n in active:
+        if n not in integrations:
+          # [coherent_ms, blocks integrated, E, P, L]
+          integrations[n] = [begin_integration(states[n]), 0, 0j, 0j, 0j]
+
+      active_states = [states[n] for n in active]
+      loop_filters = [state['loop_filter'] for state in active_states]
+      code_freqs = np.array([lf.code_freq for lf in loop_filters])
+      carr_freqs = np.array([lf.carr_freq for lf in loop_filters])
+
+      sample_indices = np.array([state['sample_index']
+                                 for state in active_states])
+      start = sample_indices.min()
+      block, index = get_samples(
+        None, start,
+        int((sample_indices.max() - start) / (sampling_freq * 1e-3)) + 1)
+      E, P, L, blksizes, code_phases, carr_phases = vector_correlator(
+        block,
+        sample_indices - index,
+        code_freqs + chipping_rate,
+        [state['code_phase'] for state in active_states],
+        carr_freqs + IF,
+        [state['carr_phase'] for state in active_states],
+        codes[active],
+        sampling_freq
+      )
+
+      for k, n in enumerate(active):
+        state = states[n]
+        blksize = blksizes[k]
+        state['sample_index'] += blksize
+        state['code_phase'] = code_phases[k]
+        state['carr_phase'] = carr_phases[k]
+        state['carr_phase_acc'] += carr_freqs[k] * blksize / sampling_freq
+        state['code_phase_acc'] += code_freqs[k] * blksize / sampling_freq
+
+        integration = integrations[n]
+        integration[1] += 1
+        integration[2] += E[k]
+        integration[3] += P[k]
+        integration[4] += L[k]
+        coherent_ms, j, E_, P_, L_ = integration
+        if j == coherent_ms:
+          end_integration(state, E_, P_, L_, coherent_ms)
+          del integrations[n]
+
+      active = [n for n in active
+                if n in integrations or states[n]['ms_tracked'] < ms_end]
+
+  def finish_channel(state, q_progress=None):
+    track_result = state['track_result']
 
     # Possibility for lock-detection later
     track_result.status = 'T'
+    sample_blocks.pop(track_result.prn, None)
 
-    track_result.resize(i)
+    track_result.resize(state['i'])
     if q_progress:
-      q_progress.put(1.0 - progress)
-        
+      q_progress.put(1.0 - state['progress'])
+
     return track_result
 
-  if multi:
-    track_results=pp.parmap(do_channel, channels,
-                            show_progress=show_progress, func_progress=show_progress)
+  # Run tracking for each channel
+  def do_channel(chan, results, n=None, q_progress=None):
+    state = start_channel(chan, results)
+    run_channel(state, ms_to_track, n, q_progress)
+    return finish_channel(state, q_progress)
+
+  def state_picklable():
+    # Segments and checkpoints pickle the tracking state, which holds the loop
+    # filter and C/N0 estimator objects. The results are detached first.
+    if not channels:
+      return True
+    state = start_channel(channels[0],
+                          np.zeros(1, track_results_dtype(precision)))
+    state['track_result'].results = None
+    try:
+      cPickle.dumps(state, cPickle.HIGHEST_PROTOCOL)
+    except Exception:
+      return False
+    return True
+
+  picklable = state_picklable()
+
+  # Tracking can be resumed from a checkpoint of the state of each channel,
+  # the results up to the checkpoint are already in `results_file`. The
+  # checkpoint is only used with the settings it was saved with.
+  prns = [chan.prn for chan in channels]
+  config = {
+    'sampling_freq': sampling_freq,
+    'chipping_rate': chipping_rate,
+    'IF': IF,
+    'stage1_loop_filter_params': stage1_loop_filter_params,
+    'stage2_coherent_ms': stage2_coherent_ms,
+    'stage2_loop_filter_params': stage2_loop_filter_params,
+    'segment_ms': segment_ms,
+    'block_ms': block_ms,
+  }
+  states = [None] * n_channels
+  if checkpoint_file is not None:
+    if results_file is None:
+      raise ValueError("Checkpointing tracking requires a results_file")
+    if not picklable:
+      raise CheckpointError("Checkpointing tracking requires a tracking state "
+                            "that can be pickled")
+    if multi and segment_ms is None:
+      raise CheckpointError("Checkpointing tracking in parallel requires a "
+                            "segment_ms")
+    checkpoint_states = _load_checkpoint(checkpoint_file, results_file, prns,
+                                         num_points,
+                                         track_results_dtype(precision),
+                                         config)
+    if checkpoint_states is not None:
+      logger.info("Resuming tracking from checkpoint '%s'" % checkpoint_file)
+      states = checkpoint_states
+  checkpointing = checkpoint_file is not None
+  resumed = any(state is not None for state in states)
+  if sample_offset and not resumed:
+    raise ValueError("A sample_offset can only be used to resume tracking "
+                     "from a checkpoint")
+
+  def next_checkpoint_ms(ms_tracked):
+    if not checkpointing:
+      return ms_to_track
+    return min(ms_to_track, (ms_tracked // checkpoint_ms + 1) * checkpoint_ms)
+
+  def save_checkpoint(results):
+    # Flush the results first so a checkpoint never refers to results that
+    # aren't in the results file.
+    results.flush()
+    _save_checkpoint(checkpoint_file, prns, num_points, config, states)
+
+  # The results of all the channels are preallocated as a single structured
+  # array with a row per channel, in memory or streamed to `results_file`.
+  if multi and n_channels:
+    # Workers write their channel's results in place so only the small
+    # remainder of each TrackResults object is pickled back.
+    if results_file is None:
+      outputs = pp.SharedArray((n_channels, num_points),
+                               track_results_dtype(precision))
+      outputs.array['tow'] = np.NAN
+    else:
+      if not resumed:
+        _allocate_results((n_channels, num_points), precision, results_file)
+      outputs = pp.SharedArray(None, filename=results_file)
+
+    def attach(track_result, n):
+      track_result.results = outputs.array[n]
+
+    def detach(track_result):
+      track_result.results = None
+
+    # If the tracking state can be pickled, each channel is tracked in
+    # segments of `segment_ms`. Segments of different channels are scheduled
+    # on whichever worker is free, channels with the most left to do first,
+    # so the run time depends on the total work rather than on the slowest
+    # channel.
+    segmented = picklable and segment_ms is not None
+    if not picklable and segment_ms is not None:
+      logger.warning("Tracking state can't be pickled, tracking each channel "
+                     "in a single task rather than in segments.")
+
+    def do_segment((n, state), q_progress=None):
+      if state is None:
+        state = start_channel(channels[n], outputs.array[n])
+      else:
+        attach(state['track_result'], n)
+      run_channel(state, min(state['ms_tracked'] + segment_ms, ms_to_track),
+                  q_progress=q_progress)
+      # The next segment may be tracked by another worker.
+      sample_blocks.pop(state['track_result'].prn, None)
+      done = state['ms_tracked'] >= ms_to_track
+      if done:
+        finish_channel(state, q_progress)
+      detach(state['track_result'])
+      return done, (n, state)
+
+    def remaining_ms((n, state)):
+      return ms_to_track - (state['ms_tracked'] if state else 0)
+
+    # The parent keeps the latest state of each channel and saves a
+    # checkpoint whenever a channel is tracked past the next multiple of
+    # `checkpoint_ms`.
+    checkpointed_ms = [state['ms_tracked'] if state else 0 for state in states]
+
+    def segment_done(i, (n, state)):
+      states[n] = state
+      if (checkpointing and
+          state['ms_tracked'] >= next_checkpoint_ms(checkpointed_ms[n])):
+        save_checkpoint(outputs.array)
+        checkpointed_ms[n] = state['ms_tracked']
+
+    def do_channel_shared(n, q_progress=None):
+      track_result = do_channel(channels[n], outputs.array[n],
+                                q_progress=q_progress)
+      n_points = len(track_result.results)
+      detach(track_result)
+      return n_points, track_result
+
+    # `do_segment` and `do_channel_shared` are closures, so the pool's workers
+    # are forked for this call and stopped at its end rather than kept. They
+    # inherit the samples, which can be far too many to copy to shared
+    # memory, and forking is negligible next to the tracking itself.
+    try:
+      if segmented:
+        pp.parchain(do_segment,
+                    [(n, state) for n, state in enumerate(states)
+                     if state is None or state['track_result'].status != 'T'],
+                    priority=remaining_ms,
+                    show_progress=show_progress,
+                    func_progress=show_progress,
+                    callback=segment_done)
+        res = [(state['i'], state['track_result']) for state in states]
+      else:
+        res = pp.parmap(do_channel_shared, range(n_channels),
+                        show_progress=show_progress,
+                        func_progress=show_progress)
+    finally:
+      if results_file is None:
+        outputs.free()
+    track_results = []
+    for n, (n_points, track_result) in enumerate(res):
+      if results_file is None:
+        track_result.results = np.asarray(outputs.array[n, :n_points])
+      else:
+        track_result.results = outputs.array[n, :n_points]
+      track_results.append(track_result)
   else:
-    track_results=map(lambda (n, chan): do_channel(chan, n=n), enumerate(channels))
-    
+    if resumed:
+      outputs = np.lib.format.open_memmap(results_file, mode='r+')
+    else:
+      outputs = _allocate_results((n_channels, num_points), precision,
+                                  results_file)
+    for n, state in enumerate(states):
+      if state is None:
+        states[n] = start_channel(channels[n], outputs[n])
+      else:
+        state['track_result'].results = outputs[n]
+
+    # Tracking stops at each checkpoint to save it.
+    if vector_correlator is not None:
+      while any(state['ms_tracked'] < ms_to_track for state in states):
+        run_channels_vectorized(states, next_checkpoint_ms(
+          min(state['ms_tracked'] for state in states)))
+        if checkpointing:
+          save_checkpoint(outputs)
+    else:
+      for n, state in enumerate(states):
+        while state['ms_tracked'] < ms_to_track:
+          run_channel(state, next_checkpoint_ms(state['ms_tracked']), n)
+          if checkpointing:
+            save_checkpoint(outputs)
+    track_results = map(finish_channel, states)
+
+  # The checkpoint is no longer needed once tracking has finished.
+  if checkpoint_file is not None and os.path.exists(checkpoint_file):
+    os.remove(checkpoint_file)
+
   if pbar:
     pbar.finish()
 
@@ -291,33 +855,347 @@ def track(samples, channels,
   return track_results
 
 
-class TrackResults:
-  def __init__(self, n_points):
+def _save_checkpoint(filename, prns, num_points, config, states):
+  # The results are detached from the states, they are already in the results
+  # file. The checkpoint is replaced atomically so a crash while saving leaves
+  # the previous one.
+  detached = []
+  for state in states:
+    if state is not None:
+      state = dict(state)
+      state['track_result'] = copy.copy(state['track_result'])
+      state['track_result'].results = None
+    detached.append(state)
+  tmp_filename = filename + '.tmp'
+  with open(tmp_filename, 'wb') as f:
+    cPickle.dump({'prns': prns, 'num_points': num_points, 'config': config,
+                  'states': detached},
+                 f, protocol=cPickle.HIGHEST_PROTOCOL)
+  os.rename(tmp_filename, filename)
+
+
+def _load_checkpoint(filename, results_file, prns, num_points, dtype, config):
+  # Returns the channel states saved in a checkpoint, or None if there is no
+  # checkpoint for tracking these channels into this results file with these
+  # settings.
+  if not os.path.exists(filename):
+    return None
+  try:
+    with open(filename, 'rb') as f:
+      checkpoint = cPickle.load(f)
+    results = np.lib.format.open_memmap(results_file, mode='r')
+  except IOError:
+    logger.warning("Couldn't open tracking checkpoint '%s', tracking from the "
+                   "start." % filename)
+    return None
+  if (checkpoint['prns'] != prns or checkpoint['num_points'] != num_points or
+      checkpoint.get('config') != config or
+      results.shape != (len(prns), num_points) or results.dtype != dtype):
+    logger.warning("Tracking checkpoint '%s' doesn't match, tracking from the "
+                   "start." % filename)
+    return None
+  return checkpoint['states']
+
+
+def checkpoint_sample_index(filename):
+  """
+  Get the index of the first sample needed to resume tracking from a
+  checkpoint.
+
+  Only the samples from this index on need to be passed to :func:`track`,
+  with the same `sample_offset`, to resume tracking.
+
+  Parameters
+  ----------
+  filename : string
+    Filename of the checkpoint, the `checkpoint_file` passed to
+    :func:`track`.
+
+  Returns
+  -------
+  out : int
+    Index of the first sample needed, ``0`` if there is no checkpoint or a
+    channel hasn't started.
+
+  """
+  try:
+    with open(filename, 'rb') as f:
+      checkpoint = cPickle.load(f)
+  except IOError:
+    return 0
+  if not checkpoint['states'] or None in checkpoint['states']:
+    return 0
+  return int(min(state['sample_index'] for state in checkpoint['states']))
+
+
+def track_results_dtype(precision=np.float64):
+  """
+  Get the structured type of :attr:`TrackResults.results`.
+
+  Parameters
+  ----------
+  precision : :class:`numpy.dtype`, optional
+    Floating point type of the fields that only need relative precision, the
+    correlations (as the complex type of the same precision), the code and
+    carrier phases and the C/N0. The sample index, accumulated phases,
+    frequencies and time of week are always `numpy.float64`.
+
+  Returns
+  -------
+  out : :class:`numpy.dtype`
+    The structured type with one field per tracking result.
+
+  """
+  complex_type = np.result_type(precision, np.complex64)
+  return np.dtype([
+    ('absolute_sample', np.float64),
+    ('code_phase', precision),
+    ('code_phase_acc', np.float64),
+    ('code_freq', np.float64),
+    ('carr_phase', precision),
+    ('carr_phase_acc', np.float64),
+    ('carr_freq', np.float64),
+    ('E', complex_type),
+    ('P', complex_type),
+    ('L', complex_type),
+    ('cn0', precision),
+    ('nav_msg_bit_phase_ref', np.int8),
+    ('tow', np.float64),
+    ('coherent_ms', np.int8),
+  ])
+
+
+def _allocate_results(shape, precision=np.float64, filename=None):
+  # Allocate a results array, in a memory mapped `.npy` file if `filename` is
+  # given.
+  dtype = track_results_dtype(precision)
+  if filename is None:
+    results = np.zeros(shape, dtype)
+  else:
+    results = np.lib.format.open_memmap(filename, mode='w+', dtype=dtype,
+                                        shape=shape)
+  results['tow'] = np.NAN
+  return results
+
+
+class TrackResults(object):
+  """
+  Tracking results of a single channel.
+
+  The results of each coherent integration are a record of a single
+  structured array, :attr:`results`, with the fields given by
+  :func:`track_results_dtype`. Each field is also available as an attribute,
+  e.g. `track_result.P`, which is a view of that field of :attr:`results`.
+
+  Parameters
+  ----------
+  n_points : int
+    Number of records to allocate.
+  results : :class:`numpy.ndarray` or `None`, optional
+    Use this preallocated structured array, e.g. a row of an array in shared
+    memory or a memory mapped file, rather than allocating one.
+  precision : :class:`numpy.dtype`, optional
+    See :func:`track_results_dtype`.
+  filename : string or `None`, optional
+    If given, the results are allocated in a new memory mapped `.npy` file
+    of this name rather than in memory.
+
+  """
+
+  def __init__(self, n_points, results=None, precision=np.float64,
+               filename=None):
     self.status = '-'
     self.prn = None
-    self.absolute_sample = np.zeros(n_points)
-    self.code_phase = np.zeros(n_points)
-    self.code_phase_acc = np.zeros(n_points)
-    self.code_freq = np.zeros(n_points)
-    self.carr_phase = np.zeros(n_points)
-    self.carr_phase_acc = np.zeros(n_points)
-    self.carr_freq = np.zeros(n_points)
-    self.E = np.zeros(n_points, dtype=np.complex128)
-    self.P = np.zeros(n_points, dtype=np.complex128)
-    self.L = np.zeros(n_points, dtype=np.complex128)
-    self.cn0 = np.zeros(n_points)
     self.nav_msg = swiftnav.nav_msg.NavMsg()
-    self.nav_msg_bit_phase_ref = np.zeros(n_points)
     self.nav_bit_sync = NBSMatchBit()
-    self.tow = np.empty(n_points)
-    self.tow[:] = np.NAN
-    self.coherent_ms = np.zeros(n_points)
+    if results is None:
+      results = _allocate_results(n_points, precision, filename)
+    self.results = results
+
+  @property
+  def results(self):
+    """The structured array of results, or `None` if detached."""
+    return self._results
+
+  @results.setter
+  def results(self, results):
+    # Make the fields available as attributes.
+    old = getattr(self, '_results', None)
+    if old is not None:
+      for name in old.dtype.names:
+        self.__dict__.pop(name, None)
+    self._results = results
+    if results is not None:
+      for name in results.dtype.names:
+        self.__dict__[name] = results[name]
+
+  def __getstate__(self):
+    # The field views are recreated from the results when unpickled.
+    state = self.__dict__.copy()
+    if self._results is not None:
+      for name in self._results.dtype.names:
+        del state[name]
+    return state
+
+  def __setstate__(self, state):
+    results = state.pop('_results')
+    self.__dict__.update(state)
+    self.results = results
 
   def resize(self, n_points):
-    for k in dir(self):
-      v = getattr(self, k)
-      if isinstance(v, np.ndarray):
-        v.resize(n_points, refcheck=False)
+    # Preallocated arrays may be shared so the results can only be shrunk to a
+    # view.
+    self.results = self.results[:n_points]
+
+
+def save_track_results(filename, track_results):
+  """
+  Save a set of tracking results to a file.
+
+  The :attr:`TrackResults.results` arrays of all the channels are saved as a
+  single structured array, with a row per channel, in the `.npy` file
+  `filename + '.npy'`. The rest of the :class:`TrackResults` objects is
+  pickled to `filename`.
+
+  If the results are already rows of `filename + '.npy'`, as when
+  :func:`track` was called with that `results_file`, the arrays are only
+  flushed to disk rather than written again. The rows are then taken to be in
+  the order returned by :func:`track`.
+
+  Parameters
+  ----------
+  filename : string
+    Filename to save tracking results to.
+  track_results : [:class:`TrackResults`]
+    List of :class:`TrackResults` objects to save.
+
+  """
+  npy_filename = filename + '.npy'
+  in_place = all(getattr(tr.results, 'filename', None) ==
+                 os.path.abspath(npy_filename) for tr in track_results)
+  if in_place:
+    for tr in track_results:
+      tr.results.flush()
+  elif track_results:
+    n_points = max(len(tr.results) for tr in track_results)
+    arrays = np.lib.format.open_memmap(
+      npy_filename, mode='w+', dtype=track_results[0].results.dtype,
+      shape=(len(track_results), n_points))
+    for n, tr in enumerate(track_results):
+      arrays[n, :len(tr.results)] = tr.results
+    arrays.flush()
+    del arrays
+
+  stripped = []
+  for tr in track_results:
+    n_points = len(tr.results)
+    tr = copy.copy(tr)
+    tr.results = None
+    stripped.append((n_points, tr))
+  with open(filename, 'wb') as f:
+    cPickle.dump(stripped, f, protocol=cPickle.HIGHEST_PROTOCOL)
+
+
+def load_track_results(filename, mmap_mode='r'):
+  """
+  Load a set of tracking results saved by :func:`save_track_results`.
+
+  Tracking results files saved by earlier releases, a pickle of the
+  :class:`TrackResults` objects with all their arrays, are converted as they
+  are loaded.
+
+  Parameters
+  ----------
+  filename : string
+    Filename to load tracking results from.
+  mmap_mode : string or `None`, optional
+    Memory map mode of the results arrays, see :func:`numpy.load`. By
+    default the arrays are mapped read-only so loading is fast and the
+    results are only read from disk as they are used. If `None` then the
+    arrays are read into memory.
+
+  Returns
+  -------
+  track_results : [:class:`TrackResults`]
+    List of :class:`TrackResults` objects loaded from the file.
+
+  Raises
+  ------
+  ValueError
+    If the file isn't a tracking results file in a known format. Tracking
+    must then be run again to recreate it.
+
+  """
+  with open(filename, 'rb') as f:
+    try:
+      stripped = cPickle.load(f)
+    except TypeError:
+      # Old-style TrackResults instances can't be unpickled as the current
+      # class, which needs the number of points to be constructed.
+      f.seek(0)
+      track_results = _load_legacy_track_results(f)
+      if track_results is None:
+        raise ValueError(_UNKNOWN_FORMAT % filename)
+      logger.info("Converted tracking results '%s' from an earlier release."
+                  % filename)
+      return track_results
+  if not (isinstance(stripped, list) and
+          all(isinstance(item, tuple) and len(item) == 2 and
+              isinstance(item[1], TrackResults) for item in stripped)):
+    raise ValueError(_UNKNOWN_FORMAT % filename)
+  track_results = []
+  if stripped:
+    arrays = np.load(filename + '.npy', mmap_mode=mmap_mode)
+    for n, (n_points, tr) in enumerate(stripped):
+      tr.results = arrays[n, :n_points]
+      track_results.append(tr)
+  return track_results
+
+
+_UNKNOWN_FORMAT = ("'%s' isn't a tracking results file in a known format, "
+                   "re-run tracking to recreate it.")
+
+
+class _LegacyTrackResults:
+  # Stands in for TrackResults when unpickling the results files of earlier
+  # releases, which pickled each result array as an attribute.
+  pass
+
+
+def _load_legacy_track_results(f):
+  # Returns the TrackResults converted from a results file saved by an
+  # earlier release, or None if it isn't one.
+  def find_global(module, name):
+    if module.split('.')[-1] == 'tracking' and name == 'TrackResults':
+      return _LegacyTrackResults
+    __import__(module)
+    return getattr(sys.modules[module], name)
+
+  unpickler = cPickle.Unpickler(f)
+  unpickler.find_global = find_global
+  try:
+    legacy = unpickler.load()
+  except Exception:
+    return None
+  if not (isinstance(legacy, list) and
+          all(isinstance(tr, _LegacyTrackResults) for tr in legacy)):
+    return None
+
+  dtype = track_results_dtype()
+  track_results = []
+  for old in legacy:
+    try:
+      results = np.zeros(len(old.P), dtype)
+      for name in dtype.names:
+        results[name] = getattr(old, name)
+    except (AttributeError, ValueError):
+      return None
+    tr = TrackResults(len(results), results)
+    for name, value in old.__dict__.iteritems():
+      if name not in dtype.names:
+        setattr(tr, name, value)
+    track_results.append(tr)
+  return track_results
 
 
 class NavBitSync:
@@ -72,7 +72,8 @@ def warm_start(signal, t_prior, r_prior, v_prior, ephem, settings,
                                 settings.IF,
                                 settings.samplingFreq * gps.code_period,
                                 n_codes_integrate=n_codes_integrate,
-                                wisdom_file = wiz_file)
+                                wisdom_file = wiz_file,
+                                code_cache_dir = settings.cacheDir)
     # Attempt to acquire both the sats we predict are visible
     # and some we predict are not.
     acq_results = a.acquisition(threshold = settings.acqThreshold,
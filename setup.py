@@ -146,6 +146,9 @@ setup_args = dict(
       'peregrine = peregrine.run:main',
       'peregrine-analyze-samples = peregrine.analysis.samples:main',
       'peregrine-show-acq = peregrine.analysis.acquisition:main',
+      'peregrine-benchmark = peregrine.analysis.benchmark:main',
+      'peregrine-acq-service = peregrine.acquisition_service:main',
+      'peregrine-plan = peregrine.plan:main',
     ]
   },
 
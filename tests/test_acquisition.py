@@ -0,0 +1,643 @@
+import os
+import shutil
+import cPickle
+import tempfile
+import unittest
+import multiprocessing as mp
+
+import numpy as np
+import pyfftw
+
+import peregrine.acquisition as acquisition
+from peregrine.acquisition import Acquisition
+from peregrine.analysis.benchmark import synthetic_samples
+from peregrine.include.generateCAcode import caCodes
+from peregrine.samples import load_samples
+
+TEST_SAMPLES = os.path.join(os.path.dirname(__file__), "test_samples.dat")
+
+
+def load_test_samples():
+  return load_samples(TEST_SAMPLES, file_format='int8')
+
+
+def make_acq(samples, n_codes_integrate=1, **kwargs):
+  # Short integrations keep the time spent planning the FFTs down.
+  return Acquisition(samples, 16.368e6, 4.092e6, 16368,
+                     n_codes_integrate=n_codes_integrate, wisdom_file=None,
+                     **kwargs)
+
+
+def reference_acquire(samples, code, freqs, n_codes_integrate=1):
+  # The correlation powers as computed by the original implementation of
+  # Acquisition.acquire, with numpy.fft and unnormalised inverse transforms.
+  samples_per_code = 16368
+  n_integrate = n_codes_integrate * samples_per_code
+  code_indices = np.arange(1.0, n_integrate + 1.0) / (samples_per_code / 1023.0)
+  code_indices = np.remainder(np.asarray(code_indices, np.int), 1023)
+  code_ft_conj = np.conj(np.fft.fft(code[code_indices]))
+  offsets = [0, n_integrate]
+  results = np.empty((len(offsets), len(freqs), samples_per_code))
+  for offset_i, offset in enumerate(offsets):
+    short_samples_ft = np.fft.fft(samples[offset:offset + n_integrate])
+    for n, freq in enumerate(freqs):
+      shift = int(round(float(freq) * n_integrate / 16.368e6))
+      short_samples_ft_bb = np.append(short_samples_ft[shift:],
+                                      short_samples_ft[:shift])
+      corr = n_integrate * np.fft.ifft(short_samples_ft_bb * code_ft_conj)
+      results[offset_i, n] = np.square(np.abs(corr[:samples_per_code]))
+  max_indices = np.unravel_index(results.argmax(), results.shape)
+  return results[max_indices[0]]
+
+
+class TestReference(unittest.TestCase):
+
+  def setUp(self):
+    self.samples = load_test_samples()
+
+  def test_acquire_matches_reference(self):
+    # The spectrum is rotated by views into a doubled buffer rather than by
+    # copying it, for shifts either side of the middle of the spectrum.
+    freqs = np.concatenate((np.arange(-7000, 7000, 1000) + 4.092e6,
+                            [0.0, 8.1e6, 12.2e6]))
+    acq = make_acq(self.samples, real=False)
+    for prn in (1, 14):
+      reference = reference_acquire(self.samples, caCodes[prn], freqs)
+      np.testing.assert_allclose(acq.acquire(caCodes[prn], freqs), reference,
+                                 rtol=1e-9, atol=1e-9 * reference.max())
+
+
+class TestRealSamples(unittest.TestCase):
+
+  def test_hermitian_extend(self):
+    rng = np.random.RandomState(0)
+    for n in (16, 17):
+      x = rng.randn(n)
+      out = np.empty(n, dtype=np.complex128)
+      acquisition.hermitian_extend(np.fft.rfft(x), out)
+      np.testing.assert_allclose(out, np.fft.fft(x), rtol=0, atol=1e-12)
+
+  def test_real_matches_complex(self):
+    samples = load_test_samples()
+    freqs = np.arange(-7000, 7000, 1000) + 4.092e6
+    real_acq = make_acq(samples)
+    self.assertTrue(real_acq.real)
+    complex_acq = make_acq(samples, real=False)
+    for prn in (1, 14):
+      reference = reference_acquire(samples, caCodes[prn], freqs)
+      np.testing.assert_allclose(real_acq.acquire(caCodes[prn], freqs),
+                                 complex_acq.acquire(caCodes[prn], freqs),
+                                 rtol=1e-9, atol=1e-9 * reference.max())
+      np.testing.assert_allclose(real_acq.acquire(caCodes[prn], freqs),
+                                 reference, rtol=1e-9,
+                                 atol=1e-9 * reference.max())
+
+  def test_complex_samples(self):
+    samples = load_test_samples()[:3 * 16368].astype(np.complex128)
+    self.assertFalse(make_acq(samples).real)
+
+
+class TestFFTSize(unittest.TestCase):
+
+  SIGNALS = ((3, 210.3, 1870.0), (17, 905.6, -2650.0))
+  PRNS = [3, 17, 8]
+
+  def test_next_fast_len(self):
+    def smooth(n):
+      for factor in (2, 3, 5, 7):
+        while n % factor == 0:
+          n //= factor
+      return n == 1
+    for n in (1, 16368, 32736, 65472):
+      fast = acquisition.next_fast_len(n)
+      self.assertTrue(smooth(fast))
+      self.assertFalse(any(smooth(m) for m in range(n, fast)))
+
+  def test_sizes(self):
+    acq = make_acq(None, fft_size='pad')
+    self.assertEqual(acq.fft_size, acquisition.next_fast_len(2 * 16368))
+    acq = make_acq(None, fft_size='resample')
+    self.assertEqual(acq.fft_size, acquisition.next_fast_len(16368))
+    with self.assertRaises(ValueError):
+      make_acq(None, fft_size=16368 + 100)
+
+  def test_results_match_unpadded(self):
+    # Padding or resampling to a fast FFT length finds the same signals, at
+    # the same code phases within a sample and Doppler within half of the
+    # 1 kHz frequency resolution of a 1 ms integration.
+    samples = synthetic_samples(4 * 16368, self.SIGNALS)
+    reference = make_acq(samples).acquisition(self.PRNS, show_progress=False,
+                                              multi=False)
+    self.assertEqual([r.status for r in reference], ['A', 'A', '-'])
+    for fft_size in ('pad', 'resample'):
+      results = make_acq(samples, fft_size=fft_size).acquisition(
+        self.PRNS, show_progress=False, multi=False)
+      for r, ref, (_, code_phase, doppler) in zip(results, reference,
+                                                  self.SIGNALS):
+        self.assertEqual(r.status, ref.status)
+        self.assertAlmostEqual(r.code_phase, ref.code_phase, delta=1 / 16.0)
+        self.assertAlmostEqual(r.code_phase, code_phase, delta=2 / 16.0)
+        self.assertAlmostEqual(r.doppler, doppler, delta=500)
+
+
+class TestReducedResults(unittest.TestCase):
+
+  def check_matches_full(self, full):
+    # Rows are added as acquire adds them, offsets within each frequency.
+    n_offsets, n_freqs, n_code = full.shape
+    reduced = acquisition.ReducedResults(n_offsets, n_freqs, n_code)
+    for n in range(n_freqs):
+      for offset_i in range(n_offsets):
+        reduced.add(offset_i, n, full[offset_i, n])
+    offset_i, n, k = np.unravel_index(full.argmax(), full.shape)
+    self.assertEqual((reduced.offset_index, reduced.freq_index,
+                      reduced.code_phase_index), (offset_i, n, k))
+    self.assertEqual(reduced.max, full.max())
+    np.testing.assert_array_equal(reduced.row_max, full.max(axis=2))
+    np.testing.assert_array_equal(reduced.row_argmax, full.argmax(axis=2))
+    np.testing.assert_allclose(reduced.row_sum, full.sum(axis=2), rtol=1e-12)
+    self.assertAlmostEqual(reduced.mean(), full[offset_i].mean(),
+                           delta=1e-12 * full.max())
+    for i, row in enumerate(range(n - 1, n + 2)):
+      if 0 <= row < n_freqs:
+        np.testing.assert_array_equal(reduced.peak_rows[i],
+                                      full[offset_i, row])
+      else:
+        self.assertTrue(np.all(np.isnan(reduced.peak_rows[i])))
+
+  def test_matches_full(self):
+    rng = np.random.RandomState(0)
+    for peak in [(0, 3, 7), (1, 0, 2), (1, 5, 0), (0, 2, 9)]:
+      full = rng.rand(2, 6, 10)
+      full[peak] = 2.0
+      self.check_matches_full(full)
+
+  def test_acquire(self):
+    acq = make_acq(load_test_samples())
+    freqs = np.arange(-3000, 3000, 500) + 4.092e6
+    reduced = acq.acquire(caCodes[14], freqs, reduce=True)
+    full = acq.acquire(caCodes[14], freqs)
+    self.assertEqual((reduced.freq_index, reduced.code_phase_index),
+                     np.unravel_index(full.argmax(), full.shape))
+    self.assertEqual(reduced.max, full.max())
+    np.testing.assert_allclose(reduced.row_max[reduced.offset_index],
+                               full.max(axis=1), rtol=1e-12)
+    np.testing.assert_allclose(reduced.peak_rows[1], full[reduced.freq_index],
+                               rtol=1e-12)
+
+
+class TestAcquirePrns(unittest.TestCase):
+
+  PRNS = [1, 14, 23, 5]
+
+  def setUp(self):
+    self.acq = make_acq(load_test_samples())
+    self.freqs = np.arange(-3000, 3000, 500) + 4.092e6
+
+  def test_shared_freqs(self):
+    results = self.acq.acquire_prns(self.PRNS, self.freqs)
+    self.assertEqual(results.shape, (len(self.PRNS), len(self.freqs), 16368))
+    for prn, result in zip(self.PRNS, results):
+      single = self.acq.acquire(caCodes[prn], self.freqs)
+      np.testing.assert_allclose(result, single, rtol=1e-9,
+                                 atol=1e-9 * single.max())
+
+  def test_freqs_per_prn(self):
+    freqs = np.array([self.freqs + 100 * n for n in range(len(self.PRNS))])
+    results = self.acq.acquire_prns(self.PRNS, freqs)
+    for prn, prn_freqs, result in zip(self.PRNS, freqs, results):
+      single = self.acq.acquire(caCodes[prn], prn_freqs)
+      np.testing.assert_allclose(result, single, rtol=1e-9,
+                                 atol=1e-9 * single.max())
+
+  def test_reduced(self):
+    results = self.acq.acquire_prns(self.PRNS, self.freqs, reduce=True)
+    for prn, result in zip(self.PRNS, results):
+      single = self.acq.acquire(caCodes[prn], self.freqs, reduce=True)
+      self.assertEqual((result.freq_index, result.code_phase_index),
+                       (single.freq_index, single.code_phase_index))
+      np.testing.assert_allclose(result.row_max, single.row_max, rtol=1e-9)
+      np.testing.assert_allclose(result.row_sum, single.row_sum, rtol=1e-9)
+
+
+class TestBatchAcquisition(unittest.TestCase):
+
+  # Size of the batched inverse FFT arrays per frequency searched.
+  ROW_BYTES = 2 * 16368 * 16
+
+  def setUp(self):
+    self.samples = load_test_samples()
+    self.freqs = np.arange(-2000, 2000, 250) + 4.092e6
+    self.chunk_bytes = acquisition.BATCH_CHUNK_BYTES
+
+  def tearDown(self):
+    acquisition.BATCH_CHUNK_BYTES = self.chunk_bytes
+
+  def test_matches_loop(self):
+    loop = make_acq(self.samples).acquire(caCodes[0], self.freqs)
+    # Force several uneven chunks, with a partial last chunk.
+    acquisition.BATCH_CHUNK_BYTES = 3 * self.ROW_BYTES
+    acq = make_acq(self.samples, batch=True)
+    batch = acq.acquire(caCodes[0], self.freqs)
+    self.assertEqual(acq.batch_ifft.input_array.shape[1], 3)
+    np.testing.assert_allclose(batch, loop, rtol=1e-9,
+                               atol=1e-9 * loop.max())
+
+  def test_reduced_matches_loop(self):
+    acquisition.BATCH_CHUNK_BYTES = 5 * self.ROW_BYTES
+    loop = make_acq(self.samples).acquire(caCodes[0], self.freqs,
+                                          reduce=True)
+    batch = make_acq(self.samples, batch=True).acquire(caCodes[0], self.freqs,
+                                                       reduce=True)
+    self.assertEqual(batch.freq_index, loop.freq_index)
+    self.assertEqual(batch.code_phase_index, loop.code_phase_index)
+    np.testing.assert_allclose(batch.row_max, loop.row_max, rtol=1e-9)
+
+  def test_plan_memory_bounded(self):
+    acq = make_acq(self.samples, batch=True)
+    freqs = np.arange(-7000, 7000, 10) + 4.092e6
+    acq.acquire(caCodes[0], freqs, reduce=True)
+    self.assertLessEqual(acq.batch_ifft.input_array.nbytes,
+                         acquisition.BATCH_CHUNK_BYTES)
+    # The plan is reused for the same number of frequencies.
+    plan = acq.batch_ifft
+    acq.acquire(caCodes[1], freqs, reduce=True)
+    self.assertIs(acq.batch_ifft, plan)
+
+
+class TestHierarchicalSearch(unittest.TestCase):
+
+  SIGNALS = ((2, 300.2, 2310.0), (9, 87.0, -4420.0), (20, 700.6, 130.0))
+  PRNS = [2, 9, 20, 4, 11]
+
+  def setUp(self):
+    samples = synthetic_samples(6 * 16368, self.SIGNALS, noise_std=12.0)
+    # Padded FFT lengths are quick to plan.
+    self.acq = make_acq(samples, n_codes_integrate=2, fft_size='pad')
+
+  def check_matches_exhaustive(self, **kwargs):
+    exhaustive = self.acq.acquisition(self.PRNS, show_progress=False,
+                                      multi=False, **kwargs)
+    hierarchical = self.acq.acquisition(self.PRNS, show_progress=False,
+                                        multi=False, coarse_codes_integrate=1,
+                                        **kwargs)
+    self.assertEqual([r.status for r in exhaustive], ['A'] * 3 + ['-'] * 2)
+    for e, h in zip(exhaustive, hierarchical):
+      self.assertEqual(h.status, e.status)
+      if e.status == 'A':
+        self.assertEqual(h.code_phase, e.code_phase)
+        # The refined frequencies are not on the exhaustive search's grid.
+        self.assertAlmostEqual(h.doppler, e.doppler,
+                               delta=self.acq.sampling_freq / self.acq.fft_size)
+        # The SNR is estimated against the same noise level.
+        self.assertAlmostEqual(h.snr, e.snr, delta=0.1 * e.snr)
+
+  def test_matches_exhaustive(self):
+    self.check_matches_exhaustive()
+
+  def test_reduced_matches_exhaustive(self):
+    self.check_matches_exhaustive(reduce=True)
+
+  def test_batch_prns_matches_exhaustive(self):
+    self.check_matches_exhaustive(batch_prns=True)
+
+
+class TestPeakStatistics(unittest.TestCase):
+
+  SIGNALS = ((0, 123.4, 1250.0), (14, 512.0, -3300.0))
+  PRNS = [0, 14, 7]
+
+  def setUp(self):
+    samples = synthetic_samples(3 * 16368, self.SIGNALS)
+    self.acq = make_acq(samples)
+
+  def test_reduced_matches_full(self):
+    freqs = np.arange(-5000, 5000, 500) + 4.092e6
+    for prn in self.PRNS:
+      full = self.acq.acquire(caCodes[prn], freqs)
+      reduced = self.acq.acquire(caCodes[prn], freqs, reduce=True)
+      np.testing.assert_allclose(self.acq.find_peak(freqs, reduced),
+                                 self.acq.find_peak(freqs, full), rtol=1e-12)
+      np.testing.assert_allclose(self.acq.peak_statistics(reduced),
+                                 self.acq.peak_statistics(full), rtol=1e-9)
+
+  def test_statistics(self):
+    freqs = np.arange(-5000, 5000, 500) + 4.092e6
+    full = self.acq.acquire(caCodes[0], freqs)
+    peak_ratio, noise_floor = self.acq.peak_statistics(full)
+    self.assertAlmostEqual(noise_floor,
+                           np.median(np.median(full[:, ::8], axis=1)) /
+                           np.log(2), delta=1e-9 * noise_floor)
+    # The median based estimate of the mean noise power agrees with the mean
+    # of the bins far from the signal.
+    freq_index = full.max(axis=1).argmax()
+    far = np.abs(np.arange(len(freqs)) - freq_index) > 1
+    self.assertAlmostEqual(noise_floor, full[far].mean(),
+                           delta=0.1 * noise_floor)
+    # A clear signal stands well above the noise and the cross-correlation.
+    self.assertGreater(peak_ratio, 3)
+    self.assertGreater(full.max() / noise_floor, 50)
+
+  def grid(self, n_prns=3, n_freqs=7):
+    # Exponentially distributed noise powers.
+    rng = np.random.RandomState(3)
+    return rng.exponential(size=(n_prns, n_freqs, 16368))
+
+  def test_second_peak(self):
+    freqs = np.arange(7) * 500.0
+    results = self.grid()
+    # PRN 0: a second peak in the peak's own row, and greater powers within a
+    # chip of the peak in the other rows, which are ignored.
+    results[0, 3, 1000] = 100
+    results[0, 3, 5000] = 40
+    results[0, :, 1010] = 60
+    # PRN 1: every row peaks within a chip of the peak.
+    results[1, :, 2000] = 50
+    results[1, 2, 2000] = 100
+    # PRN 2: the peak near the wrap of the code phase, with the second peak
+    # just more than a chip away across the wrap.
+    results[2, 5, 3] = 100
+    results[2, 6, 16368 - 14] = 80
+    results[2, 6, 16368 - 13] = 90
+    expected = []
+    for r in results:
+      freq_index, cp = np.unravel_index(r.argmax(), r.shape)
+      d = np.abs(np.arange(16368) - cp)
+      far = np.minimum(d, 16368 - d) > 16
+      expected.append(r.max() / r[:, far].max())
+    self.assertAlmostEqual(expected[0], 100 / 40.0)
+    self.assertAlmostEqual(expected[2], 100 / 80.0)
+    _, _, _, peak_ratios, _ = self.acq.analyse_peaks(freqs, results)
+    np.testing.assert_allclose(peak_ratios, expected, rtol=1e-12)
+    self.assertTrue(np.all(np.isfinite(peak_ratios)))
+
+    # Reduced results give the same ratios, rows are added in order.
+    for n, r in enumerate(results):
+      reduced = acquisition.ReducedResults(1, len(freqs), 16368,
+                                           samples_per_chip=16.0)
+      for k, row in enumerate(r):
+        reduced.add(0, k, row)
+      self.assertAlmostEqual(self.acq.peak_statistics(reduced)[0],
+                             expected[n], delta=1e-12 * expected[n])
+
+  def test_noise_floor_robust(self):
+    # A strong signal spread over many bins barely moves the noise floor.
+    freqs = np.arange(7) * 500.0
+    results = self.grid(n_prns=1)
+    _, _, _, _, (noise_floor,) = self.acq.analyse_peaks(freqs, results)
+    self.assertAlmostEqual(noise_floor, 1.0, delta=0.05)
+    results[0, :, 4000:4200] = 1e6
+    _, _, _, _, (signal_noise_floor,) = self.acq.analyse_peaks(freqs,
+                                                               results)
+    self.assertAlmostEqual(signal_noise_floor, noise_floor,
+                           delta=0.05 * noise_floor)
+
+  def test_code_phase_interpolation(self):
+    # The amplitude is a triangle one chip wide either side of the apex.
+    freqs = np.arange(5) * 500.0
+    results = np.zeros((4, 5, 16368))
+    apexes = [5000.0, 5000.3, 4999.75, 0.4]
+    k = np.arange(16368)
+    for n, apex in enumerate(apexes):
+      d = np.abs(k - apex)
+      d = np.minimum(d, 16368 - d)
+      results[n, 2] = np.square(np.maximum(0, 1 - d / 16.0)) + 1e-3
+    code_phases, _, _, _, _ = self.acq.analyse_peaks(freqs, results)
+    np.testing.assert_allclose(code_phases, np.array(apexes) / 16.0,
+                               atol=1e-3 / 16)
+    code_phases, _, _, _, _ = self.acq.analyse_peaks(freqs, results, 'none')
+    np.testing.assert_array_equal(code_phases,
+                                  np.round(apexes) / 16.0)
+
+  def test_batch_matches_single(self):
+    # All the PRNs analysed at once give the same as each on its own.
+    freqs = np.arange(-5000, 5000, 500) + 4.092e6
+    batch = self.acq.acquire_prns(self.PRNS, freqs)
+    analysed = np.transpose(self.acq.analyse_peaks(freqs, batch))
+    reduced = self.acq.acquire_prns(self.PRNS, freqs, reduce=True)
+    np.testing.assert_allclose(
+      np.transpose(self.acq.analyse_peaks(freqs, reduced)), analysed,
+      rtol=1e-9)
+    for prn, row in zip(self.PRNS, analysed):
+      full = self.acq.acquire(caCodes[prn], freqs)
+      np.testing.assert_allclose(row, self.acq.find_peak(freqs, full) +
+                                 self.acq.peak_statistics(full), rtol=1e-9)
+
+  def test_paths_agree(self):
+    kwargs = [dict(multi=False), dict(multi=False, reduce=True),
+              dict(batch_prns=True), dict(batch_prns=True, reduce=True)]
+    results = [self.acq.acquisition(self.PRNS, doppler_search=5000,
+                                    show_progress=False, **kw)
+               for kw in kwargs]
+    for path_results in results[1:]:
+      for r, r0 in zip(path_results, results[0]):
+        self.assertEqual(r.status, r0.status)
+        self.assertAlmostEqual(r.code_phase, r0.code_phase, delta=1e-9)
+        self.assertAlmostEqual(r.doppler, r0.doppler, delta=1e-6)
+        self.assertAlmostEqual(r.snr, r0.snr, delta=1e-9 * r0.snr)
+        self.assertAlmostEqual(r.peak_ratio, r0.peak_ratio,
+                               delta=1e-9 * r0.peak_ratio)
+        self.assertAlmostEqual(r.noise_floor, r0.noise_floor,
+                               delta=1e-9 * r0.noise_floor)
+
+
+class TestParallelism(unittest.TestCase):
+
+  def setUp(self):
+    self.cpu_count = acquisition.mp.cpu_count
+    self.min_size = acquisition.THREADED_FFT_MIN_SIZE
+
+  def tearDown(self):
+    acquisition.mp.cpu_count = self.cpu_count
+    acquisition.THREADED_FFT_MIN_SIZE = self.min_size
+
+  def test_plan_parallelism(self):
+    large = acquisition.THREADED_FFT_MIN_SIZE
+    plan = acquisition.plan_parallelism
+    # Jobs go to processes first, spare CPUs become threads for large FFTs.
+    self.assertEqual(plan(large, 32, n_cpus=8), (1, 8))
+    self.assertEqual(plan(large, 2, n_cpus=8), (4, 2))
+    self.assertEqual(plan(large - 1, 2, n_cpus=8), (1, 2))
+    self.assertEqual(plan(large, 1, n_cpus=8), (8, 1))
+    self.assertEqual(plan(large, 3, threads=2, n_cpus=8), (2, 3))
+    self.assertEqual(plan(large, 3, n_cpus=1), (1, 1))
+
+  def test_threaded_matches_single(self):
+    samples = load_test_samples()
+    freqs = np.arange(-2000, 2000, 500) + 4.092e6
+    single = make_acq(samples).acquire(caCodes[5], freqs)
+    threaded = make_acq(samples, threads=2).acquire(caCodes[5], freqs)
+    np.testing.assert_allclose(threaded, single, rtol=1e-9,
+                               atol=1e-9 * single.max())
+
+  def test_auto_threads_replan(self):
+    acquisition.mp.cpu_count = lambda: 4
+    acquisition.THREADED_FFT_MIN_SIZE = 16368
+    samples = load_test_samples()
+    acq = make_acq(samples, threads=None)
+    self.assertEqual(acq.threads, 4)
+    acq.acquisition(range(2), doppler_search=1000, show_progress=False)
+    self.assertEqual(acq.threads, 2)
+    self.assertEqual(acq.fft_plans[0][3], 2)
+
+  def test_workers_kept(self):
+    # The PRNs are acquired by the pool's persistent workers, which keep
+    # their Acquisition object for new samples and settings.
+    from peregrine import parallel_processing as pp
+    samples = load_test_samples()
+    prns = [1, 8, 14, 23]
+    procs = None
+    for num_skip, kwargs in [(0, {}), (16368, {}),
+                             (0, dict(coarse_codes_integrate=1)),
+                             (0, dict(reduce=True))]:
+      acq = make_acq(samples[num_skip:], n_codes_integrate=2)
+      results = acq.acquisition(prns, doppler_search=3000,
+                                show_progress=False, **kwargs)
+      _, nprocs = acquisition.plan_parallelism(acq.fft_size, len(prns),
+                                               threads=1)
+      pool = pp.get_pool(nprocs)
+      procs = procs or list(pool.procs)
+      self.assertTrue(procs)
+      self.assertEqual(pool.procs, procs)
+      expected = acq.acquisition(prns, doppler_search=3000,
+                                 show_progress=False, multi=False, **kwargs)
+      self.assertEqual([r.__dict__ for r in results],
+                       [r.__dict__ for r in expected])
+
+
+class TestPrecision(unittest.TestCase):
+
+  SIGNALS = ((0, 123.4, 1250.0), (14, 512.0, -3300.0))
+
+  def setUp(self):
+    self.samples = synthetic_samples(3 * 16368, self.SIGNALS)
+
+  def test_powers_match_double(self):
+    freqs = np.arange(-2000, 2000, 500) + 4.092e6
+    double = make_acq(self.samples).acquire(caCodes[0], freqs)
+    single = make_acq(self.samples, dtype=np.complex64).acquire(caCodes[0],
+                                                                freqs)
+    self.assertEqual(single.dtype, np.float32)
+    # Single precision FFTs are accurate to about 1e-6 of the largest value.
+    np.testing.assert_allclose(single, double, rtol=0,
+                               atol=1e-5 * double.max())
+
+  def test_results_match_double(self):
+    prns = [prn for prn, _, _ in self.SIGNALS] + [5]
+    double = make_acq(self.samples).acquisition(
+      prns, show_progress=False, multi=False)
+    single = make_acq(self.samples, dtype=np.complex64).acquisition(
+      prns, show_progress=False, multi=False)
+    for d, s in zip(double, single):
+      self.assertEqual(s.status, d.status)
+      # The peak is at the same code phase sample, only the interpolation
+      # differs.
+      self.assertAlmostEqual(s.code_phase, d.code_phase, delta=1e-3)
+      self.assertAlmostEqual(s.doppler, d.doppler, delta=1.0)
+      self.assertAlmostEqual(s.snr, d.snr, delta=1e-4 * d.snr)
+
+
+class TestCodeSpectrumCache(unittest.TestCase):
+
+  def setUp(self):
+    self.cache_dir = tempfile.mkdtemp()
+    self.key = (0, 16.368e6, 16.0, 16368, 1023, 'complex128', 16368, None)
+    self.spectrum = np.arange(16368) * (1 + 1j)
+
+  def tearDown(self):
+    shutil.rmtree(self.cache_dir)
+
+  def test_cached_acquisition_matches(self):
+    samples = load_test_samples()
+    freqs = np.arange(-2000, 2000, 500) + 4.092e6
+    uncached = make_acq(samples).acquire(caCodes[3], freqs)
+    acq = make_acq(samples, code_cache_dir=self.cache_dir)
+    key = acq.code_cache_key(3)
+    acq.code_cache.spectra.clear()
+    first = acq.acquire(caCodes[3], freqs, prn=3)
+    self.assertTrue(os.path.exists(acq.code_cache.filename(key)))
+    # Load the spectrum back from disk rather than from memory.
+    acq.code_cache.spectra.clear()
+    second = acq.acquire(caCodes[3], freqs, prn=3)
+    self.assertIsInstance(acq.code_cache.spectra[key], np.memmap)
+    np.testing.assert_array_equal(first, uncached)
+    np.testing.assert_array_equal(second, uncached)
+
+  def check_rewritten(self, cache):
+    self.assertIsNone(cache.get(self.key))
+    cache.put(self.key, self.spectrum)
+    cache = acquisition.CodeSpectrumCache(self.cache_dir)
+    np.testing.assert_array_equal(cache.get(self.key), self.spectrum)
+
+  def test_truncated_file_is_miss(self):
+    cache = acquisition.CodeSpectrumCache(self.cache_dir)
+    cache.put(self.key, self.spectrum)
+    with open(cache.filename(self.key), 'r+b') as f:
+      f.truncate(1000)
+    self.check_rewritten(acquisition.CodeSpectrumCache(self.cache_dir))
+
+  def test_mismatched_file_is_miss(self):
+    cache = acquisition.CodeSpectrumCache(self.cache_dir)
+    np.save(cache.filename(self.key), self.spectrum[:100])
+    self.check_rewritten(acquisition.CodeSpectrumCache(self.cache_dir))
+    np.save(cache.filename(self.key), self.spectrum.astype(np.complex64))
+    self.check_rewritten(acquisition.CodeSpectrumCache(self.cache_dir))
+
+
+def save_plans(filename, plans):
+  for plan in plans:
+    acquisition.WisdomStore(filename).save([plan])
+
+
+class TestWisdomStore(unittest.TestCase):
+
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.filename = os.path.join(self.dir, 'wisdom', 'fftw_wisdom')
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def test_round_trip(self):
+    plan = ('r2c', 16368, 'complex128', 1)
+    self.assertTrue(acquisition.WisdomStore(self.filename).save([plan]))
+    store = acquisition.WisdomStore(self.filename)
+    store.load()
+    self.assertEqual(store.plans, set([plan]))
+    # Nothing new to save.
+    self.assertFalse(store.save([plan]))
+
+  def test_old_format(self):
+    with open(self.filename.replace('wisdom/', ''), 'wb') as f:
+      cPickle.dump(pyfftw.export_wisdom(), f)
+    store = acquisition.WisdomStore(self.filename.replace('wisdom/', ''))
+    store.load()
+    self.assertEqual(store.plans, set())
+
+  def test_rewrite_detected(self):
+    store = acquisition.WisdomStore(self.filename)
+    store.save([('r2c', 1, 'complex128', 1)])
+    mtime = os.path.getmtime(self.filename)
+    acquisition.WisdomStore(self.filename).save([('c2c', 2, 'complex128', 1)])
+    # A rewrite within the same second as the last load has the same mtime.
+    os.utime(self.filename, (mtime, mtime))
+    store.load()
+    self.assertIn(('c2c', 2, 'complex128', 1), store.plans)
+
+  def test_concurrent_saves(self):
+    os.makedirs(os.path.dirname(self.filename))
+    plans = [[('c2c', 100 * n + k, 'complex128', 1) for k in range(10)]
+             for n in range(4)]
+    procs = [mp.Process(target=save_plans, args=(self.filename, p))
+             for p in plans]
+    for proc in procs:
+      proc.start()
+    for proc in procs:
+      proc.join()
+    store = acquisition.WisdomStore(self.filename)
+    store.load()
+    self.assertEqual(store.plans, set(sum(plans, [])))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,99 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from multiprocessing import AuthenticationError
+
+from peregrine.acquisition import Acquisition
+from peregrine.acquisition_service import AcquisitionEngine, load_key, \
+                                          request, serve
+from peregrine.samples import load_samples
+
+TEST_SAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            "test_samples.dat")
+# Short integrations keep the time spent planning the FFTs down.
+ACQ_KWARGS = dict(n_codes_integrate=1, wisdom_file=None, code_cache_dir=None)
+
+
+class TestKey(unittest.TestCase):
+
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.filename = os.path.join(self.dir, 'cache', 'key')
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def test_create(self):
+    self.assertRaises(IOError, load_key, self.filename)
+    key = load_key(self.filename, create=True)
+    self.assertEqual(os.stat(self.filename).st_mode & 0777, 0600)
+    self.assertGreaterEqual(len(key), 32)
+    self.assertEqual(load_key(self.filename, create=True), key)
+    self.assertEqual(load_key(self.filename), key)
+
+  def test_accessible_by_others(self):
+    load_key(self.filename, create=True)
+    os.chmod(self.filename, 0644)
+    self.assertRaises(IOError, load_key, self.filename)
+
+
+class TestService(unittest.TestCase):
+
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.key = load_key(os.path.join(self.dir, 'key'), create=True)
+    self.address = os.path.join(self.dir, 'socket')
+    self.engine = AcquisitionEngine(**ACQ_KWARGS)
+    self.thread = threading.Thread(target=serve,
+                                   args=(self.engine, self.address, self.key))
+    self.thread.daemon = True
+    self.thread.start()
+    while not os.path.exists(self.address):
+      self.thread.join(0.01)
+
+  def tearDown(self):
+    if self.thread.is_alive():
+      request(('shutdown',), self.address, self.key)
+    self.thread.join()
+    shutil.rmtree(self.dir)
+
+  def test_stats(self):
+    stats = request(('stats',), self.address, self.key)
+    self.assertEqual(stats['n_captures'], 0)
+
+  def test_wrong_key_rejected(self):
+    self.assertRaises(AuthenticationError, request, ('shutdown',),
+                      self.address, 'wrong key')
+    # The service keeps running.
+    self.assertEqual(request(('stats',), self.address, self.key)
+                     ['n_captures'], 0)
+
+  def test_errors_reported(self):
+    self.assertRaises(RuntimeError, request,
+                      ('acquire', os.path.join(self.dir, 'missing.dat'), {}),
+                      self.address, self.key)
+    self.assertRaises(RuntimeError, request, ('bogus',), self.address,
+                      self.key)
+
+  def test_acquire_matches_direct(self):
+    # Captures acquired by the service, reusing one Acquisition object, give
+    # the same results as a new Acquisition object for each.
+    prns = [1, 8, 14, 23]
+    for num_skip in (0, 16368, 0):
+      results = request(('acquire', TEST_SAMPLES,
+                         dict(file_format='int8', num_samples=8 * 16368,
+                              num_skip=num_skip, prns=prns)),
+                        self.address, self.key)
+      samples = load_samples(TEST_SAMPLES, 8 * 16368, num_skip, 'int8')
+      reference = Acquisition(samples, **ACQ_KWARGS).acquisition(
+        prns=prns, show_progress=False)
+      self.assertEqual([r.__dict__ for r in results],
+                       [r.__dict__ for r in reference])
+    self.assertEqual(request(('stats',), self.address, self.key)
+                     ['n_captures'], 3)
+
+
+if __name__ == '__main__':
+  unittest.main()
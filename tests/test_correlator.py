@@ -0,0 +1,237 @@
+import unittest
+
+import numpy as np
+
+from peregrine import defaults
+from peregrine.analysis.benchmark import synthetic_samples
+from peregrine.correlator import track_correlate, track_correlate_multi
+from peregrine.correlator import track_correlate_block, LUTCorrelator
+from peregrine.include.generateCAcode import caCodes
+
+try:
+  import swiftnav.correlate
+except ImportError:
+  swiftnav = None
+
+PRN = 4
+DOPPLER = 1250.0
+
+
+def padded_code(prn):
+  return np.concatenate(([caCodes[prn][-1]], caCodes[prn], [caCodes[prn][0]]))
+
+
+def reference_correlate(samples, code_freq, code_phase, carr_freq, carr_phase,
+                        code, sampling_freq):
+  # The sample by sample algorithm of swiftnav.correlate.track_correlate,
+  # with the chip and carrier phase of each sample computed directly.
+  code_length = len(code) - 2
+  code_step = code_freq / sampling_freq
+  carr_step = carr_freq * 2 * np.pi / sampling_freq
+  blksize = int(np.ceil((code_length - code_phase) / code_step))
+  k = np.arange(blksize)
+  code_phases = code_phase + k * code_step
+  carr_phases = carr_phase + k * carr_step
+  baseband = samples[:blksize] * (np.sin(carr_phases) +
+                                  1j * np.cos(carr_phases))
+  E, P, L = [np.sum(code[np.asarray(np.ceil(code_phases + offset),
+                                    dtype=np.int)] * baseband)
+             for offset in (-0.5, 0, 0.5)]
+  return (E, P, L, blksize, code_phase + blksize * code_step - code_length,
+          np.fmod(carr_phase + blksize * carr_step, 2 * np.pi))
+
+
+def run(correlator, samples, n_periods, code_phase=0.0, carr_phase=0.0,
+        doppler=DOPPLER):
+  # Correlate consecutive code periods, each starting from the phases the
+  # previous one returned, as a tracking loop in lock does.
+  code = padded_code(PRN)
+  code_freq = defaults.chipping_rate * (1 + doppler / 1.57542e9)
+  carr_freq = defaults.IF + doppler
+  out = np.empty(n_periods, dtype=[('corrs', np.complex128, 3),
+                                   ('blksize', np.int),
+                                   ('code_phase', np.float64),
+                                   ('carr_phase', np.float64),
+                                   ('amplitude', np.float64)])
+  sample_index = 0
+  for n in range(n_periods):
+    E, P, L, blksize, code_phase, carr_phase = correlator(
+      samples[sample_index:], code_freq, code_phase, carr_freq, carr_phase,
+      code, defaults.sampling_freq)
+    out[n] = ((E, P, L), blksize, code_phase, carr_phase,
+              np.sum(np.abs(samples[sample_index:sample_index + blksize])))
+    sample_index += blksize
+  return out
+
+
+class TestTrackCorrelate(unittest.TestCase):
+
+  def setUp(self):
+    self.samples = synthetic_samples(8 * 16368, [(PRN, 0.0, DOPPLER)],
+                                     noise_std=1.0)
+
+  def assert_close(self, corr, reference, amplitude):
+    E, P, L, blksize, code_phase, carr_phase = corr
+    E_ref, P_ref, L_ref, blksize_ref, code_phase_ref, carr_phase_ref = \
+      reference
+    self.assertEqual(blksize, blksize_ref)
+    np.testing.assert_allclose([code_phase, carr_phase],
+                               [code_phase_ref, carr_phase_ref],
+                               rtol=0, atol=1e-9)
+    np.testing.assert_allclose([E, P, L], [E_ref, P_ref, L_ref],
+                               rtol=0, atol=1e-9 * amplitude)
+
+  def test_single(self):
+    code = padded_code(PRN)
+    for code_phase, carr_phase, doppler in [
+        (0.0, 0.0, DOPPLER), (0.25, 1.0, -DOPPLER), (0.5, 6.2, 4000.0),
+        (0.999, 3.0, -defaults.IF - DOPPLER)]:
+      args = (defaults.chipping_rate * (1 + doppler / 1.57542e9),
+              code_phase, defaults.IF + doppler, carr_phase, code,
+              defaults.sampling_freq)
+      reference = reference_correlate(self.samples, *args)
+      self.assert_close(track_correlate(self.samples, *args), reference,
+                        np.sum(np.abs(self.samples[:reference[3]])))
+
+  def test_multi(self):
+    # Channels at different offsets in the samples, with different codes,
+    # each as correlated on its own.
+    prns = [PRN, 0, 17, 31]
+    sample_indices = [0, 1000, 16368, 3 * 16368 + 7]
+    code_freqs = defaults.chipping_rate * (1 + np.array([1.0, -2.0, 0, 3.0])
+                                           * 1e-6)
+    code_phases = [0.0, 0.3, 0.75, 0.5]
+    carr_freqs = defaults.IF + np.array([DOPPLER, -4000.0, 0.0, 2500.0])
+    carr_phases = [0.0, 1.0, 2.0, 6.0]
+    codes = np.array([padded_code(prn) for prn in prns])
+    corrs = track_correlate_multi(self.samples, sample_indices, code_freqs,
+                                  code_phases, carr_freqs, carr_phases, codes,
+                                  defaults.sampling_freq)
+    for n, sample_index in enumerate(sample_indices):
+      reference = reference_correlate(
+        self.samples[sample_index:], code_freqs[n], code_phases[n],
+        carr_freqs[n], carr_phases[n], codes[n], defaults.sampling_freq)
+      self.assert_close([c[n] for c in corrs], reference,
+                        np.sum(np.abs(self.samples[sample_index:
+                                                   sample_index + 16368])))
+
+  def test_block(self):
+    # Consecutive periods, as from calls with the returned phases.
+    code = padded_code(PRN)
+    code_freq = defaults.chipping_rate * (1 + DOPPLER / 1.57542e9)
+    carr_freq = defaults.IF + DOPPLER
+    references = run(reference_correlate, self.samples, 6, 0.1, 0.2)
+    corrs = track_correlate_block(self.samples, code_freq, 0.1, carr_freq, 0.2,
+                                  code, defaults.sampling_freq, 6)
+    for n, reference in enumerate(references):
+      self.assert_close(
+        [c[n] for c in corrs],
+        (reference['corrs'][0], reference['corrs'][1], reference['corrs'][2],
+         reference['blksize'], reference['code_phase'],
+         reference['carr_phase']),
+        reference['amplitude'])
+
+  @unittest.skipIf(swiftnav is None, "swiftnav is not installed")
+  def test_swiftnav(self):
+    reference = run(swiftnav.correlate.track_correlate, self.samples, 6, 0.1,
+                    0.2)
+    results = run(track_correlate, self.samples, 6, 0.1, 0.2)
+    np.testing.assert_array_equal(results['blksize'], reference['blksize'])
+    for field in ('corrs', 'code_phase', 'carr_phase'):
+      np.testing.assert_allclose(results[field], reference[field], rtol=0,
+                                 atol=1e-6 * reference['amplitude'].max(),
+                                 err_msg=field)
+
+
+class TestLUTCorrelator(unittest.TestCase):
+
+  def assert_matches(self, results, reference, carrier_steps):
+    # The phases handed to the next period are computed as by the reference
+    # so they don't drift however long the run.
+    np.testing.assert_array_equal(results['blksize'], reference['blksize'])
+    np.testing.assert_allclose(results['code_phase'],
+                               reference['code_phase'], rtol=0, atol=1e-9)
+    np.testing.assert_allclose(results['carr_phase'],
+                               reference['carr_phase'], rtol=0, atol=1e-9)
+    # The same chips are selected, so the only error is from quantizing the
+    # carrier phase, at most pi/N of each sample's magnitude.
+    error = np.abs(results['corrs'] - reference['corrs']).max(axis=1)
+    bound = np.pi / carrier_steps * reference['amplitude']
+    self.assertTrue(np.all(error <= bound),
+                    "Largest error %.3g of the bound" % (error / bound).max())
+
+  def test_long_run(self):
+    # A second of code periods, the carrier phase wraps millions of times
+    # and the NCOs are restarted from the returned phases each period.
+    n_periods = 1000
+    samples = synthetic_samples((n_periods + 2) * 16368,
+                                [(PRN, 0.0, DOPPLER)], noise_std=1.0)
+    reference = run(track_correlate, samples, n_periods)
+    for carrier_steps in (16, 64):
+      results = run(LUTCorrelator(carrier_steps), samples, n_periods)
+      self.assert_matches(results, reference, carrier_steps)
+      # The loss in power is about (pi/N)**2/3.
+      P, P_ref = results['corrs'][:, 1], reference['corrs'][:, 1]
+      loss = 1 - np.mean(np.abs(P) ** 2) / np.mean(np.abs(P_ref) ** 2)
+      np.testing.assert_allclose(loss, (np.pi / carrier_steps) ** 2 / 3,
+                                 rtol=0.2)
+
+  def test_phase_wrap(self):
+    # Phases just below a wrap of the carrier and of the code, and a
+    # negative carrier frequency so the carrier NCO counts down.
+    samples = synthetic_samples(6 * 16368, [(PRN, 0.0, DOPPLER)],
+                                noise_std=1.0)
+    for code_phase, carr_phase, doppler in [
+        (0.0, 2 * np.pi - 1e-12, DOPPLER),
+        (1e-9, 0.0, DOPPLER),
+        (0.5 - 1e-9, np.pi, -defaults.IF - DOPPLER),
+        (0.3, 1e-12, -defaults.IF + 10.0)]:
+      reference = run(track_correlate, samples, 4, code_phase, carr_phase,
+                      doppler)
+      results = run(LUTCorrelator(64), samples, 4, code_phase, carr_phase,
+                    doppler)
+      self.assert_matches(results, reference, 64)
+
+  @unittest.skipIf(swiftnav is None, "swiftnav is not installed")
+  def test_swiftnav(self):
+    n_periods = 200
+    samples = synthetic_samples((n_periods + 2) * 16368,
+                                [(PRN, 0.0, DOPPLER)], noise_std=1.0)
+    reference = run(swiftnav.correlate.track_correlate, samples, n_periods)
+    self.assert_matches(run(LUTCorrelator(64), samples, n_periods),
+                        reference, 64)
+
+  def test_zero_carrier(self):
+    # A carrier frequency of zero doesn't advance the carrier NCO. At the
+    # centre of a carrier phase step the replica is exact.
+    samples = synthetic_samples(2 * 16368, [(PRN, 0.0, 0.0)], noise_std=1.0)
+    carr_phase = 2.5 * 2 * np.pi / 64
+    args = (samples, defaults.chipping_rate, 0.0, 0.0, carr_phase,
+            padded_code(PRN), defaults.sampling_freq)
+    results = LUTCorrelator(64)(*args)
+    reference = reference_correlate(*args)
+    self.assertEqual(results[3:], reference[3:])
+    np.testing.assert_allclose(results[:3], reference[:3], rtol=1e-9)
+
+  def test_low_sampling_freq(self):
+    # With fewer than two samples per chip some half chips have no samples.
+    # Sampling frequencies that aren't simple multiples of the chipping rate
+    # keep the samples off the half chip boundaries, where the reference's
+    # floating point code phase may round the other way.
+    samples = synthetic_samples(3000, [(PRN, 0.0, 0.0)], noise_std=1.0)
+    carr_phase = 2.5 * 2 * np.pi / 64
+    for sampling_freq in (1.5e6 + 123.4, 2.2e6 + 123.4):
+      args = (samples, defaults.chipping_rate, 0.3123457, 0.0, carr_phase,
+              padded_code(PRN), sampling_freq)
+      results = LUTCorrelator(64)(*args)
+      reference = reference_correlate(*args)
+      self.assertEqual(results[3], reference[3])
+      np.testing.assert_allclose(results[:3], reference[:3], rtol=1e-9)
+
+  def test_carrier_steps(self):
+    with self.assertRaises(ValueError):
+      LUTCorrelator(100)
+
+
+if __name__ == '__main__':
+  unittest.main()
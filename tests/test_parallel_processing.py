@@ -0,0 +1,224 @@
+import cPickle
+import errno
+import os
+import unittest
+
+import numpy as np
+
+import peregrine.parallel_processing as pp
+
+
+def worker_pid(x):
+  return os.getpid()
+
+
+def fail(x):
+  raise ValueError(x)
+
+
+def report_progress(x, q_progress):
+  # Reports a task as progress in two increments.
+  q_progress.put(0.5)
+  q_progress.put(0.5)
+  return -x
+
+
+class CountedPickles(object):
+  # A picklable function that counts how many times it has been pickled.
+  pickled = 0
+
+  def __call__(self, x):
+    return -x
+
+  def __reduce__(self):
+    CountedPickles.pickled += 1
+    return CountedPickles, ()
+
+
+def is_running(pid):
+  try:
+    os.kill(pid, 0)
+  except OSError as e:
+    if e.errno == errno.ESRCH:
+      return False
+    raise
+  return True
+
+
+class TestWorkerPool(unittest.TestCase):
+
+  def setUp(self):
+    self.pool = pp.WorkerPool(2)
+
+  def tearDown(self):
+    self.pool.terminate()
+
+  def test_map(self):
+    self.assertEqual(self.pool.map(abs, range(-5, 5), chunksize=3),
+                     map(abs, range(-5, 5)))
+    self.assertEqual(self.pool.map(lambda x: 2 * x, range(10)),
+                     range(0, 20, 2))
+
+  def test_reuse(self):
+    # Workers are kept between calls with a picklable function.
+    pids = set(self.pool.map(worker_pid, range(20)))
+    procs = list(self.pool.procs)
+    worker_pids = set(p.pid for p in procs)
+    self.assertLessEqual(pids, worker_pids)
+    self.assertLessEqual(set(self.pool.map(worker_pid, range(20))),
+                         worker_pids)
+    self.assertEqual(self.pool.procs, procs)
+    self.assertTrue(all(is_running(pid) for pid in worker_pids))
+
+  def test_pickled_once(self):
+    # The function is pickled once per call, not for each task.
+    CountedPickles.pickled = 0
+    f = CountedPickles()
+    for n in (1, 2):
+      self.assertEqual(self.pool.map(f, range(10)), [-x for x in range(10)])
+      self.assertEqual(CountedPickles.pickled, n)
+
+  def test_closure_workers_stopped(self):
+    # Workers forked with a closure inherit the data it captures, they must
+    # not outlive the call.
+    data = np.ones(1 << 20)
+    for _ in range(2):
+      pids = set(self.pool.map(lambda x: (data[x], os.getpid())[1],
+                               range(20)))
+      self.assertEqual(self.pool.procs, [])
+      self.assertFalse(any(is_running(pid) for pid in pids))
+    self.assertEqual(pp.mp.active_children(), [])
+
+  def test_closure_after_reuse(self):
+    pids = set(self.pool.map(worker_pid, range(10)))
+    closure_pids = set(self.pool.map(lambda x: os.getpid(), range(10)))
+    self.assertFalse(pids & closure_pids)
+    self.assertFalse(any(is_running(pid) for pid in pids | closure_pids))
+
+  def test_abandoned(self):
+    it = self.pool.imap(worker_pid, range(10))
+    pid = next(it)
+    it.close()
+    self.assertEqual(self.pool.procs, [])
+    self.assertFalse(is_running(pid))
+    self.assertEqual(self.pool.map(abs, [-1, -2]), [1, 2])
+
+  def test_error(self):
+    with self.assertRaises(pp.WorkerError) as cm:
+      self.pool.map(fail, range(3))
+    self.assertIn('ValueError', str(cm.exception))
+    self.assertEqual(self.pool.procs, [])
+
+  def test_chains(self):
+    def step(x):
+      return x + 1 >= 5, x + 1
+    self.assertEqual(self.pool.chains(step, [0, 3, 4]), [5, 5, 5])
+    self.assertEqual(self.pool.procs, [])
+
+  def assert_progress(self, updates, total):
+    progress = [p for p, n in updates]
+    self.assertTrue(all(n == total for p, n in updates))
+    self.assertEqual(progress, sorted(progress))
+    self.assertEqual(progress[-1], total)
+
+  def test_progress(self):
+    # Results are collected as they arrive, in the order of `X`, and progress
+    # is reported with each result.
+    updates = []
+    X = range(12)
+    self.assertEqual(self.pool.map(abs, X, chunksize=2,
+                                   progress_callback=lambda *a:
+                                   updates.append(a)),
+                     map(abs, X))
+    self.assertEqual(len(updates), len(X))
+    self.assert_progress(updates, len(X))
+
+  def test_func_progress(self):
+    updates = []
+    X = range(12)
+    self.assertEqual(self.pool.map(report_progress, X, func_progress=True,
+                                   progress_callback=lambda *a:
+                                   updates.append(a)),
+                     [-x for x in X])
+    self.assertEqual(len(updates), 2 * len(X) + len(X))
+    self.assert_progress(updates, len(X))
+
+  def test_chains_progress(self):
+    def step(x):
+      return x + 1 >= 5, x + 1
+    updates = []
+    self.assertEqual(self.pool.chains(step, [0, 3, 4],
+                                      progress_callback=lambda *a:
+                                      updates.append(a)),
+                     [5, 5, 5])
+    self.assert_progress(updates, 3)
+
+  def test_chains_priority(self):
+    # With a single worker the ready chain with the greatest priority always
+    # runs next, as in this sequential loop over the chains.
+    def step((i, x)):
+      return x == 0, (i, x - 1)
+    def priority((i, x)):
+      return x
+    X = [(0, 2), (1, 5), (2, 3)]
+    states, ready, expected = list(X), range(len(X)), []
+    while ready:
+      ready.sort(key=lambda i: priority(states[i]), reverse=True)
+      i = ready.pop(0)
+      done, states[i] = step(states[i])
+      expected.append(i)
+      if not done:
+        ready.append(i)
+
+    pool = pp.WorkerPool(1)
+    try:
+      order = []
+      result = pool.chains(step, X, priority=priority,
+                           callback=lambda i, x: order.append(i))
+    finally:
+      pool.terminate()
+    self.assertEqual(result, states)
+    self.assertEqual(order, expected)
+
+class TestParmap(unittest.TestCase):
+
+  def tearDown(self):
+    pp.shutdown()
+
+  def test_parmap(self):
+    X = range(-10, 10)
+    self.assertEqual(pp.parmap(abs, X, nprocs=2, show_progress=False),
+                     map(abs, X))
+    offset = 3
+    self.assertEqual(pp.parmap(lambda x: x + offset, X, nprocs=2,
+                               show_progress=False),
+                     [x + offset for x in X])
+    self.assertEqual(pp.get_pool(2).procs, [])
+
+  def test_shared_array(self):
+    # Workers write into a SharedArray in place.
+    shared = pp.SharedArray((4, 8))
+    try:
+      def fill(n):
+        shared.array[n] = n
+      pp.parmap(fill, range(4), nprocs=2, show_progress=False)
+      np.testing.assert_array_equal(shared.array,
+                                    np.arange(4)[:, None] * np.ones(8))
+    finally:
+      shared.free()
+    self.assertFalse(os.path.exists(shared.filename))
+
+  def test_shared_array_pickle(self):
+    # A pickled SharedArray attaches to the same memory.
+    shared = pp.SharedArray((3,), dtype=np.int32)
+    try:
+      attached = cPickle.loads(cPickle.dumps(shared, cPickle.HIGHEST_PROTOCOL))
+      attached.array[:] = [1, 2, 3]
+      np.testing.assert_array_equal(shared.array, [1, 2, 3])
+      self.assertEqual(attached.array.dtype, np.int32)
+    finally:
+      shared.free()
+
+
+if __name__ == '__main__':
+  unittest.main()
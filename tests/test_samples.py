@@ -0,0 +1,206 @@
+import cPickle
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from peregrine.analysis.benchmark import sample_decoding
+from peregrine.samples import SampleFile, SampleStream, decode_samples
+from peregrine.samples import load_samples, save_samples
+
+
+def reference_decode(packed, file_format):
+  # Decode whole bytes as load_samples did before samples were decoded with
+  # lookup tables.
+  if file_format == 'int8':
+    return packed.view(np.int8)
+  if file_format == 'piksinew':
+    samples = np.empty(len(packed), dtype=np.int8)
+    samples[:] = (packed >> 6) - 1
+    return samples
+  if file_format == 'piksi':
+    samples = np.empty(len(packed) * 2, dtype=np.int8)
+    samples[::2] = (packed >> 5)
+    samples[1::2] = (packed >> 2) & 7
+    return (1-2*(samples>>2)) * (2*(samples&3)+1)
+  samples = 2 * np.unpackbits(packed).astype(np.int8) - 1
+  if file_format == '1bitrev':
+    samples = np.reshape(samples, (-1, 8))[:, ::-1].flatten()
+  return samples
+
+
+FORMATS = ['int8', 'piksinew', 'piksi', '1bit', '1bitrev']
+
+
+class SampleFileTestCase(unittest.TestCase):
+
+  def setUp(self):
+    # A file of 1001 random bytes in each format, with all the byte values.
+    self.tempdir = tempfile.mkdtemp()
+    rng = np.random.RandomState(0)
+    self.packed = np.concatenate((np.arange(256, dtype=np.uint8),
+                                  rng.randint(0, 256, 745).astype(np.uint8)))
+    self.filename = os.path.join(self.tempdir, 'samples.dat')
+    self.packed.tofile(self.filename)
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def reference(self, file_format):
+    return reference_decode(self.packed, file_format)
+
+
+class TestDecodeSamples(unittest.TestCase):
+
+  def setUp(self):
+    # Every byte value, then enough random bytes to decode in several chunks.
+    rng = np.random.RandomState(2)
+    self.packed = np.concatenate((np.arange(256, dtype=np.uint8),
+                                  rng.randint(0, 256, 3 * 2**16 + 5)
+                                  .astype(np.uint8)))
+
+  def test_formats(self):
+    for file_format in FORMATS:
+      reference = reference_decode(self.packed, file_format)
+      samples = decode_samples(self.packed, file_format)
+      self.assertEqual(samples.dtype, np.int8)
+      np.testing.assert_array_equal(samples, reference, err_msg=file_format)
+
+  def test_out(self):
+    # The samples are written to the buffer given.
+    for file_format in FORMATS:
+      reference = reference_decode(self.packed, file_format)
+      out = np.zeros(len(reference), dtype=np.int8)
+      samples = decode_samples(self.packed, file_format, out)
+      self.assertTrue(np.may_share_memory(samples, out))
+      np.testing.assert_array_equal(out, reference, err_msg=file_format)
+
+  def test_bad_out(self):
+    for out in [np.empty(2 * len(self.packed) - 1, dtype=np.int8),
+                np.empty(2 * len(self.packed), dtype=np.int16),
+                np.empty(4 * len(self.packed), dtype=np.int8)[::2]]:
+      with self.assertRaises(ValueError):
+        decode_samples(self.packed, 'piksi', out)
+
+  def test_1bit(self):
+    # The example of the load_samples docstring.
+    np.testing.assert_array_equal(
+      decode_samples(np.array([0x80, 0x55], dtype=np.uint8), '1bit'),
+      [1, -1, -1, -1, -1, -1, -1, -1, -1, 1, -1, 1, -1, 1, -1, 1])
+
+  def test_unknown_format(self):
+    with self.assertRaises(ValueError):
+      decode_samples(self.packed, 'int16')
+
+  def test_benchmark(self):
+    results = sample_decoding(n_bytes=2**12, repeat=1)
+    self.assertEqual(sorted(results), sorted(FORMATS[1:]))
+    for file_format, (mb_per_s, msamples_per_s) in results.items():
+      self.assertGreater(mb_per_s, 0)
+      self.assertGreater(msamples_per_s, 0)
+
+
+class TestSampleFile(SampleFileTestCase):
+
+  def test_slices(self):
+    # Slices decode only the bytes they need but give the same samples as
+    # slicing the whole file decoded.
+    for file_format in FORMATS:
+      reference = self.reference(file_format)[5:]
+      sample_file = SampleFile(self.filename, num_skip=5,
+                               file_format=file_format)
+      self.assertEqual(len(sample_file), len(reference))
+      for key in [slice(None), slice(0, 1), slice(3, 17), slice(7, 8),
+                  slice(-20, None), slice(10, 2000, 3), slice(None, None, -1),
+                  slice(50, 9, -4), slice(9, 50, -1),
+                  slice(len(reference) - 3, len(reference) + 10)]:
+        np.testing.assert_array_equal(sample_file[key], reference[key],
+                                      err_msg="%s %s" % (file_format, key))
+      for index in (0, 1, 7, -1, len(reference) - 9):
+        self.assertEqual(sample_file[index], reference[index])
+      with self.assertRaises(IndexError):
+        sample_file[len(reference)]
+
+  def test_read(self):
+    for file_format in FORMATS:
+      reference = self.reference(file_format)
+      sample_file = SampleFile(self.filename, num_samples=400,
+                               file_format=file_format)
+      out = np.zeros(100, dtype=np.int8)
+      for start, num_samples in [(0, 16), (1, 15), (8, 80), (395, 10)]:
+        expected = reference[start:min(start + num_samples, 400)]
+        np.testing.assert_array_equal(
+          sample_file.read(start, num_samples), expected)
+        samples = sample_file.read(start, num_samples, out)
+        np.testing.assert_array_equal(samples, expected)
+        # Samples are written to the start of the buffer.
+        np.testing.assert_array_equal(out[:len(expected)], expected)
+        self.assertTrue(np.may_share_memory(samples, out))
+
+  def test_pickle(self):
+    sample_file = SampleFile(self.filename, num_skip=3, file_format='piksi')
+    unpickled = cPickle.loads(cPickle.dumps(sample_file,
+                                            cPickle.HIGHEST_PROTOCOL))
+    np.testing.assert_array_equal(unpickled[:], sample_file[:])
+
+  def test_unknown_format(self):
+    with self.assertRaises(ValueError):
+      SampleFile(self.filename, file_format='int16')
+
+
+class TestLoadSamples(SampleFileTestCase):
+
+  def test_formats(self):
+    for file_format in FORMATS:
+      reference = self.reference(file_format)
+      np.testing.assert_array_equal(
+        load_samples(self.filename, file_format=file_format), reference)
+      for num_samples, num_skip in [(100, 0), (99, 3), (1, 1000)]:
+        np.testing.assert_array_equal(
+          load_samples(self.filename, num_samples, num_skip, file_format),
+          reference[num_skip:num_skip + num_samples])
+
+  def test_eof(self):
+    with self.assertRaises(EOFError):
+      load_samples(self.filename, 2003, 0, 'piksi')
+
+  def test_round_trip(self):
+    rng = np.random.RandomState(1)
+    values = {'int8': np.arange(-128, 128),
+              'piksi': [-7, -5, -3, -1, 1, 3, 5, 7],
+              '1bit': [-1, 1]}
+    for file_format, choices in values.items():
+      samples = rng.choice(choices, 4000).astype(np.int8)
+      save_samples(self.filename, samples, file_format)
+      np.testing.assert_array_equal(
+        load_samples(self.filename, file_format=file_format), samples)
+
+
+class TestSampleStream(SampleFileTestCase):
+
+  def test_blocks(self):
+    # The blocks are the same as slices of the whole file and any `overlap`
+    # consecutive samples are in one block.
+    for file_format in FORMATS:
+      reference = self.reference(file_format)[3:]
+      stream = SampleStream(self.filename, num_skip=3, file_format=file_format,
+                            block_size=64, overlap=24)
+      self.assertEqual(len(stream), len(reference))
+      for start in (0, 5, 130):
+        index = start - start % 8
+        for block_index, block in stream.blocks(start):
+          self.assertEqual(block_index, index)
+          np.testing.assert_array_equal(block,
+                                        reference[index:index + 64 + 24])
+          index += 64
+        self.assertGreaterEqual(index, len(reference))
+
+  def test_block_size(self):
+    with self.assertRaises(ValueError):
+      SampleStream(self.filename, file_format='int8', block_size=100)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,384 @@
+import cPickle
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from peregrine import defaults
+from peregrine.acquisition import AcquisitionResult
+from peregrine.include.generateCAcode import caCodes
+from peregrine.samples import SampleFile, SampleStream, load_samples
+from peregrine.samples import save_samples
+
+try:
+  import swiftnav.correlate
+  import swiftnav.track
+  import peregrine.tracking as tracking
+  import peregrine.correlator
+except ImportError:
+  swiftnav = None
+
+# (prn, code_phase, doppler) of the signals in the test samples.
+SIGNALS = [(1, 29.6875, -308.87), (14, 848.1875, 82.64), (23, 180.0, 2744.72)]
+MS_TO_TRACK = 400
+STAGE2 = dict(stage2_coherent_ms=5,
+              stage2_loop_filter_params=((1, 0.7, 1), (10, 0.7, 1), 200, 5,
+                                         1540))
+FIELDS = ['absolute_sample', 'code_phase', 'code_phase_acc', 'code_freq',
+          'carr_phase', 'carr_phase_acc', 'carr_freq', 'E', 'P', 'L', 'cn0',
+          'nav_msg_bit_phase_ref', 'tow', 'coherent_ms']
+
+
+def make_samples(n_samples, signals, noise_std=2.0, seed=0):
+  # 3-bit samples of C/A code signals modulated by random navigation bits.
+  rng = np.random.RandomState(seed)
+  t = np.arange(n_samples) / defaults.sampling_freq
+  signal = noise_std * rng.randn(n_samples)
+  for prn, code_phase, doppler in signals:
+    code_freq = defaults.chipping_rate * (1 + doppler / 1.57542e9)
+    chips = np.asarray(np.floor(t * code_freq - code_phase), dtype=np.int)
+    code = caCodes[prn][np.remainder(chips, len(caCodes[prn]))]
+    bits = rng.choice([-1, 1], chips.max() // 20460 + 2)
+    code *= bits[chips // 20460 + 1]
+    signal += code * np.cos(2 * np.pi * (defaults.IF + doppler) * t)
+  scale = 3.0 / noise_std
+  samples = 2 * np.floor(np.clip(signal * scale, -4, 3.999)) + 1
+  return samples.astype(np.int8)
+
+
+class RecordingHandler(logging.Handler):
+  # Keeps the log records it is given.
+  def __init__(self):
+    logging.Handler.__init__(self)
+    self.records = []
+
+  def emit(self, record):
+    self.records.append(record)
+
+
+@unittest.skipIf(swiftnav is None, "swiftnav is not installed")
+class TrackingTestCase(unittest.TestCase):
+
+  @classmethod
+  def setUpClass(cls):
+    cls.tempdir = tempfile.mkdtemp()
+    cls.samples_file = os.path.join(cls.tempdir, 'samples.dat')
+    n_samples = int((MS_TO_TRACK + 30) * 1e-3 * defaults.sampling_freq)
+    save_samples(cls.samples_file, make_samples(n_samples, SIGNALS), 'int8')
+
+  @classmethod
+  def tearDownClass(cls):
+    shutil.rmtree(cls.tempdir)
+
+  def samples(self):
+    return SampleFile(self.samples_file, file_format='int8')
+
+  def channels(self):
+    return [AcquisitionResult(prn, defaults.IF + doppler, doppler, code_phase,
+                              100.0, 'A')
+            for prn, code_phase, doppler in SIGNALS]
+
+  def track(self, **kwargs):
+    kwargs.setdefault('show_progress', False)
+    return tracking.track(self.samples(), self.channels(), MS_TO_TRACK,
+                          **kwargs)
+
+  def track_logged(self, **kwargs):
+    # Track, returning the results and the warnings logged.
+    handler = RecordingHandler()
+    tracking.logger.addHandler(handler)
+    try:
+      results = self.track(**kwargs)
+    finally:
+      tracking.logger.removeHandler(handler)
+    return results, [record.getMessage() for record in handler.records
+                     if record.levelno == logging.WARNING]
+
+  def assert_same_results(self, results, reference, rtol=0):
+    self.assertEqual(len(results), len(reference))
+    for r, ref in zip(results, reference):
+      self.assertEqual(r.prn, ref.prn)
+      self.assertEqual(r.status, ref.status)
+      for field in FIELDS:
+        np.testing.assert_allclose(getattr(r, field), getattr(ref, field),
+                                   rtol=rtol, atol=0, err_msg=field)
+
+
+class TestBlockMode(TrackingTestCase):
+
+  def test_stage2_switch(self):
+    # With one integration per block the NCO is updated as often as without
+    # blocks, so the results, including the switch to stage 2, are the same.
+    reference = self.track(multi=False,
+                           correlator=peregrine.correlator.track_correlate,
+                           **STAGE2)
+    self.assertTrue(any(np.any(r.coherent_ms == 5) for r in reference))
+    self.assert_same_results(self.track(multi=False, block_ms=1, **STAGE2),
+                             reference, rtol=1e-9)
+
+  def test_stage2_within_block(self):
+    # The rest of a block is dropped at the switch to stage 2, so every
+    # integration after it is a stage 2 integration.
+    for r in self.track(multi=False, block_ms=20, **STAGE2):
+      coherent_ms = np.asarray(r.coherent_ms)
+      switch = np.argmax(coherent_ms == 5)
+      self.assertTrue(np.all(coherent_ms[:switch] == 1))
+      self.assertTrue(np.all(coherent_ms[switch:] == 5))
+
+
+class TestCorrelators(TrackingTestCase):
+
+  def test_vector_correlator(self):
+    # All channels correlated in one call per code period track as each
+    # channel does on its own with the same correlator.
+    reference = self.track(multi=False,
+                           correlator=peregrine.correlator.track_correlate)
+    self.assert_same_results(
+      self.track(vector_correlator=peregrine.correlator.track_correlate_multi),
+      reference, rtol=1e-9)
+
+  def test_block_correlator(self):
+    reference = self.track(multi=False, block_ms=20,
+                           correlator=peregrine.correlator.track_correlate)
+    self.assert_same_results(
+      self.track(multi=False, block_ms=20,
+                 block_correlator=peregrine.correlator.track_correlate_block),
+      reference, rtol=1e-9)
+
+  def test_default_block_correlator(self):
+    # Block mode correlates the periods of a block in one call by default.
+    reference = self.track(
+      multi=False, block_ms=20,
+      block_correlator=peregrine.correlator.track_correlate_block)
+    self.assert_same_results(self.track(multi=False, block_ms=20), reference)
+
+
+class TestSampleSources(TrackingTestCase):
+
+  def test_stream(self):
+    # Tracking samples read a block at a time, or sliced from the file as
+    # they are needed, gives the same results as tracking the samples loaded
+    # into memory.
+    samples = load_samples(self.samples_file, file_format='int8')
+    reference = tracking.track(samples, self.channels(), MS_TO_TRACK,
+                               multi=False, show_progress=False)
+    self.assert_same_results(self.track(multi=False), reference)
+    for block_size, overlap in [(2**16, 2**15), (2**20, 2**17)]:
+      stream = SampleStream(self.samples_file, file_format='int8',
+                            block_size=block_size, overlap=overlap)
+      for kwargs in [dict(multi=False), dict(multi=True, segment_ms=50)]:
+        self.assert_same_results(
+          tracking.track(stream, self.channels(), MS_TO_TRACK,
+                         show_progress=False, **kwargs),
+          reference)
+
+
+class TestMultiProcess(TrackingTestCase):
+
+  def setUp(self):
+    self.results_file = os.path.join(self.tempdir, 'results.npy')
+
+  def tearDown(self):
+    if os.path.exists(self.results_file):
+      os.remove(self.results_file)
+
+  def test_shared_results(self):
+    # Workers write the results into shared memory, or into the results
+    # file, rather than pickling them back.
+    reference = self.track(multi=False)
+    self.assert_same_results(self.track(multi=True, segment_ms=None),
+                             reference)
+    results = self.track(multi=True, segment_ms=None,
+                         results_file=self.results_file)
+    self.assert_same_results(results, reference)
+    saved = np.load(self.results_file)
+    for n, r in enumerate(results):
+      for field in FIELDS:
+        np.testing.assert_array_equal(saved[field][n, :len(r.results)],
+                                      getattr(r, field))
+
+  def test_segments(self):
+    # Channels tracked in segments, resumed from the state pickled at the
+    # end of the previous one, give the same results as in a single call.
+    for kwargs in [{}, dict(block_ms=20, **STAGE2)]:
+      reference = self.track(multi=False, **kwargs)
+      self.assert_same_results(self.track(multi=True, segment_ms=50,
+                                          **kwargs),
+                               reference)
+
+  def test_unpicklable_state(self):
+    # Tracking states that can't be pickled can't be tracked in segments, each
+    # channel is tracked in a single task with a warning.
+    class LoopFilter(swiftnav.track.AidedTrackingLoop):
+      pass
+    reference = self.track(multi=False, loop_filter_class=LoopFilter)
+    results, warnings = self.track_logged(multi=True, segment_ms=50,
+                                          loop_filter_class=LoopFilter)
+    self.assert_same_results(results, reference)
+    self.assertEqual(len(warnings), 1)
+    self.assertIn("can't be pickled", warnings[0])
+
+
+class TestPrecision(TrackingTestCase):
+
+  def test_float32(self):
+    # Single precision only changes how the results are stored, the tracking
+    # itself is the same.
+    reference = self.track(multi=False)
+    results = self.track(multi=False, precision=np.float32)
+    dtype = tracking.track_results_dtype(np.float32)
+    self.assertEqual(len(results), len(reference))
+    for r, ref in zip(results, reference):
+      self.assertEqual(r.results.dtype, dtype)
+      for field in FIELDS:
+        np.testing.assert_array_equal(
+          getattr(r, field), getattr(ref, field).astype(dtype[field]),
+          err_msg=field)
+
+
+class Crash(Exception):
+  pass
+
+
+def crashing_correlator(n_calls):
+  # A correlator that fails after `n_calls` calls, interrupting tracking.
+  calls = [0]
+  def correlator(*args):
+    calls[0] += 1
+    if calls[0] > n_calls:
+      raise Crash()
+    return swiftnav.correlate.track_correlate(*args)
+  return correlator
+
+
+class TestCheckpoint(TrackingTestCase):
+
+  def setUp(self):
+    self.checkpoint_file = os.path.join(self.tempdir, 'checkpoint')
+    self.results_file = os.path.join(self.tempdir, 'results.npy')
+
+  def tearDown(self):
+    for filename in (self.checkpoint_file, self.results_file):
+      if os.path.exists(filename):
+        os.remove(filename)
+
+  def track_checkpointed(self, **kwargs):
+    return self.track(multi=False, checkpoint_file=self.checkpoint_file,
+                      results_file=self.results_file, checkpoint_ms=100,
+                      **kwargs)
+
+  def interrupt(self, **kwargs):
+    # Track the first channel past two checkpoints.
+    with self.assertRaises(Crash):
+      self.track_checkpointed(correlator=crashing_correlator(250), **kwargs)
+    self.assertTrue(os.path.exists(self.checkpoint_file))
+
+  def test_resume(self):
+    reference = self.track(multi=False)
+    self.interrupt()
+    self.assert_same_results(self.track_checkpointed(), reference)
+    self.assertFalse(os.path.exists(self.checkpoint_file))
+
+  def test_settings_changed(self):
+    # A checkpoint saved with other settings isn't resumed from.
+    reference = self.track(multi=False, block_ms=20)
+    self.interrupt()
+    self.assert_same_results(self.track_checkpointed(block_ms=20), reference)
+
+  def test_unpicklable_state(self):
+    # Tracking states that can't be pickled can't be checkpointed.
+    class LoopFilter(swiftnav.track.AidedTrackingLoop):
+      pass
+    with self.assertRaises(tracking.CheckpointError):
+      self.track_checkpointed(loop_filter_class=LoopFilter)
+    self.assertFalse(os.path.exists(self.checkpoint_file))
+
+  def test_unsegmented(self):
+    # Only segments of parallel tracking can be checkpointed.
+    with self.assertRaises(tracking.CheckpointError):
+      self.track(multi=True, segment_ms=None,
+                 checkpoint_file=self.checkpoint_file,
+                 results_file=self.results_file)
+    self.assertFalse(os.path.exists(self.checkpoint_file))
+
+
+class LegacyTrackResults:
+  # The TrackResults class of earlier releases, which pickled each result
+  # array as an attribute.
+  def __init__(self, n_points):
+    self.status = 'T'
+    self.prn = 14
+    for name in FIELDS:
+      setattr(self, name, np.arange(n_points, dtype=np.float64))
+    for name in ('E', 'P', 'L'):
+      setattr(self, name, np.arange(n_points) * (1 + 2j))
+    self.nav_msg = None
+    self.nav_bit_sync = tracking.NBSMatchBit()
+
+
+def make_track_results(n_points, prn):
+  tr = tracking.TrackResults(n_points)
+  tr.prn = prn
+  tr.status = 'T'
+  for n, name in enumerate(FIELDS):
+    getattr(tr, name)[:] = np.arange(n_points) + n
+  return tr
+
+
+@unittest.skipIf(swiftnav is None, "swiftnav is not installed")
+class TestTrackResultsFiles(unittest.TestCase):
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+    self.filename = os.path.join(self.tempdir, 'samples.dat.track_results')
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def test_round_trip(self):
+    track_results = [make_track_results(20, 3), make_track_results(15, 7)]
+    tracking.save_track_results(self.filename, track_results)
+    loaded = tracking.load_track_results(self.filename)
+    self.assertEqual([len(tr.results) for tr in loaded], [20, 15])
+    for tr, ref in zip(loaded, track_results):
+      self.assertEqual((tr.prn, tr.status), (ref.prn, ref.status))
+      np.testing.assert_array_equal(tr.results, ref.results)
+
+  def test_legacy(self):
+    # Pickle the old-style class under the name of the current one, as an
+    # earlier release saved it.
+    legacy = [LegacyTrackResults(10), LegacyTrackResults(10)]
+    current = tracking.TrackResults
+    LegacyTrackResults.__module__ = current.__module__
+    LegacyTrackResults.__name__ = 'TrackResults'
+    tracking.TrackResults = LegacyTrackResults
+    try:
+      with open(self.filename, 'wb') as f:
+        cPickle.dump(legacy, f, protocol=cPickle.HIGHEST_PROTOCOL)
+    finally:
+      tracking.TrackResults = current
+      LegacyTrackResults.__name__ = 'LegacyTrackResults'
+      LegacyTrackResults.__module__ = __name__
+
+    loaded = tracking.load_track_results(self.filename)
+    self.assertEqual(len(loaded), 2)
+    for tr, old in zip(loaded, legacy):
+      self.assertIsInstance(tr, tracking.TrackResults)
+      self.assertEqual((tr.prn, tr.status), (old.prn, old.status))
+      self.assertEqual(tr.results.dtype, tracking.track_results_dtype())
+      for name in FIELDS:
+        np.testing.assert_array_equal(getattr(tr, name), getattr(old, name),
+                                      err_msg=name)
+
+  def test_unknown_format(self):
+    with open(self.filename, 'wb') as f:
+      cPickle.dump({'not': 'track results'}, f)
+    with self.assertRaisesRegexp(ValueError, 're-run tracking'):
+      tracking.load_track_results(self.filename)
+
+
+if __name__ == '__main__':
+  unittest.main()